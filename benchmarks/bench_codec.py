@@ -0,0 +1,142 @@
+"""Client call throughput: per-call TypeAdapter and model serialization against the cached codecs.
+
+Starts a server on temporary paths and makes GET_PROCESS_ID calls the way `cli` (one socket, one call at
+a time) and `api` (one shared pipelined connection, many endpoint threads) make them.
+
+Usage: PYTHONPATH=src python benchmarks/bench_codec.py [--count N] [--threads N] [--mode threaded|event_loop]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from pydantic import TypeAdapter
+
+# `api` reads its settings on import
+os.environ.setdefault("SERVER_SOCKET_PATH_1", "/tmp/server_1.sock")
+os.environ.setdefault("SERVER_SOCKET_PATH_2", "/tmp/server_2.sock")
+
+import client
+from api import Server
+from client import build_request, connect, send, send_result
+from models.request import CallABC
+from models.response import ErrorResponse, GetProcessIdResponse, Response
+from utils.log import log
+from utils.messagging import EFraming, encode_message, get_one_message, send_message
+
+SERVER_SCRIPT = Path(__file__).resolve().parent.parent / "src" / "server.py"
+
+
+def legacy_send[T: Response](
+    s: Any, message: CallABC[Any], shutdown_event: threading.Event, expected_response: type[T]
+) -> T | ErrorResponse:
+    # `client.send` before the codecs
+    send_message(s, message)
+    raw = get_one_message(s, shutdown_event, log)
+    return TypeAdapter(expected_response | ErrorResponse).validate_json(raw)
+
+
+def legacy_encode_call(call: CallABC[Any], framing: EFraming = EFraming.JSON_LINES, *, id: int | None = None) -> bytes:
+    return encode_message(call.model_copy(update={"id": id}), framing)
+
+
+def legacy_decode_response[T: Response](raw: bytes, expected_response: type[T]) -> T | ErrorResponse:
+    return TypeAdapter(expected_response | ErrorResponse).validate_json(raw)
+
+
+@contextmanager
+def legacy_codecs() -> Iterator[None]:
+    # `Connection` as it encoded and decoded calls before the codecs
+    encode, decode = client.encode_call, client.decode_response
+    client.encode_call, client.decode_response = legacy_encode_call, legacy_decode_response  # type: ignore[assignment]
+    try:
+        yield
+    finally:
+        client.encode_call, client.decode_response = encode, decode
+
+
+@contextmanager
+def run_server(mode: str) -> Iterator[Path]:
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = Path(directory) / "server.sock"
+        env = os.environ | {
+            "SERVER_SOCKET_PATH": socket_path.as_posix(),
+            "LOCK_FILE_PATH": f"{directory}/server.lock",
+            "LOG_PIPE_PATH": f"{directory}/server.log",
+            "SERVER_MODE": mode,
+        }
+        process = subprocess.Popen([sys.executable, SERVER_SCRIPT], env=env, stdout=subprocess.DEVNULL)
+        try:
+            while not socket_path.exists():
+                time.sleep(0.05)
+            yield socket_path
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def bench_cli(socket_path: Path, count: int, call: Callable[[Any, threading.Event], Any]) -> float:
+    shutdown_event = threading.Event()
+    with connect(socket_path) as s:
+        started = time.perf_counter()
+        for _ in range(count):
+            call(s, shutdown_event)
+        return count / (time.perf_counter() - started)
+
+
+def bench_api(socket_path: Path, count: int, threads: int, call: Callable[[Server], Any]) -> float:
+    server = Server("bench", socket_path)
+    server.connect()
+    try:
+
+        def worker(n: int) -> None:
+            for _ in range(n):
+                call(server)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for _ in executor.map(worker, [count // threads] * threads):
+                pass
+        return count // threads * threads / (time.perf_counter() - started)
+    finally:
+        server.disconnect()
+
+
+def main(*, count: int, threads: int, mode: str) -> None:
+    message = build_request("pid", None, None)
+    cli_cases: list[tuple[str, Callable[[Any, threading.Event], Any]]] = [
+        ("legacy", lambda s, e: legacy_send(s, message, e, GetProcessIdResponse)),
+        ("codec", lambda s, e: send(s, message, e, GetProcessIdResponse)),
+        ("codec, raw result", lambda s, e: send_result(s, message, e)),
+    ]
+    api_cases: list[tuple[str, Callable[[Server], Any]]] = [
+        ("codec", lambda server: server.request(message, GetProcessIdResponse)),
+        ("codec, raw result", lambda server: server.request_result(message)),
+    ]
+    print(f"{'client':<8}{'path':<20}{'calls/s':>12}")
+    with run_server(mode) as socket_path:
+        for name, cli_call in cli_cases:
+            print(f"{'cli':<8}{name:<20}{bench_cli(socket_path, count, cli_call):>12,.0f}")
+        with legacy_codecs():
+            rate = bench_api(socket_path, count, threads, lambda server: server.request(message, GetProcessIdResponse))
+        print(f"{'api':<8}{'legacy':<20}{rate:>12,.0f}")
+        for name, api_call in api_cases:
+            print(f"{'api':<8}{name:<20}{bench_api(socket_path, count, threads, api_call):>12,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=5_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--mode", choices=["threaded", "event_loop"], default="event_loop")
+    ns = parser.parse_args()
+    main(count=ns.count, threads=ns.threads, mode=ns.mode)
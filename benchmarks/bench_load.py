@@ -0,0 +1,472 @@
+"""Load test: throughput and latency percentiles of every call under concurrent clients.
+
+Starts a server on temporary socket, lock and log pipe paths (with `--target api` also the API in front of it,
+under uvicorn on a temporary Unix socket) and drives every call with `--clients` concurrent clients, one
+connection each, for `--duration` seconds.
+
+Closed loop: every client makes its next call as soon as the previous one is answered, the throughput is what
+the server sustains. Open loop: calls are scheduled at a fixed `--rate` per second across the clients and the
+latency is measured from the scheduled start, so a server that falls behind shows up as latency instead of
+silently receiving fewer calls.
+
+Results can be saved with `--output` and compared with a previous run with `--compare`.
+
+Usage: PYTHONPATH=src python benchmarks/bench_load.py [--target socket|api] [--loop closed|open] [--rate N]
+       [--clients N] [--duration S] [--call TYPE ...] [--mode threaded|event_loop] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, NamedTuple, Protocol
+
+from client import Connection
+from models.request import (
+    Batch,
+    BatchCall,
+    CallABC,
+    CaptureMainMonitorRegion,
+    CaptureMainMonitorRegionCall,
+    ECallType,
+    GetCacheStatsCall,
+    GetLogStatsCall,
+    GetMainMonitorParamsCall,
+    GetMainMonitorPixelColor,
+    GetMainMonitorPixelColorCall,
+    GetMainMonitorPixelColors,
+    GetMainMonitorPixelColorsCall,
+    GetMetricsCall,
+    GetProcessIdCall,
+    GetThreadCountCall,
+    PingCall,
+)
+from models.response import CaptureMainMonitorRegionResponse, ErrorResponse
+from utils.codec import CallError
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+SERVER_SCRIPT = SRC / "server.py"
+# Seconds a call, or opening a connection, may take before it counts as an error
+CALL_TIMEOUT = 10
+
+REGION_SIZE = 64
+
+BATCH_CALL = BatchCall(
+    type=ECallType.BATCH,
+    params=Batch(
+        calls=[
+            GetProcessIdCall(type=ECallType.GET_PROCESS_ID, params=None),
+            GetThreadCountCall(type=ECallType.GET_THREAD_COUNT, params=None),
+            GetMainMonitorParamsCall(type=ECallType.GET_MAIN_MONITOR_PARAMS, params=None),
+        ]
+    ),
+)
+
+
+class Case(NamedTuple):
+    call: CallABC[Any]
+    # Followed by raw frames that are read to the end
+    streamed: bool = False
+    # (method, path, JSON body) of the API endpoint making the call, `None` when there is none
+    http: tuple[str, str, bytes | None] | None = None
+
+
+# Every call that is answered once; framing negotiation and frame subscriptions change the connection itself
+CASES: dict[ECallType, Case] = {
+    ECallType.GET_MAIN_MONITOR_PARAMS: Case(
+        GetMainMonitorParamsCall(type=ECallType.GET_MAIN_MONITOR_PARAMS, params=None),
+        http=("GET", "/monitor/params", None),
+    ),
+    ECallType.GET_MAIN_MONITOR_PIXEL_COLOR: Case(
+        GetMainMonitorPixelColorCall(
+            type=ECallType.GET_MAIN_MONITOR_PIXEL_COLOR, params=GetMainMonitorPixelColor(x=0, y=0)
+        ),
+        http=("GET", "/monitor/pixel?x=0&y=0", None),
+    ),
+    ECallType.GET_MAIN_MONITOR_PIXEL_COLORS: Case(
+        GetMainMonitorPixelColorsCall(
+            type=ECallType.GET_MAIN_MONITOR_PIXEL_COLORS, params=GetMainMonitorPixelColors(points=[(0, 0), (1, 1)])
+        ),
+        http=("POST", "/monitor/pixels", b'{"points": [[0, 0], [1, 1]]}'),
+    ),
+    ECallType.CAPTURE_MAIN_MONITOR_REGION: Case(
+        CaptureMainMonitorRegionCall(
+            type=ECallType.CAPTURE_MAIN_MONITOR_REGION,
+            params=CaptureMainMonitorRegion(x=0, y=0, width=REGION_SIZE, height=REGION_SIZE),
+        ),
+        streamed=True,
+        http=("GET", f"/monitor/region/1?x=0&y=0&width={REGION_SIZE}&height={REGION_SIZE}", None),
+    ),
+    ECallType.GET_PROCESS_ID: Case(
+        GetProcessIdCall(type=ECallType.GET_PROCESS_ID, params=None), http=("GET", "/proc/pid", None)
+    ),
+    ECallType.GET_THREAD_COUNT: Case(
+        GetThreadCountCall(type=ECallType.GET_THREAD_COUNT, params=None), http=("GET", "/proc/threads", None)
+    ),
+    ECallType.GET_CACHE_STATS: Case(
+        GetCacheStatsCall(type=ECallType.GET_CACHE_STATS, params=None), http=("GET", "/cache/1", None)
+    ),
+    ECallType.GET_LOG_STATS: Case(GetLogStatsCall(type=ECallType.GET_LOG_STATS, params=None)),
+    ECallType.GET_METRICS: Case(
+        GetMetricsCall(type=ECallType.GET_METRICS, params=None), http=("GET", "/metrics/1", None)
+    ),
+    ECallType.PING: Case(PingCall(type=ECallType.PING, params=None)),
+    # What three separate calls above fetch, in one round trip
+    ECallType.BATCH: Case(BATCH_CALL, http=("POST", "/batch/1", BATCH_CALL.params.model_dump_json().encode())),
+}
+
+
+class Client(Protocol):
+    def call(self, case: Case) -> bool:
+        """Make the call, False if it failed."""
+
+    def close(self) -> None: ...
+
+
+class SocketClient:
+    """One connection to the server, the way `api` talks to it."""
+
+    def __init__(self, socket_path: Path) -> None:
+        self._connection = Connection.open(socket_path, threading.Event(), timeout=CALL_TIMEOUT)
+
+    def call(self, case: Case) -> bool:
+        if case.streamed:
+            response, chunks = self._connection.stream(
+                case.call, CaptureMainMonitorRegionResponse, timeout=CALL_TIMEOUT
+            )
+            for _ in chunks:
+                pass
+            return not isinstance(response, ErrorResponse)
+        try:
+            self._connection.request_result(case.call, timeout=CALL_TIMEOUT)
+        except CallError:
+            return False
+        return True
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: Path) -> None:
+        super().__init__("localhost", timeout=CALL_TIMEOUT)
+        self._path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path.as_posix())
+
+
+class ApiClient:
+    """One keep-alive HTTP connection to the API."""
+
+    def __init__(self, socket_path: Path) -> None:
+        self._connection = _UnixHTTPConnection(socket_path)
+
+    def call(self, case: Case) -> bool:
+        assert case.http is not None
+        method, path, body = case.http
+        status, content = self._request(method, path, body)
+        if status >= 400:
+            return False
+        if not content.startswith(b'{"results":'):
+            return True
+        # Fanned out to the servers of a role: failed unless all of them responded with a success
+        return all(
+            result["response"] is not None and result["response"]["success"]
+            for result in json.loads(content)["results"]
+        )
+
+    def request(self, method: str, path: str, body: bytes | None = None) -> int:
+        return self._request(method, path, body)[0]
+
+    def _request(self, method: str, path: str, body: bytes | None) -> tuple[int, bytes]:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            self._connection.request(method, path, body, headers)
+            response = self._connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnects on the next request
+            self._connection.close()
+            raise
+        return response.status, content
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class Result(NamedTuple):
+    call: str
+    calls: int
+    errors: int
+    throughput: float
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+    p999_ms: float
+    max_ms: float
+
+
+@contextmanager
+def run_server(directory: Path, mode: str, clients: int) -> Iterator[Path]:
+    socket_path = directory / "server.sock"
+    pipe_path = directory / "server.pipe"
+    os.mkfifo(pipe_path)
+    # Stands in for the log server: the server blocks opening the pipe until it has a reader
+    drain = threading.Thread(target=_drain, args=(pipe_path,), daemon=True)
+    drain.start()
+    env = os.environ | {
+        "SERVER_SOCKET_PATH": socket_path.as_posix(),
+        "LOCK_FILE_PATH": (directory / "server.lock").as_posix(),
+        "LOG_PIPE_PATH": pipe_path.as_posix(),
+        "SERVER_MODE": mode,
+        # A threaded server serves every connection with a worker of its own, the default is cpu_count + 4
+        "SERVER_WORKERS": str(clients),
+    }
+    with _process([sys.executable, SERVER_SCRIPT], env, socket_path):
+        yield socket_path
+
+
+@contextmanager
+def run_api(directory: Path, server_socket_path: Path, clients: int) -> Iterator[Path]:
+    socket_path = directory / "api.sock"
+    # A single server with both roles, every call fanned out by the API reaches just that one
+    servers = [{"id": "1", "socket_path": server_socket_path.as_posix(), "roles": ["monitor", "proc"]}]
+    # As many connections to the server as it has workers, the clients' calls are all in flight at once
+    env = os.environ | {"SERVERS": json.dumps(servers), "SERVER_POOL_SIZE": str(clients)}
+    args = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "api:app",
+        "--app-dir",
+        SRC,
+        "--uds",
+        socket_path,
+        "--log-level",
+        "critical",
+    ]
+    with _process(args, env, socket_path):
+        api = ApiClient(socket_path)
+        try:
+            if api.request("POST", "/connect/1") >= 400:
+                raise RuntimeError("The API could not connect to the server")
+        finally:
+            api.close()
+        yield socket_path
+
+
+@contextmanager
+def _process(args: list[Any], env: dict[str, str], socket_path: Path) -> Iterator[None]:
+    process = subprocess.Popen(args, env=env, stdout=subprocess.DEVNULL)
+    try:
+        while not socket_path.exists():
+            if process.poll() is not None:
+                raise RuntimeError(f"{args[1]} exited with {process.returncode}")
+            time.sleep(0.05)
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _drain(pipe_path: Path) -> None:
+    with pipe_path.open("rb") as pipe:
+        while pipe.read(64 * 1024):
+            pass
+
+
+def drive(client: Client, case: Case, *, start: int, stop: int, period: int | None) -> tuple[list[int], int, int]:
+    """Call until `stop`: back to back, or every `period` ns from `start` on. Latencies in ns, errors, last end."""
+    latencies: list[int] = []
+    errors = 0
+    scheduled = start
+    now = time.perf_counter_ns()
+    while True:
+        if period is None:
+            scheduled = now
+        elif scheduled > now:
+            time.sleep((scheduled - now) / 1e9)
+        if scheduled >= stop:
+            return latencies, errors, now
+        try:
+            ok = client.call(case)
+        except (OSError, ValueError, http.client.HTTPException):
+            ok = False
+        now = time.perf_counter_ns()
+        latencies.append(now - scheduled)
+        errors += not ok
+        if period is not None:
+            scheduled += period
+
+
+def run_case(
+    clients: list[Client], call_type: ECallType, case: Case, *, duration: float, warmup: float, rate: float | None
+) -> Result:
+    # Clients are spread evenly over the period, together they make `rate` calls a second
+    period = round(len(clients) * 1e9 / rate) if rate else None
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+
+        def run(length: float) -> tuple[int, list[tuple[list[int], int, int]]]:
+            # Leaves the threads time to start, every client begins at the same moment
+            start = time.perf_counter_ns() + 10_000_000
+            stop = start + round(length * 1e9)
+            offsets = [index * (period or 0) // len(clients) for index in range(len(clients))]
+            futures = [
+                executor.submit(drive, client, case, start=start + offset, stop=stop, period=period)
+                for client, offset in zip(clients, offsets)
+            ]
+            return start, [future.result() for future in futures]
+
+        if warmup:
+            run(warmup)
+        start, runs = run(duration)
+    latencies = sorted(latency for run_latencies, _, _ in runs for latency in run_latencies)
+    errors = sum(run_errors for _, run_errors, _ in runs)
+    elapsed = (max(end for _, _, end in runs) - start) / 1e9
+    return Result(
+        call=call_type.value,
+        calls=len(latencies),
+        errors=errors,
+        throughput=len(latencies) / elapsed if elapsed > 0 else 0.0,
+        mean_ms=sum(latencies) / len(latencies) / 1e6 if latencies else 0.0,
+        p50_ms=_percentile(latencies, 0.5),
+        p99_ms=_percentile(latencies, 0.99),
+        p999_ms=_percentile(latencies, 0.999),
+        max_ms=latencies[-1] / 1e6 if latencies else 0.0,
+    )
+
+
+def _percentile(ordered: list[int], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)] / 1e6
+
+
+def print_results(results: list[Result], baseline: dict[str, dict[str, Any]] | None) -> None:
+    header = (
+        f"{'call':<32}{'calls':>9}{'errors':>8}{'calls/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'p999 ms':>9}{'max ms':>9}"
+    )
+    if baseline is not None:
+        header += f"{'calls/s Δ':>11}{'p99 Δ':>9}"
+    print(header)
+    for result in results:
+        line = (
+            f"{result.call:<32}{result.calls:>9,}{result.errors:>8,}{result.throughput:>11,.0f}"
+            f"{result.p50_ms:>9.3f}{result.p99_ms:>9.3f}{result.p999_ms:>9.3f}{result.max_ms:>9.3f}"
+        )
+        previous = baseline.get(result.call) if baseline is not None else None
+        if previous is not None:
+            line += f"{_change(result.throughput, previous['throughput']):>11}{_change(result.p99_ms, previous['p99_ms']):>9}"
+        print(line)
+
+
+def _change(value: float, previous: float) -> str:
+    return f"{(value - previous) / previous:+.1%}" if previous else "-"
+
+
+def main(
+    *,
+    target: str,
+    loop: str,
+    rate: float | None,
+    clients: int,
+    duration: float,
+    warmup: float,
+    call_types: list[ECallType],
+    mode: str,
+    output: Path | None,
+    compare: Path | None,
+) -> None:
+    if target == "api":
+        skipped = [call_type for call_type in call_types if CASES[call_type].http is None]
+        if skipped:
+            print(f"No API endpoint for {', '.join(skipped)}, skipped")
+        call_types = [call_type for call_type in call_types if CASES[call_type].http is not None]
+    baseline = None
+    if compare is not None:
+        baseline = {result["call"]: result for result in json.loads(compare.read_text())["results"]}
+    results: list[Result] = []
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        directory = Path(tmp)
+        socket_path = stack.enter_context(run_server(directory, mode, clients))
+        if target == "api":
+            socket_path = stack.enter_context(run_api(directory, socket_path, clients))
+        for call_type in call_types:
+            connected: list[Client] = []
+            try:
+                for _ in range(clients):
+                    connected.append(ApiClient(socket_path) if target == "api" else SocketClient(socket_path))
+                results.append(
+                    run_case(
+                        connected,
+                        call_type,
+                        CASES[call_type],
+                        duration=duration,
+                        warmup=warmup,
+                        rate=rate if loop == "open" else None,
+                    )
+                )
+            finally:
+                for client in connected:
+                    client.close()
+    print(
+        f"target={target} loop={loop} mode={mode} clients={clients} duration={duration}s"
+        + (f" rate={rate}/s" if loop == "open" else "")
+    )
+    print_results(results, baseline)
+    if output is not None:
+        report = {
+            "started_at": datetime.now().isoformat(),
+            "target": target,
+            "loop": loop,
+            "rate": rate if loop == "open" else None,
+            "mode": mode,
+            "clients": clients,
+            "duration": duration,
+            "results": [result._asdict() for result in results],
+        }
+        output.write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["socket", "api"], default="socket")
+    parser.add_argument("--loop", choices=["closed", "open"], default="closed")
+    parser.add_argument("--rate", type=float, default=1_000, help="calls per second of the open loop")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5, help="seconds per call")
+    parser.add_argument("--warmup", type=float, default=0.5, help="seconds per call before measuring")
+    parser.add_argument("--call", type=ECallType, action="append", choices=list(CASES), help="default: all")
+    parser.add_argument("--mode", choices=["threaded", "event_loop"], default="threaded")
+    parser.add_argument("--output", type=Path, help="save the results as JSON")
+    parser.add_argument("--compare", type=Path, help="JSON results of a previous run to compare with")
+    ns = parser.parse_args()
+    if ns.rate <= 0:
+        parser.error("--rate must be positive")
+    main(
+        target=ns.target,
+        loop=ns.loop,
+        rate=ns.rate,
+        clients=ns.clients,
+        duration=ns.duration,
+        warmup=ns.warmup,
+        call_types=ns.call or list(CASES),
+        mode=ns.mode,
+        output=ns.output,
+        compare=ns.compare,
+    )
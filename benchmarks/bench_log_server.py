@@ -0,0 +1,112 @@
+"""log_server ingestion throughput: the original readline loop against the poll-based `ingest`.
+
+Writers connect to the FIFO one after another (like restarted servers), each writes its share of the
+lines in 64KiB chunks; the time is measured until all of them have reached the log file.
+
+Usage: PYTHONPATH=src python benchmarks/bench_log_server.py [--lines N] [--writers N] [--fsync POLICY]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from time import sleep
+
+from consts import DEFAULT_LOG_FLUSH_BYTES, DEFAULT_LOG_FLUSH_INTERVAL
+from log_server import EFsyncPolicy, LogSource, ingest
+
+WRITE_CHUNK = 64 * 1024
+LINE = b"timestamp='2026-01-01T00:00:00.000000' level='INFO' message='Received message: b'{\"type\":\"pid\"}''\n"
+
+SOURCE_TAG = b"source='bench' "
+
+type TIngest = Callable[[Path, Path, threading.Event], None]
+
+
+def legacy_ingest(pipe_path: Path, log_file_path: Path, shutdown_event: threading.Event) -> None:
+    # The loop of `log_server.main` before `ingest`
+    with log_file_path.open("a") as log, pipe_path.open("r") as pipe:
+        while not shutdown_event.is_set():
+            line = pipe.readline()
+            if not line:
+                sleep(0.1)
+                continue
+            log.write(line)
+            log.flush()
+
+
+def poll_ingest(fsync: EFsyncPolicy) -> TIngest:
+    def run(pipe_path: Path, log_file_path: Path, shutdown_event: threading.Event) -> None:
+        wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_read, False)
+        stop = threading.Thread(target=lambda: (shutdown_event.wait(), os.write(wakeup_write, b"\0")))
+        stop.start()
+        try:
+            ingest(
+                [LogSource("bench", pipe_path)],
+                log_file_path,
+                shutdown_event,
+                wakeup_fd=wakeup_read,
+                flush_bytes=DEFAULT_LOG_FLUSH_BYTES,
+                flush_interval=DEFAULT_LOG_FLUSH_INTERVAL,
+                fsync=fsync,
+            )
+        finally:
+            stop.join()
+            os.close(wakeup_read)
+            os.close(wakeup_write)
+
+    return run
+
+
+def _run(run_ingest: TIngest, lines: int, writers: int, line_overhead: int) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        pipe_path = Path(directory) / "log.pipe"
+        log_file_path = Path(directory) / "log.txt"
+        os.mkfifo(pipe_path)
+        log_file_path.touch()
+        shutdown_event = threading.Event()
+        reader = threading.Thread(target=run_ingest, args=(pipe_path, log_file_path, shutdown_event))
+        reader.start()
+
+        per_writer = lines // writers
+        data = memoryview(LINE * per_writer)
+        expected = (len(data) + per_writer * line_overhead) * writers
+        started = time.perf_counter()
+        for _ in range(writers):
+            fd = os.open(pipe_path, os.O_WRONLY)
+            try:
+                for offset in range(0, len(data), WRITE_CHUNK):
+                    os.write(fd, data[offset : offset + WRITE_CHUNK])
+            finally:
+                os.close(fd)
+        while os.stat(log_file_path).st_size < expected:
+            sleep(0.001)
+        elapsed = time.perf_counter() - started
+
+        shutdown_event.set()
+        reader.join()
+        return per_writer * writers / elapsed
+
+
+def main(*, lines: int, writers: int, fsync: EFsyncPolicy) -> None:
+    print(f"{'ingest':<16}{'lines':>10}{'writers':>9}{'lines/s':>14}")
+    # The poll-based ingest prefixes every line with its source tag
+    cases: list[tuple[str, TIngest, int]] = [
+        ("legacy", legacy_ingest, 0),
+        (f"poll ({fsync})", poll_ingest(fsync), len(SOURCE_TAG)),
+    ]
+    for name, run_ingest, line_overhead in cases:
+        print(f"{name:<16}{lines:>10}{writers:>9}{_run(run_ingest, lines, writers, line_overhead):>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=500_000)
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--fsync", type=EFsyncPolicy, choices=list(EFsyncPolicy), default=EFsyncPolicy.NEVER)
+    ns = parser.parse_args()
+    main(lines=ns.lines, writers=ns.writers, fsync=ns.fsync)
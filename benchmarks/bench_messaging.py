@@ -0,0 +1,96 @@
+"""Receive path microbenchmark: the original `bytes` concatenation reader against `FrameReader`.
+
+Usage: PYTHONPATH=src python benchmarks/bench_messaging.py [--count N] [--size BYTES ...]
+"""
+
+import argparse
+import socket
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+
+from consts import MESSAGE_DELIMITER
+from utils.messagging import DELIMITER, EFrameType, EFraming, FrameReader, encode_frame
+
+WRITE_CHUNK = 64 * 1024
+
+
+def legacy_get_messages(s: socket.socket, *, read_bytes: int = 1024) -> Iterator[bytes]:
+    # The receive loop `get_messages` used before FrameReader, without the shutdown polling
+    buffer = b""
+    while True:
+        data = s.recv(read_bytes)
+        if not data:
+            return
+        parts = data.split(MESSAGE_DELIMITER.encode())
+        if len(parts) == 1:
+            buffer += data
+            continue
+        for part in parts[:-1]:
+            buffer += part
+            yield buffer
+            buffer = b""
+        buffer = parts[-1]
+
+
+def frame_reader_messages(s: socket.socket, framing: EFraming) -> Iterator[bytes]:
+    reader = FrameReader(s, lambda _: None, framing=framing, max_message_size=1 << 30)
+    for frame in reader.frames(threading.Event()):
+        yield frame.body
+
+
+def _run(
+    receive: Callable[[socket.socket], Iterator[bytes]], payload: bytes, count: int, *, trace: bool
+) -> tuple[float, int]:
+    reader_sock, writer_sock = socket.socketpair()
+    stream = memoryview(payload * count)
+
+    def write() -> None:
+        with writer_sock:
+            for offset in range(0, len(stream), WRITE_CHUNK):
+                writer_sock.sendall(stream[offset : offset + WRITE_CHUNK])
+
+    writer = threading.Thread(target=write)
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    writer.start()
+    with reader_sock:
+        received = sum(1 for _ in receive(reader_sock))
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    writer.join()
+    assert received == count, f"received {received} of {count} messages"
+    return count / elapsed, peak
+
+
+def main(*, count: int, sizes: list[int]) -> None:
+    print(f"{'reader':<16}{'size':>10}{'msg/s':>14}{'peak alloc':>14}")
+    for size in sizes:
+        body = b"x" * size
+        line = body + DELIMITER
+        frame = encode_frame(EFrameType.MESSAGE, body)
+        # Keep the total volume comparable between small and large messages
+        n = max(1, min(count, count * 1024 // size))
+        cases: list[tuple[str, Callable[[socket.socket], Iterator[bytes]], bytes]] = [
+            ("legacy", legacy_get_messages, line),
+            ("json_lines", lambda s: frame_reader_messages(s, EFraming.JSON_LINES), line),
+            ("binary", lambda s: frame_reader_messages(s, EFraming.BINARY), frame),
+        ]
+        for name, receive, payload in cases:
+            # Timed separately since tracemalloc slows every allocation down
+            rate, _ = _run(receive, payload, n, trace=False)
+            _, peak = _run(receive, payload, n, trace=True)
+            print(f"{name:<16}{size:>10}{rate:>14,.0f}{peak:>14,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=50_000)
+    parser.add_argument("--size", type=int, nargs="+", default=[100, 4 * 1024, 1024 * 1024])
+    ns = parser.parse_args()
+    main(count=ns.count, sizes=ns.size)
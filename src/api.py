@@ -1,123 +1,472 @@
-import socket
+import asyncio
 import threading
-from contextlib import asynccontextmanager
+import time
+from collections.abc import AsyncIterator, Iterable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from enum import StrEnum
 from pathlib import Path
-from fastapi import Path as FastAPIPath
-from typing import Annotated, Any, AsyncIterator, Literal, Optional
+from typing import Annotated, Any
 
 from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi import Path as FastAPIPath
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings
-from starlette.responses import RedirectResponse
-
-from client import send
+from starlette.responses import RedirectResponse, StreamingResponse
+
+from client import (
+    DEFAULT_POOL_OPTIONS,
+    AsyncConnection,
+    AsyncConnectionPool,
+    Connection,
+    ConnectionPool,
+    PoolExhaustedError,
+    PoolOptions,
+)
+from models.common import EPixelFormat, HealthStats, PoolStats
 from models.request import (
+    Batch,
+    BatchCall,
     CallABC,
+    CaptureMainMonitorRegion,
+    CaptureMainMonitorRegionCall,
     ECallType,
-    GetProcessIdCall,
-    GetThreadCountCall,
+    GetCacheStatsCall,
     GetMainMonitorParamsCall,
-    GetMainMonitorPixelColorCall,
     GetMainMonitorPixelColor,
+    GetMainMonitorPixelColorCall,
+    GetMainMonitorPixelColors,
+    GetMainMonitorPixelColorsCall,
+    GetMetricsCall,
+    GetProcessIdCall,
+    GetThreadCountCall,
 )
 from models.response import (
+    BatchResponse,
+    CaptureMainMonitorRegionResponse,
+    ErrorResponse,
+    GetCacheStatsResponse,
     GetMainMonitorParamsResponse,
-    Response,
     GetMainMonitorPixelColorResponse,
+    GetMainMonitorPixelColorsResponse,
+    GetMetricsResponse,
     GetProcessIdResponse,
     GetThreadCountResponse,
+    Response,
 )
+from utils.health import DEFAULT_HEALTH_OPTIONS, CircuitBreaker, CircuitOpenError, HealthOptions
+
+
+class ERole(StrEnum):
+    # Main monitor params, pixels and regions
+    MONITOR = "monitor"
+    # Process id and thread count
+    PROC = "proc"
 
 
 class Server:
-    def __init__(self, name: str, socket_path: Path):
+    """A backend behind a pool of connections.
+
+    The endpoints go through the event loop pool (`aconnect`, `arequest`, ...), every waiting call is a
+    coroutine rather than a threadpool thread. The thread pool (`connect`, `request`, ...) serves callers that
+    run in threads of their own.
+
+    Once connected, the backend is probed in the background and reconnected with backoff when it goes down;
+    meanwhile calls fail fast with a 503.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        socket_path: Path,
+        pool_options: PoolOptions = DEFAULT_POOL_OPTIONS,
+        health_options: HealthOptions = DEFAULT_HEALTH_OPTIONS,
+        *,
+        id: str,
+        roles: frozenset[ERole],
+    ):
+        self.id = id
         self.name = name
+        self.roles = roles
         self._socket_path = socket_path
-        self._sock: Optional[socket.socket] = None
+        self._pool_options = pool_options
+        self._health_options = health_options
+        self._pool: ConnectionPool | None = None
+        self._apool: AsyncConnectionPool | None = None
+        self._breaker = CircuitBreaker(name, health_options)
+        self._watcher: asyncio.Task[None] | None = None
         self._shutdown_event = threading.Event()
 
     @property
     def connected(self) -> bool:
-        return self._sock is not None
+        return any(pool is not None and not pool.closed for pool in (self._pool, self._apool))
 
     @property
     def socket_path(self) -> Path:
         return self._socket_path
 
-    def request[T: Response](self, message: CallABC[Any], expected_response: type[T]) -> T:
-        if self._sock is None:
-            raise RuntimeError(f"{self.name} is not connected")
-        return send(self._sock, message, self._shutdown_event, expected_response)
+    def request[T: Response](self, message: CallABC[Any], expected_response: type[T]) -> T | ErrorResponse:
+        # Every call has a connection of its own for its duration, concurrent callers do not wait
+        # for each other until the pool runs out
+        with self._checkout() as connection:
+            return connection.request(message, expected_response)
+
+    def request_result(self, message: CallABC[Any]) -> Any:
+        with self._checkout() as connection:
+            return connection.request_result(message)
+
+    def stream[T: Response](
+        self, message: CallABC[Any], expected_response: type[T]
+    ) -> tuple[T | ErrorResponse, Iterator[bytes]]:
+        pool = self._connected(self._pool)
+        with self._guard():
+            connection = _checkout_from(pool)
+            try:
+                response, chunks = connection.stream(message, expected_response)
+            except BaseException:
+                pool.checkin(connection)
+                raise
+        if isinstance(response, ErrorResponse):
+            pool.checkin(connection)
+            return response, iter(())
+        # Held until the last chunk is read or the response is abandoned
+        return response, _checkin_after(chunks, pool, connection)
+
+    async def arequest[T: Response](self, message: CallABC[Any], expected_response: type[T]) -> T | ErrorResponse:
+        async with self._acheckout() as connection:
+            return await connection.request(message, expected_response)
+
+    async def arequest_result(self, message: CallABC[Any]) -> Any:
+        async with self._acheckout() as connection:
+            return await connection.request_result(message)
+
+    async def astream[T: Response](
+        self, message: CallABC[Any], expected_response: type[T]
+    ) -> tuple[T | ErrorResponse, AsyncIterator[bytes]]:
+        pool = self._connected(self._apool)
+        with self._guard():
+            connection = await _acheckout_from(pool)
+            try:
+                response, chunks = await connection.stream(message, expected_response)
+            except BaseException:
+                pool.checkin(connection)
+                raise
+        if isinstance(response, ErrorResponse):
+            pool.checkin(connection)
+            return response, _no_chunks()
+        return response, _acheckin_after(chunks, pool, connection)
+
+    def pool_stats(self) -> PoolStats | None:
+        pool = self._apool or self._pool
+        return pool.stats() if pool is not None else None
+
+    def health_stats(self) -> HealthStats | None:
+        return self._breaker.stats() if self.connected else None
 
     def connect(self) -> None:
+        """Without probes: while the backend is down the first call after the backoff tries to reconnect."""
+        self.disconnect()
+        pool = ConnectionPool(self._socket_path, self._shutdown_event, self._pool_options)
+        try:
+            pool.warm_up()
+        except BaseException:
+            pool.close()
+            raise
+        self._pool = pool
+        self._breaker = CircuitBreaker(self.name, self._health_options)
+
+    async def aconnect(self) -> None:
+        """Must be called on the event loop that makes the calls."""
         self.disconnect()
-        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        s.connect(self._socket_path.as_posix())
-        self._sock = s
+        pool = AsyncConnectionPool(self._socket_path, self._pool_options)
+        try:
+            await pool.warm_up()
+        except BaseException:
+            pool.close()
+            raise
+        self._apool = pool
+        self._breaker = CircuitBreaker(self.name, self._health_options)
+        self._watcher = asyncio.create_task(self._watch(pool, self._breaker), name=f"{self.name} health")
 
     def disconnect(self) -> None:
-        if self._sock is not None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        pools, self._pool, self._apool = (self._pool, self._apool), None, None
+        for pool in pools:
+            if pool is not None:
+                pool.close()
+
+    @staticmethod
+    async def _watch(pool: AsyncConnectionPool, breaker: CircuitBreaker) -> None:
+        """Ping the backend every probe interval; while it is down, try to reconnect when the backoff is over."""
+        while True:
+            await asyncio.sleep(breaker.next_probe_in())
+            started = time.perf_counter_ns()
+            try:
+                with breaker.guard():
+                    # Reopens the connections closed while the backend was down
+                    await pool.warm_up()
+                    async with pool.connection() as connection:
+                        await connection.ping(timeout=breaker.options.probe_timeout)
+                    breaker.record_probe(time.perf_counter_ns() - started)
+            except (OSError, EOFError, PoolExhaustedError):
+                # Recorded by the breaker; a call that got the reconnect attempt first, or all connections busy
+                continue
+
+    @contextmanager
+    def _guard(self) -> Iterator[None]:
+        try:
+            with self._breaker.guard():
+                yield
+        except CircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e)) from e
+        except (OSError, EOFError) as e:
+            raise HTTPException(status_code=503, detail=f"{self.name} is unavailable: {e}") from e
+
+    @contextmanager
+    def _checkout(self) -> Iterator[Connection]:
+        pool = self._connected(self._pool)
+        with self._guard():
+            connection = _checkout_from(pool)
             try:
-                self._sock.close()
+                yield connection
             finally:
-                self._sock = None
+                pool.checkin(connection)
 
+    @asynccontextmanager
+    async def _acheckout(self) -> AsyncIterator[AsyncConnection]:
+        pool = self._connected(self._apool)
+        with self._guard():
+            connection = await _acheckout_from(pool)
+            try:
+                yield connection
+            finally:
+                pool.checkin(connection)
 
-@asynccontextmanager
-async def lifespan(app_: FastAPI) -> AsyncIterator[None]:
-    print("Starting up Client...")
-    app_.state.server1 = Server("Server 1", client_settings.SERVER_SOCKET_PATH_1)
-    app_.state.server2 = Server("Server 2", client_settings.SERVER_SOCKET_PATH_2)
+    def _connected[P: ConnectionPool | AsyncConnectionPool](self, pool: P | None) -> P:
+        if pool is None:
+            raise RuntimeError(f"{self.name} is not connected")
+        return pool
+
+
+def _checkout_from(pool: ConnectionPool) -> Connection:
+    try:
+        return pool.checkout()
+    except PoolExhaustedError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+
+
+async def _acheckout_from(pool: AsyncConnectionPool) -> AsyncConnection:
+    try:
+        return await pool.checkout()
+    except PoolExhaustedError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+
+
+def _checkin_after(chunks: Iterator[bytes], pool: ConnectionPool, connection: Connection) -> Iterator[bytes]:
+    try:
+        yield from chunks
+    finally:
+        pool.checkin(connection)
+
+
+async def _acheckin_after(
+    chunks: AsyncIterator[bytes], pool: AsyncConnectionPool, connection: AsyncConnection
+) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        pool.checkin(connection)
+
+
+async def _no_chunks() -> AsyncIterator[bytes]:
+    return
     yield
-    print("Shutting down Client...")
 
 
-class ClientSettings(BaseSettings):
-    SERVER_SOCKET_PATH_1: Path
-    SERVER_SOCKET_PATH_2: Path
+class Registry:
+    """The configured servers by id, in the configured order."""
 
+    def __init__(self, servers: Iterable[Server]) -> None:
+        self._servers: dict[str, Server] = {}
+        for server in servers:
+            if server.id in self._servers:
+                raise ValueError(f"Duplicate server id {server.id!r}")
+            self._servers[server.id] = server
 
-client_settings = ClientSettings()
+    def __iter__(self) -> Iterator[Server]:
+        return iter(self._servers.values())
 
-type TServerId = Literal["1", "2"]
+    def get(self, server_id: str) -> Server | None:
+        return self._servers.get(server_id)
 
-app = FastAPI(title="OS Course Client API", lifespan=lifespan, version="1.0.0")
+    def with_role(self, role: ERole) -> list[Server]:
+        return [server for server in self._servers.values() if role in server.roles]
 
 
-def get_server_1(request: Request) -> Server:
-    return request.app.state.server1
+class ServerResult[T](BaseModel):
+    id: str
+    name: str
+    # The server's response, an error response included; None when there is none
+    response: T | ErrorResponse | None = None
+    # Why there is no response: not connected, down, too slow...
+    error: str | None = None
+    elapsed_ms: float
+
+
+class Gathered[T](BaseModel):
+    # In the configured order of the servers
+    results: list[ServerResult[T]]
+    # False if any server did not respond
+    complete: bool
+
+
+async def gather[T: Response](
+    servers: list[Server], message: CallABC[Any], expected_response: type[T], timeout: float
+) -> Gathered[T]:
+    """Make the call on all the servers in parallel, each one has `timeout` seconds to respond.
+
+    Takes as long as the slowest server, or `timeout`; the servers that did not respond are reported
+    with the reason instead of failing the whole call.
+    """
+    results = await asyncio.gather(*(_gather_one(server, message, expected_response, timeout) for server in servers))
+    return Gathered[T](results=results, complete=all(result.error is None for result in results))
+
+
+async def _gather_one[T: Response](
+    server: Server, message: CallABC[Any], expected_response: type[T], timeout: float
+) -> ServerResult[T]:
+    started = time.perf_counter()
+    response: T | ErrorResponse | None = None
+    error: str | None = None
+    try:
+        if not server.connected:
+            raise ConnectionError("not connected")
+        response = await asyncio.wait_for(server.arequest(message, expected_response), timeout)
+    except TimeoutError:
+        error = f"no response within {timeout}s"
+    except HTTPException as e:
+        error = str(e.detail)
+    # Not connected, connection failures and responses that do not decode
+    except (OSError, EOFError, RuntimeError, ValueError) as e:
+        error = _describe(e)
+    return ServerResult[T](
+        id=server.id,
+        name=server.name,
+        response=response,
+        error=error,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+    )
 
 
-def get_server_2(request: Request) -> Server:
-    return request.app.state.server2
+def _describe(error: Exception) -> str:
+    return str(error) or type(error).__name__
 
 
-def get_connected_server_1(
-    server_1: Annotated[Server, Depends(get_server_1)],
-) -> Server:
-    if not server_1.connected:
-        raise HTTPException(status_code=409, detail=f"Server {server_1.name} is not connected")
-    return server_1
+def _succeeded[T: Response](response: T | ErrorResponse) -> T:
+    """The server answered, but with an error: a bad gateway rather than a response of the wrong model."""
+    if isinstance(response, ErrorResponse):
+        raise HTTPException(status_code=502, detail=response.error)
+    return response
 
 
-def get_connected_server_2(
-    server_2: Annotated[Server, Depends(get_server_2)],
-) -> Server:
-    if not server_2.connected:
-        raise HTTPException(status_code=409, detail=f"Server {server_2.name} is not connected")
-    return server_2
+@asynccontextmanager
+async def lifespan(app_: FastAPI) -> AsyncIterator[None]:
+    print("Starting up Client...")
+    pool_options = PoolOptions(
+        size=client_settings.SERVER_POOL_SIZE,
+        min_idle=client_settings.SERVER_POOL_MIN_IDLE,
+        idle_timeout=client_settings.SERVER_POOL_IDLE_TIMEOUT,
+        checkout_timeout=client_settings.SERVER_POOL_CHECKOUT_TIMEOUT,
+    )
+    health_options = HealthOptions(
+        probe_interval=client_settings.SERVER_PROBE_INTERVAL,
+        probe_timeout=client_settings.SERVER_PROBE_TIMEOUT,
+        failure_threshold=client_settings.SERVER_FAILURE_THRESHOLD,
+        backoff_base=client_settings.SERVER_BACKOFF_BASE,
+        backoff_max=client_settings.SERVER_BACKOFF_MAX,
+    )
+    app_.state.registry = Registry(
+        Server(
+            backend.name or f"Server {backend.id}",
+            backend.socket_path,
+            pool_options,
+            health_options,
+            id=backend.id,
+            roles=frozenset(backend.roles),
+        )
+        for backend in client_settings.backends()
+    )
+    yield
+    for server in app_.state.registry:
+        server.disconnect()
+    print("Shutting down Client...")
+
+
+class BackendSettings(BaseModel):
+    id: str
+    socket_path: Path
+    roles: list[ERole]
+    # "Server <id>" by default
+    name: str | None = None
+
+
+class ClientSettings(BaseSettings):
+    # JSON list of `BackendSettings`, e.g. [{"id": "1", "socket_path": "/tmp/server_1.sock", "roles": ["monitor"]}]
+    SERVERS: list[BackendSettings] = []
+    # Without SERVERS: monitor server "1" and proc server "2"
+    SERVER_SOCKET_PATH_1: Path | None = None
+    SERVER_SOCKET_PATH_2: Path | None = None
+    # Connections per server, see `PoolOptions`
+    SERVER_POOL_SIZE: int = DEFAULT_POOL_OPTIONS.size
+    SERVER_POOL_MIN_IDLE: int = DEFAULT_POOL_OPTIONS.min_idle
+    SERVER_POOL_IDLE_TIMEOUT: float = DEFAULT_POOL_OPTIONS.idle_timeout
+    SERVER_POOL_CHECKOUT_TIMEOUT: float = DEFAULT_POOL_OPTIONS.checkout_timeout
+    # Health probes and reconnection, see `HealthOptions`
+    SERVER_PROBE_INTERVAL: float = DEFAULT_HEALTH_OPTIONS.probe_interval
+    SERVER_PROBE_TIMEOUT: float = DEFAULT_HEALTH_OPTIONS.probe_timeout
+    SERVER_FAILURE_THRESHOLD: int = DEFAULT_HEALTH_OPTIONS.failure_threshold
+    SERVER_BACKOFF_BASE: float = DEFAULT_HEALTH_OPTIONS.backoff_base
+    SERVER_BACKOFF_MAX: float = DEFAULT_HEALTH_OPTIONS.backoff_max
+    # Seconds every server has to answer its part of a call fanned out to a role, unless the call sets `timeout`
+    SERVER_GATHER_TIMEOUT: float = 2.0
+
+    def backends(self) -> list[BackendSettings]:
+        if self.SERVERS:
+            return self.SERVERS
+        backends = []
+        if self.SERVER_SOCKET_PATH_1 is not None:
+            backends.append(BackendSettings(id="1", socket_path=self.SERVER_SOCKET_PATH_1, roles=[ERole.MONITOR]))
+        if self.SERVER_SOCKET_PATH_2 is not None:
+            backends.append(BackendSettings(id="2", socket_path=self.SERVER_SOCKET_PATH_2, roles=[ERole.PROC]))
+        if not backends:
+            raise ValueError("No servers configured, set SERVERS or SERVER_SOCKET_PATH_1/SERVER_SOCKET_PATH_2")
+        return backends
+
+
+client_settings = ClientSettings()
+
+app = FastAPI(title="OS Course Client API", lifespan=lifespan, version="1.0.0")
 
 
-def get_server(
-    server_1: Annotated[Server, Depends(get_server_1)],
-    server_2: Annotated[Server, Depends(get_server_2)],
+async def get_registry(request: Request) -> Registry:
+    registry: Registry = request.app.state.registry
+    return registry
+
+
+async def get_server(
+    registry: Annotated[Registry, Depends(get_registry)],
     *,
-    server_id: Annotated[TServerId, FastAPIPath(description="1 or 2")],
+    server_id: Annotated[str, FastAPIPath(description="Id of a configured server")],
 ) -> Server:
-    return server_1 if server_id == "1" else server_2
+    server = registry.get(server_id)
+    if server is None:
+        raise HTTPException(status_code=404, detail=f"No server {server_id!r}")
+    return server
 
 
-def get_connected_server(
+async def get_connected_server(
     server: Annotated[Server, Depends(get_server)],
 ) -> Server:
     if not server.connected:
@@ -125,86 +474,226 @@ def get_connected_server(
     return server
 
 
+async def get_monitor_servers(registry: Annotated[Registry, Depends(get_registry)]) -> list[Server]:
+    return _with_role(registry, ERole.MONITOR)
+
+
+async def get_proc_servers(registry: Annotated[Registry, Depends(get_registry)]) -> list[Server]:
+    return _with_role(registry, ERole.PROC)
+
+
+def _with_role(registry: Registry, role: ERole) -> list[Server]:
+    servers = registry.with_role(role)
+    if not servers:
+        raise HTTPException(status_code=404, detail=f"No {role} servers configured")
+    return servers
+
+
+async def get_gather_timeout(
+    timeout: Annotated[float | None, Query(gt=0, description="Seconds every server has to answer")] = None,
+) -> float:
+    return timeout if timeout is not None else client_settings.SERVER_GATHER_TIMEOUT
+
+
 class Status(BaseModel):
+    id: str
     name: str
+    roles: list[ERole]
     socket_path: str
     connected: bool
+    pool: PoolStats | None = None
+    health: HealthStats | None = None
+    # Why connecting failed
+    error: str | None = None
+
+
+def _status(server: Server, error: str | None = None) -> Status:
+    return Status(
+        id=server.id,
+        name=server.name,
+        roles=sorted(server.roles),
+        socket_path=server.socket_path.as_posix(),
+        connected=server.connected,
+        pool=server.pool_stats(),
+        health=server.health_stats(),
+        error=error,
+    )
 
 
 @app.get("/servers", response_model=list[Status])
-def servers_status(
-    server_1: Annotated[Server, Depends(get_server_1)],
-    server_2: Annotated[Server, Depends(get_server_2)],
+async def servers_status(
+    registry: Annotated[Registry, Depends(get_registry)],
 ) -> list[Status]:
+    return [_status(server) for server in registry]
+
+
+@app.post("/connect")
+async def connect_servers(
+    registry: Annotated[Registry, Depends(get_registry)],
+) -> list[Status]:
+    """Connect all the servers at once, those that cannot be reached are reported with the error."""
+    errors = await asyncio.gather(*(server.aconnect() for server in registry), return_exceptions=True)
     return [
-        Status(name=server_1.name, socket_path=server_1.socket_path.as_posix(), connected=server_1.connected),
-        Status(name=server_1.name, socket_path=server_2.socket_path.as_posix(), connected=server_2.connected),
+        _status(server, _describe(error) if isinstance(error, Exception) else None)
+        for server, error in zip(registry, errors)
     ]
 
 
 @app.post("/connect/{server_id}")
-def connect_server(
+async def connect_server(
     server: Annotated[Server, Depends(get_server)],
 ) -> Status:
-    server.connect()
-    return Status(name=server.name, socket_path=server.socket_path.as_posix(), connected=True)
+    await server.aconnect()
+    return _status(server)
 
 
 @app.post("/disconnect/{server_id}")
-def disconnect_server(
+async def disconnect_server(
     server: Annotated[Server, Depends(get_connected_server)],
 ) -> Status:
     server.disconnect()
-    return Status(name=server.name, socket_path=server.socket_path.as_posix(), connected=False)
+    return _status(server)
+
+
+@app.get("/cache/{server_id}")
+async def server_cache_stats(
+    server: Annotated[Server, Depends(get_connected_server)],
+) -> GetCacheStatsResponse:
+    return _succeeded(
+        await server.arequest(GetCacheStatsCall(type=ECallType.GET_CACHE_STATS, params=None), GetCacheStatsResponse)
+    )
+
+
+@app.get("/metrics/{server_id}")
+async def server_metrics(
+    server: Annotated[Server, Depends(get_connected_server)],
+) -> GetMetricsResponse:
+    return _succeeded(
+        await server.arequest(GetMetricsCall(type=ECallType.GET_METRICS, params=None), GetMetricsResponse)
+    )
+
+
+@app.post("/batch/{server_id}")
+async def server_batch(
+    batch: Batch,
+    server: Annotated[Server, Depends(get_connected_server)],
+) -> BatchResponse:
+    """The calls run concurrently on the server, every one of them succeeds or fails on its own."""
+    return _succeeded(await server.arequest(BatchCall(type=ECallType.BATCH, params=batch), BatchResponse))
+
+
+@app.post("/batch")
+async def servers_batch(
+    batch: Batch,
+    registry: Annotated[Registry, Depends(get_registry)],
+    role: Annotated[ERole, Query(description="The batch is sent to every server with this role")],
+    timeout: Annotated[float, Depends(get_gather_timeout)],
+) -> Gathered[BatchResponse]:
+    return await gather(
+        _with_role(registry, role), BatchCall(type=ECallType.BATCH, params=batch), BatchResponse, timeout
+    )
 
 
-# Server 1 monitor endpoints
-@app.get("/server_1/monitor/params")
-def server1_monitor_params(
-    server: Annotated[Server, Depends(get_connected_server_1)],
-) -> GetMainMonitorParamsResponse:
-    return server.request(
+# Monitor endpoints, every call is fanned out to all the monitor servers
+@app.get("/monitor/params")
+async def monitor_params(
+    servers: Annotated[list[Server], Depends(get_monitor_servers)],
+    timeout: Annotated[float, Depends(get_gather_timeout)],
+) -> Gathered[GetMainMonitorParamsResponse]:
+    return await gather(
+        servers,
         GetMainMonitorParamsCall(type=ECallType.GET_MAIN_MONITOR_PARAMS, params=None),
         GetMainMonitorParamsResponse,
+        timeout,
     )
 
 
-@app.get("/server_1/monitor/pixel")
-def server1_monitor_pixel(
+@app.get("/monitor/pixel")
+async def monitor_pixel(
     x: Annotated[int, Query(..., description="X for pixel")],
     y: Annotated[int, Query(..., description="Y for pixel")],
-    server: Annotated[Server, Depends(get_connected_server_1)],
-) -> GetMainMonitorPixelColorResponse:
-    return server.request(
+    servers: Annotated[list[Server], Depends(get_monitor_servers)],
+    timeout: Annotated[float, Depends(get_gather_timeout)],
+) -> Gathered[GetMainMonitorPixelColorResponse]:
+    return await gather(
+        servers,
         GetMainMonitorPixelColorCall(
             type=ECallType.GET_MAIN_MONITOR_PIXEL_COLOR,
             params=GetMainMonitorPixelColor(x=x, y=y),
         ),
         GetMainMonitorPixelColorResponse,
+        timeout,
+    )
+
+
+@app.post("/monitor/pixels")
+async def monitor_pixels(
+    points: GetMainMonitorPixelColors,
+    servers: Annotated[list[Server], Depends(get_monitor_servers)],
+    timeout: Annotated[float, Depends(get_gather_timeout)],
+) -> Gathered[GetMainMonitorPixelColorsResponse]:
+    return await gather(
+        servers,
+        GetMainMonitorPixelColorsCall(type=ECallType.GET_MAIN_MONITOR_PIXEL_COLORS, params=points),
+        GetMainMonitorPixelColorsResponse,
+        timeout,
+    )
+
+
+# A stream of raw pixels, from a single server
+@app.get("/monitor/region/{server_id}", response_class=StreamingResponse)
+async def monitor_region(
+    x: Annotated[int, Query(..., description="Left edge of the region")],
+    y: Annotated[int, Query(..., description="Top edge of the region")],
+    width: Annotated[int, Query(..., gt=0)],
+    height: Annotated[int, Query(..., gt=0)],
+    server: Annotated[Server, Depends(get_connected_server)],
+    pixel_format: Annotated[EPixelFormat, Query()] = EPixelFormat.BGRA,
+) -> StreamingResponse:
+    if ERole.MONITOR not in server.roles:
+        raise HTTPException(status_code=404, detail=f"Server {server.name} is not a monitor server")
+    response, chunks = await server.astream(
+        CaptureMainMonitorRegionCall(
+            type=ECallType.CAPTURE_MAIN_MONITOR_REGION,
+            params=CaptureMainMonitorRegion(x=x, y=y, width=width, height=height, pixel_format=pixel_format),
+        ),
+        CaptureMainMonitorRegionResponse,
+    )
+    frame = _succeeded(response).result
+    # The raw pixels are passed through chunk by chunk as they arrive from the server
+    return StreamingResponse(
+        chunks,
+        media_type="application/octet-stream",
+        headers={
+            "Content-Length": str(frame.size),
+            "X-Frame-Width": str(frame.width),
+            "X-Frame-Height": str(frame.height),
+            "X-Pixel-Format": frame.pixel_format,
+        },
     )
 
 
-# Server 2 pid/proc endpoints
-@app.get("/server_2/pid")
-def server2_pid(
-    server: Annotated[Server, Depends(get_connected_server_2)],
-) -> GetProcessIdResponse:
-    return server.request(
-        GetProcessIdCall(type=ECallType.GET_PROCESS_ID, params=None),
-        GetProcessIdResponse,
+# Proc endpoints, every call is fanned out to all the proc servers
+@app.get("/proc/pid")
+async def proc_pid(
+    servers: Annotated[list[Server], Depends(get_proc_servers)],
+    timeout: Annotated[float, Depends(get_gather_timeout)],
+) -> Gathered[GetProcessIdResponse]:
+    return await gather(
+        servers, GetProcessIdCall(type=ECallType.GET_PROCESS_ID, params=None), GetProcessIdResponse, timeout
     )
 
 
-@app.get("/server_2/threads")
-def server2_threads(
-    server: Annotated[Server, Depends(get_connected_server_2)],
-) -> GetThreadCountResponse:
-    return server.request(
-        GetThreadCountCall(type=ECallType.GET_THREAD_COUNT, params=None),
-        GetThreadCountResponse,
+@app.get("/proc/threads")
+async def proc_threads(
+    servers: Annotated[list[Server], Depends(get_proc_servers)],
+    timeout: Annotated[float, Depends(get_gather_timeout)],
+) -> Gathered[GetThreadCountResponse]:
+    return await gather(
+        servers, GetThreadCountCall(type=ECallType.GET_THREAD_COUNT, params=None), GetThreadCountResponse, timeout
     )
 
 
 @app.get("/")
-def root() -> RedirectResponse:
+async def root() -> RedirectResponse:
     return RedirectResponse("/docs")
@@ -4,28 +4,41 @@ import signal
 import sys
 import threading
 import socket
+from collections.abc import Callable
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from types import FrameType
 import os
+import time
+from typing import Any
 
 from client import (
     WhatType,
     build_request,
+    ping as client_ping,
     resolve_sockets,
     send as client_send,
 )
+from models.request import CallABC
 from models.response import (
+    BatchResponse,
     GetMainMonitorParamsResponse,
     GetMainMonitorPixelColorResponse,
+    GetMainMonitorPixelColorsResponse,
     GetProcessIdResponse,
     GetThreadCountResponse,
     Response,
 )
+from utils.health import CircuitBreaker
 
-# Global shutdown flag and persistent connections registry
+# Global shutdown flag and persistent connections registry, a dropped connection is None until it is reopened
 _shutdown_event = threading.Event()
-_connections: dict[Path, socket.socket] = {}
+_connections: dict[Path, socket.socket | None] = {}
+# Per connection: health, a lock that keeps calls and probes from interleaving on the socket,
+# and the event that stops its health probes
+_breakers: dict[Path, CircuitBreaker] = {}
+_locks: dict[Path, threading.Lock] = {}
+_watchers: dict[Path, threading.Event] = {}
 
 
 def _setup_signal_handlers() -> None:
@@ -33,24 +46,99 @@ def _setup_signal_handlers() -> None:
         print(f"Received shutdown signal {signum}, exiting...")
         _shutdown_event.set()
         # Close all persistent connections gracefully
-        for p, s in list(_connections.items()):
-            try:
-                s.close()
-            except Exception:
-                pass
-            finally:
-                _connections.pop(p, None)
+        for p in list(_connections):
+            _forget(p)
         sys.exit(0)
 
     signal.signal(signal.SIGINT, shutdown)
     signal.signal(signal.SIGTERM, shutdown)
 
 
+def _open(sock_path: Path) -> socket.socket:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(sock_path.as_posix())
+    except BaseException:
+        s.close()
+        raise
+    return s
+
+
+def _drop(sock_path: Path) -> None:
+    s = _connections.get(sock_path)
+    if s is not None:
+        try:
+            s.close()
+        except Exception:
+            pass
+        _connections[sock_path] = None
+
+
+def _forget(sock_path: Path) -> None:
+    stop = _watchers.pop(sock_path, None)
+    if stop is not None:
+        stop.set()
+    lock = _locks.get(sock_path)
+    if lock is None:
+        return
+    with lock:
+        _drop(sock_path)
+        _connections.pop(sock_path, None)
+        _breakers.pop(sock_path, None)
+        _locks.pop(sock_path, None)
+
+
+def _register(sock_path: Path, s: socket.socket) -> None:
+    breaker = _breakers[sock_path] = CircuitBreaker(sock_path.as_posix())
+    _locks[sock_path] = threading.Lock()
+    _connections[sock_path] = s
+    stop = _watchers[sock_path] = threading.Event()
+    threading.Thread(target=_watch, args=(sock_path, breaker, stop), name=f"health {sock_path}", daemon=True).start()
+
+
+def _with_connection[T](sock_path: Path, call: Callable[[socket.socket], T]) -> T:
+    """Run `call` on the connection, reopening it first if it was dropped.
+
+    While the server is down CircuitOpenError is raised right away, except for the reconnect attempt once the
+    backoff is over; a connection that failed is dropped.
+    """
+    lock = _locks.get(sock_path)
+    breaker = _breakers.get(sock_path)
+    if lock is None or breaker is None:
+        raise ConnectionError("not connected")
+    with lock, breaker.guard():
+        if sock_path not in _connections:
+            raise ConnectionError("not connected")
+        s = _connections[sock_path]
+        if s is None:
+            s = _connections[sock_path] = _open(sock_path)
+        try:
+            return call(s)
+        except (OSError, EOFError):
+            _drop(sock_path)
+            raise
+
+
+def _watch(sock_path: Path, breaker: CircuitBreaker, stop: threading.Event) -> None:
+    """Ping the server every probe interval; while it is down, try to reconnect when the backoff is over."""
+    timeout = breaker.options.probe_timeout
+    while not stop.wait(breaker.next_probe_in()) and not _shutdown_event.is_set():
+        started = time.perf_counter_ns()
+        try:
+            _with_connection(sock_path, lambda s: client_ping(s, _shutdown_event, timeout=timeout))
+        except (OSError, EOFError):
+            # Recorded by the breaker
+            continue
+        breaker.record_probe(time.perf_counter_ns() - started)
+
+
 def _response_type_for(what: WhatType) -> type[Response]:
     if what == "monitor_params":
         return GetMainMonitorParamsResponse
     if what == "pixel":
         return GetMainMonitorPixelColorResponse
+    if what == "pixels":
+        return GetMainMonitorPixelColorsResponse
     if what == "pid":
         return GetProcessIdResponse
     if what == "threads":
@@ -59,7 +147,7 @@ def _response_type_for(what: WhatType) -> type[Response]:
 
 
 def _what_role(what: WhatType) -> str:
-    return "monitor" if what in ("monitor_params", "pixel") else "proc"
+    return "monitor" if what in ("monitor_params", "pixel", "pixels") else "proc"
 
 
 def _infer_role_for_socket(sock_path: Path) -> str | None:
@@ -145,15 +233,9 @@ def cmd_connect(argv: list[str]) -> None:
             if sock_path in _connections:
                 print(f"Already connected: {sock_path.as_posix()}")
                 return
-            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            s.connect(sock_path.as_posix())
-            _connections[sock_path] = s
+            _register(sock_path, _open(sock_path))
             print(f"Connected to {sock_path.as_posix()}")
         except Exception as e:
-            try:
-                s.close()  # type: ignore[name-defined]
-            except Exception:
-                pass
             print(f"Failed to connect to {sock_path}: {e}")
 
     with ThreadPoolExecutor(max_workers=len(targets) or None) as ex:
@@ -189,16 +271,10 @@ def cmd_disconnect(argv: list[str]) -> None:
         return
 
     def worker(sock_path: Path) -> None:
-        s = _connections.get(sock_path)
-        if not s:
+        if sock_path not in _connections:
             print(f"Not connected: {sock_path}")
             return
-        try:
-            s.close()
-        except Exception:
-            pass
-        finally:
-            _connections.pop(sock_path, None)
+        _forget(sock_path)
         print(f"Disconnected from {sock_path}")
 
     with ThreadPoolExecutor(max_workers=len(targets) or None) as ex:
@@ -210,56 +286,87 @@ def cmd_status(argv: list[str]) -> None:
     if not _connections:
         print("No active connections")
         return
-    for p, s in _connections.items():
+    for p, s in list(_connections.items()):
         role = _infer_role_for_socket(p) or "unknown"
-        print(f"{p.as_posix()} [role={role}] fd={s.fileno()}")
+        breaker = _breakers.get(p)
+        health = breaker.stats() if breaker is not None else None
+        line = f"{p.as_posix()} [role={role}] fd={s.fileno() if s is not None else '-'}"
+        if health is not None:
+            line += f" state={health.state}"
+            if health.retry_in is not None:
+                line += f" retry_in={health.retry_in:.1f}s last_error={health.last_error}"
+        print(line)
+
+
+def _parse_point(value: str) -> tuple[int, int]:
+    x, _, y = value.partition(",")
+    try:
+        return int(x), int(y)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected X,Y, got {value!r}")
 
 
 def cmd_get(argv: list[str]) -> None:
     parser = argparse.ArgumentParser(prog="get")
-    parser.add_argument("--what", required=True, choices=["monitor_params", "pixel", "pid", "threads"], type=str)
+    parser.add_argument(
+        "--what",
+        required=True,
+        choices=["monitor_params", "pixel", "pixels", "pid", "threads"],
+        type=str,
+        action="append",
+        help="may be repeated, several are sent to each server as one batch",
+    )
     parser.add_argument("--x", type=int)
     parser.add_argument("--y", type=int)
+    parser.add_argument("--point", type=_parse_point, action="append", help="X,Y for 'pixels', may be repeated")
     ns = parser.parse_args(argv)
 
-    what: WhatType = ns.what  # type: ignore[assignment]
+    whats: list[WhatType] = ns.what
     x: int | None = ns.x
     y: int | None = ns.y
+    points: list[tuple[int, int]] | None = ns.point
 
-    try:
-        request = build_request(what, x, y)
-    except Exception as e:
-        print(f"build_request error: {e}")
-        return
+    # Every role is asked for its own whats
+    by_role: dict[str, list[WhatType]] = {}
+    for what in dict.fromkeys(whats):
+        by_role.setdefault(_what_role(what), []).append(what)
 
-    resp_type = _response_type_for(what)
-    required_role = _what_role(what)
+    jobs: list[tuple[Path, CallABC[Any], type[Response], list[WhatType]]] = []
+    for required_role, role_whats in by_role.items():
+        try:
+            request = build_request(role_whats if len(role_whats) > 1 else role_whats[0], x, y, points=points)
+        except Exception as e:
+            print(f"build_request error: {e}")
+            return
+        resp_type = BatchResponse if len(role_whats) > 1 else _response_type_for(role_whats[0])
 
-    # Auto-select from connected sockets with matching role
-    targets: list[Path] = []
-    for p in _connections.keys():
-        role = _infer_role_for_socket(p)
-        if role == required_role:
-            targets.append(p)
-    if not targets:
-        hint = "connect 1" if required_role == "monitor" else "connect 2"
-        print(f"No connected {required_role} servers available. Use '{hint}' first.")
-        return
+        # Auto-select from connected sockets with matching role
+        targets: list[Path] = []
+        for p in _connections.keys():
+            role = _infer_role_for_socket(p)
+            if role == required_role:
+                targets.append(p)
+        if not targets:
+            hint = "connect 1" if required_role == "monitor" else "connect 2"
+            print(f"No connected {required_role} servers available. Use '{hint}' first.")
+            continue
+        jobs.extend((sock_path, request, resp_type, role_whats) for sock_path in targets)
 
-    def worker(sock_path: Path) -> None:
-        s = _connections.get(sock_path)
-        if not s:
-            print(f"[{sock_path}] -> error: not connected")
-            return
+    def worker(sock_path: Path, request: CallABC[Any], resp_type: type[Response], role_whats: list[WhatType]) -> None:
         try:
-            response = client_send(s, request, _shutdown_event, resp_type)
-            print(f"[{sock_path}] -> {response.model_dump_json(by_alias=True, exclude_none=True)}")
+            response = _with_connection(sock_path, lambda s: client_send(s, request, _shutdown_event, resp_type))
         except Exception as e:
             print(f"[{sock_path}] -> error: {e}")
+            return
+        if isinstance(response, BatchResponse):
+            for what, item in zip(role_whats, response.result):
+                print(f"[{sock_path}] {what} -> {item.model_dump_json(by_alias=True, exclude_none=True)}")
+        else:
+            print(f"[{sock_path}] -> {response.model_dump_json(by_alias=True, exclude_none=True)}")
 
-    with ThreadPoolExecutor(max_workers=len(targets) or None) as ex:
-        for sock in targets:
-            ex.submit(worker, sock)
+    with ThreadPoolExecutor(max_workers=len(jobs) or None) as ex:
+        for job in jobs:
+            ex.submit(worker, *job)
 
 
 def run_shell() -> None:
@@ -297,13 +404,8 @@ def run_shell() -> None:
         except Exception as e:
             print(f"Command error: {e}")
     # Cleanup on normal exit
-    for p, s in list(_connections.items()):
-        try:
-            s.close()
-        except Exception:
-            pass
-        finally:
-            _connections.pop(p, None)
+    for p in list(_connections):
+        _forget(p)
 
 
 if __name__ == "__main__":
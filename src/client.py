@@ -1,26 +1,53 @@
+import asyncio
+import collections
+import itertools
+import json
 import os
+import queue
+import select
 import socket
 import threading
-from collections.abc import Iterator
-from contextlib import contextmanager
+import time
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, Literal, NamedTuple, Protocol, Self
 
-from pydantic import TypeAdapter
-
-from consts import DEFAULT_SERVER_SOCKET
+from consts import DEFAULT_MAX_MESSAGE_SIZE, DEFAULT_SERVER_SOCKET
+from models.common import PoolStats
 from models.request import (
+    Batch,
+    BatchCall,
     CallABC,
     ECallType,
     GetMainMonitorParamsCall,
     GetMainMonitorPixelColor,
     GetMainMonitorPixelColorCall,
+    GetMainMonitorPixelColors,
+    GetMainMonitorPixelColorsCall,
     GetProcessIdCall,
     GetThreadCountCall,
+    NegotiateFraming,
+    NegotiateFramingCall,
+    PingCall,
+    TBatchedCall,
 )
-from models.response import ErrorResponse, Response
+from models.response import ErrorResponse, NegotiateFramingResponse, PingResponse, Response
+from utils.codec import decode_response, decode_result, encode_call
 from utils.log import log
-from utils.messagging import get_one_message, send_message
+from utils.messagging import (
+    DELIMITER,
+    FLAG_MORE,
+    SUPPORTED_FRAMINGS,
+    EFrameType,
+    EFraming,
+    Frame,
+    FrameReader,
+    get_one_message,
+    read_stream_frames,
+)
+from utils.metrics import Histogram
 
 
 def resolve_sockets(servers: list[Path] | None) -> list[Path]:
@@ -55,10 +82,23 @@ def connect(socket_path: Path) -> Iterator[socket.socket]:
         yield client
 
 
-WhatType = Literal["monitor_params", "pixel", "pid", "threads"]
+WhatType = Literal["monitor_params", "pixel", "pixels", "pid", "threads"]
 
 
-def build_request(what: WhatType, x: int | None, y: int | None) -> CallABC[Any]:
+def build_request(
+    what: WhatType | list[WhatType], x: int | None, y: int | None, *, points: list[tuple[int, int]] | None = None
+) -> CallABC[Any]:
+    """A list of `what`s is sent as one batch call, they share `x`, `y` and `points`."""
+    if isinstance(what, list):
+        return BatchCall(
+            type=ECallType.BATCH, params=Batch(calls=[_build_call(one, x, y, points=points) for one in what])
+        )
+    return _build_call(what, x, y, points=points)
+
+
+def _build_call(
+    what: WhatType, x: int | None, y: int | None, *, points: list[tuple[int, int]] | None = None
+) -> TBatchedCall:
     if what == "monitor_params":
         return GetMainMonitorParamsCall(type=ECallType.GET_MAIN_MONITOR_PARAMS, params=None)
     if what == "pixel":
@@ -68,6 +108,13 @@ def build_request(what: WhatType, x: int | None, y: int | None) -> CallABC[Any]:
             type=ECallType.GET_MAIN_MONITOR_PIXEL_COLOR,
             params=GetMainMonitorPixelColor(x=x, y=y),
         )
+    if what == "pixels":
+        if not points:
+            raise ValueError("at least one --point is required for 'pixels' request")
+        return GetMainMonitorPixelColorsCall(
+            type=ECallType.GET_MAIN_MONITOR_PIXEL_COLORS,
+            params=GetMainMonitorPixelColors(points=points),
+        )
     if what == "pid":
         return GetProcessIdCall(type=ECallType.GET_PROCESS_ID, params=None)
     if what == "threads":
@@ -78,6 +125,674 @@ def build_request(what: WhatType, x: int | None, y: int | None) -> CallABC[Any]:
 def send[T: Response](
     client: socket.socket, message: CallABC[Any], shutdown_event: threading.Event, expected_response: type[T]
 ) -> T | ErrorResponse:
-    send_message(client, message)
+    client.sendall(encode_call(message))
     raw = get_one_message(client, shutdown_event, log)
-    return TypeAdapter(expected_response | ErrorResponse).validate_json(raw)
+    return decode_response(raw, expected_response)
+
+
+def send_result(client: socket.socket, message: CallABC[Any], shutdown_event: threading.Event) -> Any:
+    """Like `send`, but returns only the plain JSON result and raises CallError if the call failed."""
+    client.sendall(encode_call(message))
+    return decode_result(get_one_message(client, shutdown_event, log))
+
+
+def ping(client: socket.socket, shutdown_event: threading.Event, *, timeout: float) -> None:
+    """Raises TimeoutError if the server does not answer within `timeout`, ConnectionError if it is gone."""
+    client.sendall(encode_call(PingCall(type=ECallType.PING, params=None)))
+    if not select.select([client], [], [], timeout)[0]:
+        raise TimeoutError(f"No answer to a ping within {timeout}s")
+    get_one_message(client, shutdown_event, log)
+
+
+def negotiate_framing(
+    client: socket.socket, shutdown_event: threading.Event, *, timeout: float | None = None
+) -> EFraming:
+    """Switch a fresh connection to the best framing the server supports.
+
+    Servers that predate the negotiation answer with an error and the connection stays on JSON lines. With a
+    `timeout`, raises TimeoutError if the server does not answer in time, e.g. a threaded server with all its
+    workers busy with other connections.
+    """
+    client.sendall(encode_call(_negotiate_framing_call()))
+    if timeout is not None and not select.select([client], [], [], timeout)[0]:
+        raise TimeoutError(f"No answer to the framing negotiation within {timeout}s")
+    return _negotiated_framing(get_one_message(client, shutdown_event, log))
+
+
+async def anegotiate_framing(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> EFraming:
+    """Event-loop counterpart of `negotiate_framing`."""
+    writer.write(encode_call(_negotiate_framing_call()))
+    await writer.drain()
+    return _negotiated_framing((await reader.readuntil(DELIMITER))[: -len(DELIMITER)])
+
+
+def _negotiate_framing_call() -> NegotiateFramingCall:
+    return NegotiateFramingCall(
+        type=ECallType.NEGOTIATE_FRAMING,
+        params=NegotiateFraming(framings=list(SUPPORTED_FRAMINGS)),
+    )
+
+
+def _negotiated_framing(raw: bytes) -> EFraming:
+    response = decode_response(raw, NegotiateFramingResponse)
+    if isinstance(response, ErrorResponse):
+        return EFraming.JSON_LINES
+    return EFraming(response.result)
+
+
+class Connection:
+    """A socket shared by many threads with any number of calls in flight.
+
+    Every call gets a fresh `id`; a reader thread matches responses back to the waiting callers by that id,
+    so responses may arrive in any order. Raw frames of streamed calls are routed the same way.
+    """
+
+    def __init__(
+        self, sock: socket.socket, shutdown_event: threading.Event, framing: EFraming = EFraming.JSON_LINES
+    ) -> None:
+        self._sock = sock
+        self._shutdown_event = shutdown_event
+        self._framing = framing
+        self._ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self._pending: dict[int, Future[bytes]] = {}
+        self._streams: dict[int, queue.SimpleQueue[bytes | Exception | None]] = {}
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_responses, name="connection-reader", daemon=True)
+        self._reader.start()
+
+    @classmethod
+    def open(
+        cls,
+        socket_path: Path,
+        shutdown_event: threading.Event,
+        *,
+        negotiate: bool = True,
+        timeout: float | None = None,
+    ) -> Self:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path.as_posix())
+            framing = negotiate_framing(sock, shutdown_event, timeout=timeout) if negotiate else EFraming.JSON_LINES
+        except Exception:
+            sock.close()
+            raise
+        return cls(sock, shutdown_event, framing)
+
+    @property
+    def framing(self) -> EFraming:
+        return self._framing
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def request[T: Response](
+        self, message: CallABC[Any], expected_response: type[T], *, timeout: float | None = None
+    ) -> T | ErrorResponse:
+        return decode_response(self._call(message, timeout=timeout), expected_response)
+
+    def request_result(self, message: CallABC[Any], *, timeout: float | None = None) -> Any:
+        """Only the plain JSON result of the call, skips building the response model; raises CallError on errors."""
+        return decode_result(self._call(message, timeout=timeout))
+
+    def ping(self, *, timeout: float) -> None:
+        """Raises TimeoutError if the server does not answer within `timeout`, ConnectionError if it is gone."""
+        self.request(PingCall(type=ECallType.PING, params=None), PingResponse, timeout=timeout)
+
+    def stream[T: Response](
+        self, message: CallABC[Any], expected_response: type[T], *, timeout: float | None = None
+    ) -> tuple[T | ErrorResponse, Iterator[bytes]]:
+        """Make a call whose response is followed by raw frames, the chunks are yielded as they arrive."""
+        if self._framing != EFraming.BINARY:
+            raise ConnectionError("Streamed calls require the binary framing")
+        chunks: queue.SimpleQueue[bytes | Exception | None] = queue.SimpleQueue()
+        raw = self._call(message, timeout=timeout, chunks=chunks)
+        return decode_response(raw, expected_response), _iter_chunks(chunks)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    def _call(
+        self,
+        message: CallABC[Any],
+        *,
+        timeout: float | None,
+        chunks: queue.SimpleQueue[bytes | Exception | None] | None = None,
+    ) -> bytes:
+        request_id = next(self._ids)
+        data = encode_call(message, self._framing, id=request_id)
+        future: Future[bytes] = Future()
+        try:
+            with self._send_lock:
+                # Registered in send order: servers that do not echo ids answer in that order
+                self._pending[request_id] = future
+                if chunks is not None:
+                    self._streams[request_id] = chunks
+                if self._closed:
+                    raise ConnectionError("Connection is closed")
+                self._sock.sendall(data)
+            raw = future.result(timeout)
+        except BaseException:
+            self._streams.pop(request_id, None)
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+        return raw
+
+    def _read_responses(self) -> None:
+        # Not `log`: the reader reports every recv timeout, once a second on an idle connection
+        reader = FrameReader(self._sock, _ignore, framing=self._framing)
+        try:
+            for frame in reader.frames(self._shutdown_event):
+                if frame.type == EFrameType.RAW:
+                    self._read_chunk(frame)
+                    continue
+                # Binary frames carry the call id in the header, JSON lines have to be decoded to find it
+                request_id = frame.id if self._framing == EFraming.BINARY else json.loads(frame.body).get("id")
+                if request_id is None and self._pending:
+                    request_id = next(iter(self._pending))
+                future = self._pending.get(request_id)
+                if future is not None and not future.done():
+                    future.set_result(frame.body)
+                    if not frame.flags & FLAG_MORE:
+                        self._end_stream(request_id, None)
+                elif request_id in self._streams:
+                    # A second message for a streamed call: the server aborted the stream
+                    error = ErrorResponse.model_validate_json(frame.body).error
+                    self._end_stream(request_id, ConnectionError(error))
+                else:
+                    log(f"Dropping response for an unknown call: {frame.body!r}")
+        # Framing errors and responses that do not decode are ValueErrors
+        except (OSError, ValueError) as e:
+            # Not an error when the connection was closed on our side, the recv just fails
+            if not self._closed:
+                log(f"Client error: {e}")
+        finally:
+            self._closed = True
+            for future in list(self._pending.values()):
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed before a response was received"))
+            for request_id in list(self._streams):
+                self._end_stream(request_id, ConnectionError("Connection closed in the middle of a stream"))
+
+    def _read_chunk(self, frame: Frame) -> None:
+        chunks = self._streams.get(frame.id)
+        if chunks is None:
+            log(f"Dropping {len(frame.body)} raw bytes for an unknown call")
+            return
+        if frame.body:
+            chunks.put(frame.body)
+        if not frame.flags & FLAG_MORE:
+            self._end_stream(frame.id, None)
+
+    def _end_stream(self, request_id: int, end: Exception | None) -> None:
+        chunks = self._streams.pop(request_id, None)
+        if chunks is not None:
+            chunks.put(end)
+
+
+class AsyncConnection:
+    """Event-loop counterpart of `Connection` over `asyncio.open_unix_connection`.
+
+    Calls are matched back to their callers by id the same way, by a reader task instead of a thread, so any
+    number of coroutines share the connection without a thread each.
+    """
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, framing: EFraming = EFraming.JSON_LINES
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._framing = framing
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future[bytes]] = {}
+        self._streams: dict[int, asyncio.Queue[bytes | Exception | None]] = {}
+        self._closed = False
+        self._reader_task = asyncio.create_task(self._read_responses(), name="connection-reader")
+
+    @classmethod
+    async def open(cls, socket_path: Path, *, negotiate: bool = True, timeout: float | None = None) -> Self:
+        reader, writer = await asyncio.open_unix_connection(socket_path.as_posix(), limit=DEFAULT_MAX_MESSAGE_SIZE)
+        try:
+            framing = EFraming.JSON_LINES
+            if negotiate:
+                try:
+                    framing = await asyncio.wait_for(anegotiate_framing(reader, writer), timeout)
+                except TimeoutError as e:
+                    raise TimeoutError(f"No answer to the framing negotiation within {timeout}s") from e
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer, framing)
+
+    @property
+    def framing(self) -> EFraming:
+        return self._framing
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def request[T: Response](
+        self, message: CallABC[Any], expected_response: type[T], *, timeout: float | None = None
+    ) -> T | ErrorResponse:
+        return decode_response(await self._call(message, timeout=timeout), expected_response)
+
+    async def request_result(self, message: CallABC[Any], *, timeout: float | None = None) -> Any:
+        return decode_result(await self._call(message, timeout=timeout))
+
+    async def ping(self, *, timeout: float) -> None:
+        await self.request(PingCall(type=ECallType.PING, params=None), PingResponse, timeout=timeout)
+
+    async def stream[T: Response](
+        self, message: CallABC[Any], expected_response: type[T], *, timeout: float | None = None
+    ) -> tuple[T | ErrorResponse, AsyncIterator[bytes]]:
+        if self._framing != EFraming.BINARY:
+            raise ConnectionError("Streamed calls require the binary framing")
+        chunks: asyncio.Queue[bytes | Exception | None] = asyncio.Queue()
+        raw = await self._call(message, timeout=timeout, chunks=chunks)
+        return decode_response(raw, expected_response), _aiter_chunks(chunks)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.close()
+        self._reader_task.cancel()
+
+    async def _call(
+        self,
+        message: CallABC[Any],
+        *,
+        timeout: float | None,
+        chunks: asyncio.Queue[bytes | Exception | None] | None = None,
+    ) -> bytes:
+        request_id = next(self._ids)
+        data = encode_call(message, self._framing, id=request_id)
+        future: asyncio.Future[bytes] = asyncio.get_running_loop().create_future()
+        # A write is never interleaved with another one, no lock is needed to keep the send order
+        self._pending[request_id] = future
+        if chunks is not None:
+            self._streams[request_id] = chunks
+        try:
+            if self._closed:
+                raise ConnectionError("Connection is closed")
+            self._writer.write(data)
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except BaseException:
+            self._streams.pop(request_id, None)
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _read_responses(self) -> None:
+        try:
+            async for frame in read_stream_frames(self._reader, self._framing):
+                if frame.type == EFrameType.RAW:
+                    self._read_chunk(frame)
+                    continue
+                request_id = frame.id if self._framing == EFraming.BINARY else json.loads(frame.body).get("id")
+                if request_id is None and self._pending:
+                    request_id = next(iter(self._pending))
+                future = self._pending.get(request_id)
+                if future is not None and not future.done():
+                    future.set_result(frame.body)
+                    if not frame.flags & FLAG_MORE:
+                        self._end_stream(request_id, None)
+                elif request_id in self._streams:
+                    error = ErrorResponse.model_validate_json(frame.body).error
+                    self._end_stream(request_id, ConnectionError(error))
+                else:
+                    log(f"Dropping response for an unknown call: {frame.body!r}")
+        except asyncio.CancelledError:
+            pass
+        except (OSError, ValueError) as e:
+            log(f"Client error: {e}")
+        finally:
+            self._closed = True
+            self._writer.close()
+            for future in list(self._pending.values()):
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed before a response was received"))
+            for request_id in list(self._streams):
+                self._end_stream(request_id, ConnectionError("Connection closed in the middle of a stream"))
+
+    def _read_chunk(self, frame: Frame) -> None:
+        chunks = self._streams.get(frame.id)
+        if chunks is None:
+            log(f"Dropping {len(frame.body)} raw bytes for an unknown call")
+            return
+        if frame.body:
+            chunks.put_nowait(frame.body)
+        if not frame.flags & FLAG_MORE:
+            self._end_stream(frame.id, None)
+
+    def _end_stream(self, request_id: int, end: Exception | None) -> None:
+        chunks = self._streams.pop(request_id, None)
+        if chunks is not None:
+            chunks.put_nowait(end)
+
+
+class PoolOptions(NamedTuple):
+    # Most connections open at once, and so most calls in flight. A threaded server serves every connection with
+    # a worker of its own: across all the clients of a server keep it below its SERVER_WORKERS
+    size: int = 8
+    # Opened by `warm_up` and kept open however long they stay idle
+    min_idle: int = 2
+    # Seconds after which an idle connection above `min_idle` is closed
+    idle_timeout: float = 60
+    # Seconds a checkout waits for a free connection when all `size` are in use
+    checkout_timeout: float = 5
+
+
+DEFAULT_POOL_OPTIONS = PoolOptions()
+
+
+class PoolExhaustedError(Exception):
+    """No connection was checked in within `checkout_timeout`: the server is busy, not necessarily down."""
+
+
+class _Pooled(Protocol):
+    @property
+    def closed(self) -> bool: ...
+
+    def close(self) -> None: ...
+
+
+class _PoolBase[C: _Pooled]:
+    """Bookkeeping of `ConnectionPool` and `AsyncConnectionPool`, they differ in how they wait for it.
+
+    The most recently used idle connection is handed out first, so under a light load the same few are reused
+    and the rest go idle until they are closed. Idle connections are not free: a threaded server keeps a worker
+    busy for every open connection.
+    """
+
+    def __init__(self, socket_path: Path, options: PoolOptions) -> None:
+        self._socket_path = socket_path
+        self._options = options._replace(min_idle=min(options.min_idle, options.size))
+        # (connection, checked in at), the most recently used last
+        self._idle: list[tuple[C, float]] = []
+        # Idle, checked out or being opened
+        self._open = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait = Histogram()
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _warm(self) -> bool:
+        return len(self._idle) >= self._options.min_idle or self._open >= self._options.size
+
+    def _take(self, started: int) -> C | None:
+        """An idle connection; None with a slot for a new one reserved in `_open`, or raises if there is none."""
+        if self._closed:
+            raise ConnectionError("Connection pool is closed")
+        while self._idle:
+            connection, _ = self._idle.pop()
+            if not connection.closed:
+                self._record_checkout(started)
+                return connection
+            # Dropped by the server while idle
+            self._open -= 1
+        if self._open < self._options.size:
+            self._open += 1
+            return None
+        raise PoolExhaustedError
+
+    def _timed_out(self) -> PoolExhaustedError:
+        self._timeouts += 1
+        return PoolExhaustedError(f"All {self._options.size} connections to {self._socket_path} are in use")
+
+    def _put(self, connection: C) -> bool:
+        """Return a checked out connection, False if it has to be closed instead."""
+        if self._closed or connection.closed:
+            self._open -= 1
+            return False
+        self._idle.append((connection, time.monotonic()))
+        return True
+
+    def _release(self, error: BaseException) -> None:
+        # A slot reserved by `_take` whose connection could not be opened
+        self._open -= 1
+        self._timeouts += isinstance(error, TimeoutError)
+
+    def _expired(self) -> list[C]:
+        cutoff = time.monotonic() - self._options.idle_timeout
+        expired: list[C] = []
+        # The least recently used come first
+        while len(self._idle) > self._options.min_idle and self._idle[0][1] < cutoff:
+            expired.append(self._idle.pop(0)[0])
+        self._open -= len(expired)
+        return expired
+
+    def _close_pool(self) -> list[C]:
+        self._closed = True
+        idle = [connection for connection, _ in self._idle]
+        self._idle.clear()
+        self._open -= len(idle)
+        return idle
+
+    def _stats(self) -> PoolStats:
+        return PoolStats(
+            size=self._options.size,
+            open=self._open,
+            idle=len(self._idle),
+            in_use=self._open - len(self._idle),
+            checkouts=self._checkouts,
+            timeouts=self._timeouts,
+            wait=self._wait.snapshot(),
+        )
+
+    def _record_checkout(self, started: int) -> None:
+        self._checkouts += 1
+        self._wait.record(time.perf_counter_ns() - started)
+
+
+class ConnectionPool(_PoolBase[Connection]):
+    """Up to `size` connections to one server, a caller checks one out for the duration of its call.
+
+    A background thread closes the connections idle for longer than `idle_timeout`, down to `min_idle`.
+    """
+
+    def __init__(
+        self, socket_path: Path, shutdown_event: threading.Event, options: PoolOptions = DEFAULT_POOL_OPTIONS
+    ) -> None:
+        super().__init__(socket_path, options)
+        self._shutdown_event = shutdown_event
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._reaper = threading.Thread(target=self._close_idle, name="pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def warm_up(self) -> None:
+        """Open connections until `min_idle` are idle, raises if the server cannot be reached."""
+        while True:
+            with self._condition:
+                if self._warm():
+                    return
+                self._open += 1
+            self.checkin(self._connect())
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        connection = self.checkout()
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    def checkout(self) -> Connection:
+        """An idle connection, a new one if none is idle, or the first one checked in when all are in use.
+
+        Raises PoolExhaustedError when none is checked in within `checkout_timeout`.
+        """
+        started = time.perf_counter_ns()
+        deadline = time.monotonic() + self._options.checkout_timeout
+        with self._condition:
+            while True:
+                try:
+                    connection = self._take(started)
+                    break
+                except PoolExhaustedError:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out() from None
+                    self._condition.wait(remaining)
+        if connection is not None:
+            return connection
+        connection = self._connect()
+        with self._condition:
+            self._record_checkout(started)
+        return connection
+
+    def checkin(self, connection: Connection) -> None:
+        with self._condition:
+            kept = self._put(connection)
+            self._condition.notify()
+        if not kept:
+            connection.close()
+
+    def stats(self) -> PoolStats:
+        with self._condition:
+            return self._stats()
+
+    def close(self) -> None:
+        """Close the idle connections now and the checked out ones as they are checked in."""
+        with self._condition:
+            idle = self._close_pool()
+            self._condition.notify_all()
+        self._stopped.set()
+        for connection in idle:
+            connection.close()
+
+    def _connect(self) -> Connection:
+        # The caller has already counted it in `_open`
+        try:
+            # A threaded server only answers once a worker is free, which may be never
+            return Connection.open(self._socket_path, self._shutdown_event, timeout=self._options.checkout_timeout)
+        except BaseException as e:
+            with self._condition:
+                self._release(e)
+                self._condition.notify()
+            raise
+
+    def _close_idle(self) -> None:
+        while not self._stopped.wait(self._options.idle_timeout / 2):
+            with self._condition:
+                expired = self._expired()
+            for connection in expired:
+                connection.close()
+
+
+class AsyncConnectionPool(_PoolBase[AsyncConnection]):
+    """Event-loop counterpart of `ConnectionPool`, created and used on a single event loop."""
+
+    def __init__(self, socket_path: Path, options: PoolOptions = DEFAULT_POOL_OPTIONS) -> None:
+        super().__init__(socket_path, options)
+        # Checkouts waiting for a connection to be checked in, in arrival order
+        self._waiters: collections.deque[asyncio.Future[None]] = collections.deque()
+        self._reaper = asyncio.create_task(self._close_idle(), name="pool-reaper")
+
+    async def warm_up(self) -> None:
+        while not self._warm():
+            self._open += 1
+            self.checkin(await self._connect())
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncConnection]:
+        connection = await self.checkout()
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    async def checkout(self) -> AsyncConnection:
+        started = time.perf_counter_ns()
+        deadline = time.monotonic() + self._options.checkout_timeout
+        while True:
+            try:
+                connection = self._take(started)
+                break
+            except PoolExhaustedError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timed_out() from None
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    await asyncio.wait_for(waiter, remaining)
+                except TimeoutError:
+                    pass
+                finally:
+                    if not waiter.done():
+                        self._waiters.remove(waiter)
+        if connection is not None:
+            return connection
+        connection = await self._connect()
+        self._record_checkout(started)
+        return connection
+
+    def checkin(self, connection: AsyncConnection) -> None:
+        if not self._put(connection):
+            connection.close()
+        self._wake()
+
+    def stats(self) -> PoolStats:
+        return self._stats()
+
+    def close(self) -> None:
+        for connection in self._close_pool():
+            connection.close()
+        self._reaper.cancel()
+        self._wake(len(self._waiters))
+
+    async def _connect(self) -> AsyncConnection:
+        # The caller has already counted it in `_open`
+        try:
+            return await AsyncConnection.open(self._socket_path, timeout=self._options.checkout_timeout)
+        except BaseException as e:
+            self._release(e)
+            self._wake()
+            raise
+
+    def _wake(self, count: int = 1) -> None:
+        while count and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                count -= 1
+
+    async def _close_idle(self) -> None:
+        while True:
+            await asyncio.sleep(self._options.idle_timeout / 2)
+            for connection in self._expired():
+                connection.close()
+
+
+def _iter_chunks(chunks: queue.SimpleQueue[bytes | Exception | None]) -> Iterator[bytes]:
+    while (chunk := chunks.get()) is not None:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+async def _aiter_chunks(chunks: asyncio.Queue[bytes | Exception | None]) -> AsyncIterator[bytes]:
+    while (chunk := await chunks.get()) is not None:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def _ignore(_msg: str) -> None: ...
@@ -1,11 +1,52 @@
 MESSAGE_DELIMITER = "\n"
+DEFAULT_MAX_MESSAGE_SIZE = 16 * 1024 * 1024
 
 SERVER_SOCKER_ENV_VAR = "SERVER_SOCKET_PATH"
 SERVER_LOCK_ENV_VAR = "LOCK_FILE_PATH"
 LOG_PIPE_ENV_VAR = "LOG_PIPE_PATH"
 LOG_FILE_PATH_ENV_VAR = "LOG_FILE_PATH"
+LOG_FLUSH_BYTES_ENV_VAR = "LOG_FLUSH_BYTES"
+LOG_FLUSH_INTERVAL_ENV_VAR = "LOG_FLUSH_INTERVAL"
+LOG_FSYNC_ENV_VAR = "LOG_FSYNC"
+LOG_PIPE_PATHS_ENV_VAR = "LOG_PIPE_PATHS"
+LOG_SOCKET_PATH_ENV_VAR = "LOG_SOCKET_PATH"
+LOG_OUTPUT_ENV_VAR = "LOG_OUTPUT"
+LOG_STORAGE_ENV_VAR = "LOG_STORAGE"
+LOG_SEGMENT_BYTES_ENV_VAR = "LOG_SEGMENT_BYTES"
+LOG_INDEX_INTERVAL_ENV_VAR = "LOG_INDEX_INTERVAL"
+LOG_ROTATE_INTERVAL_ENV_VAR = "LOG_ROTATE_INTERVAL"
+LOG_RETENTION_SEGMENTS_ENV_VAR = "LOG_RETENTION_SEGMENTS"
+LOG_RETENTION_BYTES_ENV_VAR = "LOG_RETENTION_BYTES"
+LOG_RETENTION_AGE_ENV_VAR = "LOG_RETENTION_AGE"
+LOG_COMPRESSION_ENV_VAR = "LOG_COMPRESSION"
+SERVER_MODE_ENV_VAR = "SERVER_MODE"
+SERVER_WORKERS_ENV_VAR = "SERVER_WORKERS"
+SERVER_MAX_MESSAGE_SIZE_ENV_VAR = "SERVER_MAX_MESSAGE_SIZE"
+SERVER_CACHE_SIZE_ENV_VAR = "SERVER_CACHE_SIZE"
+SERVER_LOG_LEVEL_ENV_VAR = "SERVER_LOG_LEVEL"
+SERVER_LOG_OVERFLOW_ENV_VAR = "SERVER_LOG_OVERFLOW"
+SERVER_LOG_QUEUE_SIZE_ENV_VAR = "SERVER_LOG_QUEUE_SIZE"
+SERVER_PROCESS_WORKERS_ENV_VAR = "SERVER_PROCESS_WORKERS"
+SERVER_FORKS_ENV_VAR = "SERVER_FORKS"
 
 
 DEFAULT_SERVER_SOCKET = "/tmp/server_1.sock"
 DEFAULT_SERVER_LOCK = "/tmp/server_1.lock"
 DEFAULT_LOG_PIPE = "/tmp/log_server_1.pipe"
+DEFAULT_SERVER_MODE = "threaded"
+DEFAULT_SERVER_CACHE_SIZE = 1024
+DEFAULT_SERVER_LOG_LEVEL = "info"
+DEFAULT_SERVER_LOG_OVERFLOW = "drop"
+DEFAULT_SERVER_LOG_QUEUE_SIZE = 10_000
+DEFAULT_SERVER_PROCESS_WORKERS = 0
+DEFAULT_SERVER_FORKS = 0
+DEFAULT_LOG_FLUSH_BYTES = 64 * 1024
+DEFAULT_LOG_FLUSH_INTERVAL = 0.2
+DEFAULT_LOG_FSYNC = "never"
+DEFAULT_LOG_OUTPUT = "shared"
+DEFAULT_LOG_STORAGE = "segmented"
+DEFAULT_LOG_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_LOG_INDEX_INTERVAL = 16 * 1024
+DEFAULT_LOG_ROTATE_INTERVAL = 60 * 60
+DEFAULT_LOG_COMPRESSION = "gzip"
+DEFAULT_LOG_RETENTION_BYTES = 1024 * 1024 * 1024
@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from consts import LOG_FILE_PATH_ENV_VAR
+from utils.log_store import iter_lines, read_range, store_directory
+
+
+def main(
+    *,
+    log_file_path: Path,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    source: str | None = None,
+    follow: bool = False,
+) -> None:
+    """Print the records of a segmented log (`LOG_STORAGE=segmented`) logged in [start, end).
+
+    Without a range the whole log is streamed, compressed segments included; with `follow` new records are
+    printed as they are written.
+    """
+    directory = store_directory(log_file_path)
+    if start is not None or end is not None:
+        lines = read_range(directory, start or datetime.min, end or datetime.max)
+    else:
+        lines = iter_lines(directory, follow=follow)
+    tag = f"source='{source}' ".encode() if source is not None else None
+    out = sys.stdout.buffer
+    try:
+        for line in lines:
+            if tag is None or line.startswith(tag):
+                out.write(line)
+                if follow:
+                    out.flush()
+        out.flush()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a time range of a segmented log_server log or stream it.")
+    parser.add_argument("start", nargs="?", type=datetime.fromisoformat, help="ISO time, inclusive")
+    parser.add_argument("end", nargs="?", type=datetime.fromisoformat, help="ISO time, exclusive")
+    parser.add_argument("--source", help="only the records of this source")
+    parser.add_argument("--follow", "-f", action="store_true", help="keep printing new records, without a range")
+    parser.add_argument(
+        "--log-file",
+        type=Path,
+        default=Path(os.getenv(LOG_FILE_PATH_ENV_VAR, "/tmp/log_server_1.log")),
+        help=f"LOG_FILE_PATH the log server was started with (default: ${LOG_FILE_PATH_ENV_VAR})",
+    )
+    ns = parser.parse_args()
+    if ns.follow and ns.start is not None:
+        parser.error("--follow streams the whole log, it takes no range")
+    main(log_file_path=ns.log_file, start=ns.start, end=ns.end, source=ns.source, follow=ns.follow)
@@ -1,12 +1,137 @@
+import fcntl
+import gzip
+import heapq
 import os
+import select
+import shutil
 import signal
-import threading
+import socket
 import stat
+import threading
+import time
+from collections.abc import Iterable
+from datetime import datetime
+from enum import StrEnum
+from operator import itemgetter
 from pathlib import Path
-from time import sleep
 from types import FrameType
+from typing import NamedTuple
+
+from consts import (
+    DEFAULT_LOG_COMPRESSION,
+    DEFAULT_LOG_FLUSH_BYTES,
+    DEFAULT_LOG_FLUSH_INTERVAL,
+    DEFAULT_LOG_FSYNC,
+    DEFAULT_LOG_INDEX_INTERVAL,
+    DEFAULT_LOG_OUTPUT,
+    DEFAULT_LOG_PIPE,
+    DEFAULT_LOG_RETENTION_BYTES,
+    DEFAULT_LOG_ROTATE_INTERVAL,
+    DEFAULT_LOG_SEGMENT_BYTES,
+    DEFAULT_LOG_STORAGE,
+    LOG_COMPRESSION_ENV_VAR,
+    LOG_FILE_PATH_ENV_VAR,
+    LOG_FLUSH_BYTES_ENV_VAR,
+    LOG_FLUSH_INTERVAL_ENV_VAR,
+    LOG_FSYNC_ENV_VAR,
+    LOG_INDEX_INTERVAL_ENV_VAR,
+    LOG_OUTPUT_ENV_VAR,
+    LOG_PIPE_ENV_VAR,
+    LOG_PIPE_PATHS_ENV_VAR,
+    LOG_RETENTION_AGE_ENV_VAR,
+    LOG_RETENTION_BYTES_ENV_VAR,
+    LOG_RETENTION_SEGMENTS_ENV_VAR,
+    LOG_ROTATE_INTERVAL_ENV_VAR,
+    LOG_SEGMENT_BYTES_ENV_VAR,
+    LOG_SOCKET_PATH_ENV_VAR,
+    LOG_STORAGE_ENV_VAR,
+)
+from utils.log_store import (
+    INDEX_ENTRY,
+    READ_SIZE,
+    find_timestamp,
+    index_path,
+    is_compressed,
+    list_segments,
+    parse_timestamp,
+    segment_path,
+    segment_seq,
+    store_directory,
+    to_micros,
+)
+
+# Requested FIFO capacity (Linux defaults to 64KiB), writers block only once this much is unread.
+# A single read takes up to all of it
+PIPE_SIZE = 1024 * 1024
+
+# How often fsync is called at most with EFsyncPolicy.INTERVAL, seconds
+FSYNC_INTERVAL = 1.0
+
+# How often the retention limits are checked while no new segment is started, seconds
+RETENTION_CHECK_INTERVAL = 60.0
+
+COMPRESS_LEVEL = 6
+
+# Tag of the datagrams sent from an unbound socket
+UNNAMED_DATAGRAM_SOURCE = "datagram"
+
+
+class EFsyncPolicy(StrEnum):
+    # Leave writing back to the page cache, the fastest
+    NEVER = "never"
+    # At most once per FSYNC_INTERVAL
+    INTERVAL = "interval"
+    # After every flush, nothing that was flushed is lost on a power failure
+    ALWAYS = "always"
+
+
+class EOutputMode(StrEnum):
+    # Records of all the sources merged by timestamp into the log file
+    SHARED = "shared"
+    # One file per source next to the log file, `logs/all.log` -> `logs/all.server_1.log`
+    PER_SOURCE = "per_source"
+
+
+class EStorage(StrEnum):
+    # One plain file
+    FILE = "file"
+    # Segments with time indexes in a directory named after the file, see `utils.log_store`
+    SEGMENTED = "segmented"
+
+
+class ECompression(StrEnum):
+    NONE = "none"
+    GZIP = "gzip"
+
+
+class SegmentOptions(NamedTuple):
+    # A new segment is started once the current one reaches this size
+    segment_bytes: int = DEFAULT_LOG_SEGMENT_BYTES
+    # ... or once its first record is this many seconds old, 0 disables the time-based rotation
+    rotate_interval: float = DEFAULT_LOG_ROTATE_INTERVAL
+    # Bytes between the lines recorded in a segment's index
+    index_interval: int = DEFAULT_LOG_INDEX_INTERVAL
+    # Closed segments beyond any of these limits are deleted, oldest first; 0 disables a limit.
+    # The age is that of the newest record of a segment, in seconds
+    retention_segments: int = 0
+    retention_bytes: int = DEFAULT_LOG_RETENTION_BYTES
+    retention_age: float = 0.0
+    # Of the closed segments, done in the background
+    compression: ECompression = ECompression.GZIP
+
+
+class LogSource(NamedTuple):
+    name: str
+    pipe_path: Path
+
 
-from consts import LOG_FILE_PATH_ENV_VAR, LOG_PIPE_ENV_VAR
+def parse_sources(value: str) -> list[LogSource]:
+    """Parse comma-separated `name=path` pairs; a bare path is named after its file, `pipes/a.pipe` -> `a`."""
+    sources = []
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        name, _, path = item.rpartition("=")
+        sources.append(LogSource(name or Path(path).stem, Path(path)))
+    return sources
 
 
 def _ensure_fifo(path: Path) -> None:
@@ -19,7 +144,17 @@ def _ensure_fifo(path: Path) -> None:
         os.mkfifo(path)
 
 
-def main(*, pipe_path: Path, log_file_path: Path):
+def main(
+    *,
+    sources: list[LogSource],
+    log_file_path: Path,
+    socket_path: Path | None = None,
+    output: EOutputMode = EOutputMode.SHARED,
+    segments: SegmentOptions | None = None,
+    flush_bytes: int = DEFAULT_LOG_FLUSH_BYTES,
+    flush_interval: float = DEFAULT_LOG_FLUSH_INTERVAL,
+    fsync: EFsyncPolicy = EFsyncPolicy.NEVER,
+) -> None:
     shutdown_event = threading.Event()
 
     def shutdown(signum: int, _frame: FrameType | None) -> None:
@@ -29,30 +164,543 @@ def main(*, pipe_path: Path, log_file_path: Path):
     signal.signal(signal.SIGINT, shutdown)
     signal.signal(signal.SIGTERM, shutdown)
 
-    pipe_path.parent.mkdir(exist_ok=True)
-    if not pipe_path.exists():
-        os.mkfifo(pipe_path)
+    for source in sources:
+        source.pipe_path.parent.mkdir(exist_ok=True)
+        _ensure_fifo(source.pipe_path)
+        assert source.pipe_path.is_fifo()
+    if socket_path is not None:
+        socket_path.parent.mkdir(exist_ok=True)
     log_file_path.parent.mkdir(exist_ok=True)
-    log_file_path.touch(exist_ok=True)
-    assert pipe_path.is_fifo()
-    assert log_file_path.is_file()
-
-    with log_file_path.open("a") as log:
-        print("Starting log server.")
-        # Continuously reopen the FIFO to keep waiting for new writers.
-        with pipe_path.open("r") as pipe:
-            while not shutdown_event.is_set():
-                line = pipe.readline()
-                if not line:
-                    print("No data received, retrying in 100ms.")
-                    sleep(0.1)
+
+    # A signal writes a byte into this pipe, it wakes `poll` up right away
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    try:
+        print(f"Starting log server for {', '.join(source.name for source in sources) or 'datagrams only'}.")
+        ingest(
+            sources,
+            log_file_path,
+            shutdown_event,
+            socket_path=socket_path,
+            output=output,
+            segments=segments,
+            wakeup_fd=wakeup_read,
+            flush_bytes=flush_bytes,
+            flush_interval=flush_interval,
+            fsync=fsync,
+        )
+        print("Shutdown event set, exiting log server.")
+    finally:
+        signal.set_wakeup_fd(-1)
+        os.close(wakeup_read)
+        os.close(wakeup_write)
+
+
+def ingest(
+    sources: list[LogSource],
+    log_file_path: Path,
+    shutdown_event: threading.Event,
+    *,
+    socket_path: Path | None = None,
+    output: EOutputMode = EOutputMode.SHARED,
+    segments: SegmentOptions | None = None,
+    wakeup_fd: int,
+    flush_bytes: int,
+    flush_interval: float,
+    fsync: EFsyncPolicy,
+) -> None:
+    """Copy the records of all the FIFOs in `sources` (and of a datagram socket at `socket_path`) to the log.
+
+    One `poll` loop multiplexes every source; it sleeps until there is data or the non-blocking `wakeup_fd`
+    becomes readable. Each record is prefixed with `source='<name>'`. The buffered records are written out
+    once `flush_bytes` are buffered or the oldest of them is `flush_interval` seconds old, merged by their
+    timestamps: the log is ordered within a flush, records that arrive a flush late stay after it.
+    With `segments` the log is stored as time-indexed segments instead of a single file.
+    """
+    poller = select.poll()
+    poller.register(wakeup_fd, select.POLLIN)
+    # FIFO read fd -> its source; datagram sources are added by sender as they show up
+    pipes: dict[int, _SourceBuffer] = {}
+    buffers: dict[str, _SourceBuffer] = {}
+    keepalive_fds: list[int] = []
+    datagram_socket: socket.socket | None = None
+    writer = _OutputWriter(log_file_path, output, segments=segments, fsync=fsync)
+    try:
+        for source in sources:
+            pipe_fd = os.open(source.pipe_path, os.O_RDONLY | os.O_NONBLOCK)
+            pipes[pipe_fd] = buffers.setdefault(source.name, _SourceBuffer(source.name))
+            # Holding a write end ourselves keeps the FIFO from reporting EOF (and POLLHUP) whenever the last
+            # writer disconnects, so the loop only wakes up for data
+            keepalive_fds.append(os.open(source.pipe_path, os.O_WRONLY | os.O_NONBLOCK))
+            try:
+                fcntl.fcntl(pipe_fd, fcntl.F_SETPIPE_SZ, PIPE_SIZE)
+            except OSError:
+                pass  # Above /proc/sys/fs/pipe-max-size for an unprivileged process, keep the default
+            poller.register(pipe_fd, select.POLLIN)
+        if socket_path is not None:
+            datagram_socket = _bind_datagram_socket(socket_path)
+            poller.register(datagram_socket.fileno(), select.POLLIN)
+        chunk = bytearray(PIPE_SIZE)
+        # Bytes read since the last flush and when the first of them arrived
+        pending = 0
+        buffered_since = 0.0
+        while not shutdown_event.is_set():
+            timeout = None if not pending else max(0.0, buffered_since + flush_interval - time.monotonic())
+            for fd, _ in poller.poll(None if timeout is None else timeout * 1000):
+                if fd == wakeup_fd:
+                    _drain(wakeup_fd)
                     continue
-                log.write(line)
-                log.flush()
-            print("Shutdown event set, exiting log server.")
+                if not pending:
+                    buffered_since = time.monotonic()
+                if datagram_socket is not None and fd == datagram_socket.fileno():
+                    pending += _receive_datagrams(datagram_socket, chunk, buffers, flush_bytes)
+                else:
+                    pending += _read_available(fd, chunk, pipes[fd], flush_bytes)
+            if pending >= flush_bytes or (pending and time.monotonic() - buffered_since >= flush_interval):
+                writer.write(buffers.values())
+                pending = 0
+        # Whatever the writers managed to send before the shutdown
+        while True:
+            received = sum(_read_available(fd, chunk, buffer, flush_bytes) for fd, buffer in pipes.items())
+            if datagram_socket is not None:
+                received += _receive_datagrams(datagram_socket, chunk, buffers, flush_bytes)
+            writer.write(buffers.values())
+            if not received:
+                break
+        for buffer in buffers.values():
+            buffer.finish()
+        writer.write(buffers.values())
+        writer.sync()
+    finally:
+        writer.close()
+        if datagram_socket is not None and socket_path is not None:
+            datagram_socket.close()
+            socket_path.unlink(missing_ok=True)
+        for fd in keepalive_fds:
+            os.close(fd)
+        for fd in pipes:
+            os.close(fd)
+
+
+class _SourceBuffer:
+    """Complete lines of one source waiting for the next flush, already tagged with the source."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._tag = f"source='{name}' ".encode()
+        self._newline_tag = b"\n" + self._tag
+        self._partial = bytearray()
+        self._blocks: list[bytes] = []
+        # Timestamp of the last line taken, the next lines without one (a message with a newline) sort with it
+        self._last_timestamp = b""
+
+    def __bool__(self) -> bool:
+        return bool(self._blocks)
+
+    def feed(self, data: memoryview) -> None:
+        self._partial += data
+        end = self._partial.rfind(b"\n")
+        if end != -1:
+            self._add_lines(bytes(self._partial[:end]))
+            del self._partial[: end + 1]
+
+    def finish(self) -> None:
+        """Take the unterminated last line as it is, the writer is gone or a datagram ended."""
+        if self._partial:
+            self._add_lines(bytes(self._partial))
+            self._partial.clear()
+
+    def take(self) -> list[bytes]:
+        """The buffered lines in arrival order, in blocks."""
+        blocks, self._blocks = self._blocks, []
+        if blocks:
+            self._last_timestamp = find_timestamp(blocks[-1], last=True) or self._last_timestamp
+        return blocks
+
+    def take_records(self) -> list[tuple[bytes, bytes]]:
+        """The buffered lines (without newlines) keyed and ordered by their timestamps, arrival order among equal."""
+        timestamp = self._last_timestamp
+        records = []
+        for line in b"".join(self.take()).split(b"\n")[:-1]:
+            timestamp = find_timestamp(line) or timestamp
+            records.append((timestamp, line))
+        # Almost always sorted already, which takes timsort a single pass
+        records.sort(key=itemgetter(0))
+        return records
+
+    def _add_lines(self, lines: bytes) -> None:
+        # One pass in C instead of a loop over the lines
+        self._blocks.append(self._tag + lines.replace(b"\n", self._newline_tag) + b"\n")
+
+
+class _LogWriter:
+    def __init__(self, path: Path, *, fsync: EFsyncPolicy) -> None:
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._fsync = fsync
+        self._synced_at = time.monotonic()
+
+    def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        if self._fsync == EFsyncPolicy.ALWAYS or (
+            self._fsync == EFsyncPolicy.INTERVAL and time.monotonic() - self._synced_at >= FSYNC_INTERVAL
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        if self._fsync != EFsyncPolicy.NEVER:
+            os.fsync(self.fd)
+            self._synced_at = time.monotonic()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _SegmentedLogWriter:
+    """Log split into numbered segments, each with a sparse index of its line timestamps.
+
+    A segment is closed once it reaches `segment_bytes` or its first record is `rotate_interval` old.
+    An index entry is added for the first line that starts at least `index_interval` bytes after the previous one.
+    Closed segments are compressed and deleted past the retention limits by a `_SegmentMaintainer`.
+    """
+
+    def __init__(self, directory: Path, options: SegmentOptions, *, fsync: EFsyncPolicy) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self._directory = directory
+        self._options = options
+        self._fsync = fsync
+        segments = list_segments(directory)
+        # Carry on with the last segment after a restart, unless it has been closed already
+        self._seq = 0
+        if segments:
+            last = segments[-1]
+            self._seq = segment_seq(last) + 1 if is_compressed(last) else segment_seq(last)
+        self._open()
+        self._maintainer = _SegmentMaintainer(directory, options, live_seq=self._seq)
+
+    def write(self, data: bytes) -> None:
+        if self._should_rotate():
+            self._close_segment()
+            self._seq += 1
+            self._open()
+            self._maintainer.live_seq = self._seq
+            self._maintainer.wake()
+        entries = self._index_entries(data)
+        # Data first, an index entry never points past the end of the segment
+        self._log.write(data)
+        if entries:
+            self._index.write(entries)
+        self._size += len(data)
+
+    def sync(self) -> None:
+        self._log.sync()
+        self._index.sync()
+
+    def close(self) -> None:
+        self._close_segment()
+        self._maintainer.stop()
+
+    def _should_rotate(self) -> bool:
+        if not self._size:
+            return False
+        if self._size >= self._options.segment_bytes:
+            return True
+        return bool(
+            self._options.rotate_interval
+            and self._first_key is not None
+            and to_micros(datetime.now()) - self._first_key >= self._options.rotate_interval * 1_000_000
+        )
+
+    def _open(self) -> None:
+        path = segment_path(self._directory, self._seq)
+        self._log = _LogWriter(path, fsync=self._fsync)
+        self._index = _LogWriter(index_path(path), fsync=self._fsync)
+        self._size = os.fstat(self._log.fd).st_size
+        self._next_index_at = self._size
+        # A crash may have cut the last index entry short
+        index_size = os.fstat(self._index.fd).st_size
+        index_size -= index_size % INDEX_ENTRY.size
+        os.ftruncate(self._index.fd, index_size)
+        # Keys never decrease, a reopened index continues from its last one
+        self._first_key: int | None = None
+        self._last_key = 0
+        if index_size:
+            with index_path(path).open("rb") as index:
+                self._first_key = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+                index.seek(index_size - INDEX_ENTRY.size)
+                self._last_key = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+
+    def _close_segment(self) -> None:
+        self._log.close()
+        self._index.close()
+
+    def _index_entries(self, data: bytes) -> bytes:
+        entries = bytearray()
+        position = max(0, self._next_index_at - self._size)
+        while position < len(data):
+            if position and data[position - 1] != ord("\n"):
+                # Move on to the start of the next line
+                position = data.find(b"\n", position) + 1 or len(data)
+                continue
+            end = data.find(b"\n", position)
+            raw = find_timestamp(data[position:end])
+            key = parse_timestamp(raw) if raw is not None else None
+            if key is None:
+                position = end + 1
+                continue
+            self._last_key = max(self._last_key, key)
+            if self._first_key is None:
+                self._first_key = self._last_key
+            entries += INDEX_ENTRY.pack(self._last_key, self._size + position)
+            self._next_index_at = self._size + position + self._options.index_interval
+            position = self._next_index_at - self._size
+        return bytes(entries)
+
+
+class _OutputWriter:
+    def __init__(
+        self, log_file_path: Path, output: EOutputMode, *, segments: SegmentOptions | None, fsync: EFsyncPolicy
+    ) -> None:
+        self._log_file_path = log_file_path
+        self._output = output
+        self._segments = segments
+        self._fsync = fsync
+        self._writers: dict[Path, _LogWriter | _SegmentedLogWriter] = {}
+
+    def write(self, buffers: Iterable[_SourceBuffer]) -> None:
+        pending = [buffer for buffer in buffers if buffer]
+        if self._output == EOutputMode.PER_SOURCE:
+            for buffer in pending:
+                path = self._log_file_path.with_name(
+                    f"{self._log_file_path.stem}.{buffer.name}{self._log_file_path.suffix}"
+                )
+                self._writer(path).write(b"".join(buffer.take()))
+        elif len(pending) == 1:
+            # Nothing to interleave, a source's own lines are in order
+            self._writer(self._log_file_path).write(b"".join(pending[0].take()))
+        elif pending:
+            runs = [buffer.take_records() for buffer in pending]
+            # ISO timestamps in one format order the same as strings
+            merged = b"\n".join(line for _, line in heapq.merge(*runs, key=itemgetter(0)))
+            self._writer(self._log_file_path).write(merged + b"\n")
+
+    def sync(self) -> None:
+        for writer in self._writers.values():
+            writer.sync()
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+    def _writer(self, path: Path) -> _LogWriter | _SegmentedLogWriter:
+        writer = self._writers.get(path)
+        if writer is None:
+            if self._segments is not None:
+                writer = _SegmentedLogWriter(store_directory(path), self._segments, fsync=self._fsync)
+            else:
+                writer = _LogWriter(path, fsync=self._fsync)
+            self._writers[path] = writer
+        return writer
+
+
+class _SegmentMaintainer:
+    """Compresses the closed segments and enforces the retention limits on a background thread.
+
+    Ingestion only wakes the thread up when it starts a new segment, it never waits for it.
+    """
+
+    def __init__(self, directory: Path, options: SegmentOptions, *, live_seq: int) -> None:
+        # Segments before this one are closed
+        self.live_seq = live_seq
+        self._directory = directory
+        self._options = options
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="log-maintainer", daemon=True)
+        self._thread.start()
+        # Leftovers of the previous run
+        self.wake()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        """Stop after the segment being compressed, if any; the rest is done on the next start."""
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            # The age limit is checked even when nothing is logged
+            self._wakeup.wait(RETENTION_CHECK_INTERVAL)
+            self._wakeup.clear()
+            if self._stopped:
+                return
+            try:
+                self._compress()
+                self._apply_retention()
+            except OSError as e:
+                print(f"Log segment maintenance failed: {e}")
+
+    def _compress(self) -> None:
+        if self._options.compression == ECompression.NONE:
+            return
+        for segment in list_segments(self._directory):
+            if self._stopped or segment_seq(segment) >= self.live_seq:
+                return
+            if not is_compressed(segment):
+                _compress_segment(segment)
+
+    def _apply_retention(self) -> None:
+        options = self._options
+        segments = [
+            (segment, segment.stat(), _size_on_disk(index_path(segment))) for segment in list_segments(self._directory)
+        ]
+        total = sum(stat_result.st_size + index_size for _, stat_result, index_size in segments)
+        now = time.time()
+        for count, (segment, stat_result, index_size) in zip(range(len(segments), 0, -1), segments):
+            if segment_seq(segment) >= self.live_seq:
+                return
+            if not (
+                (options.retention_segments and count > options.retention_segments)
+                or (options.retention_bytes and total > options.retention_bytes)
+                or (options.retention_age and now - stat_result.st_mtime > options.retention_age)
+            ):
+                return
+            segment.unlink(missing_ok=True)
+            index_path(segment).unlink(missing_ok=True)
+            total -= stat_result.st_size + index_size
+
+
+def _compress_segment(segment: Path) -> None:
+    target = segment_path(segment.parent, segment_seq(segment), compressed=True)
+    partial = target.with_name(f"{target.name}.tmp")
+    with segment.open("rb") as source, gzip.open(partial, "wb", compresslevel=COMPRESS_LEVEL) as compressed:
+        shutil.copyfileobj(source, compressed, READ_SIZE)
+    # The age of a segment is that of its newest record, keep it
+    source_stat = segment.stat()
+    os.utime(partial, (source_stat.st_atime, source_stat.st_mtime))
+    # Readers keep seeing the uncompressed segment until it is gone
+    os.replace(partial, target)
+    segment.unlink()
+
+
+def _size_on_disk(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _bind_datagram_socket(path: Path) -> socket.socket:
+    path.unlink(missing_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, PIPE_SIZE)
+        sock.bind(str(path))
+        # Any local process may log
+        path.chmod(0o666)
+        sock.setblocking(False)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _read_available(fd: int, chunk: bytearray, buffer: _SourceBuffer, limit: int) -> int:
+    """Read until the pipe is empty or `limit` bytes were read, return how many were.
+
+    Reads go into the reusable `chunk` and are fed to `buffer` from there.
+    """
+    view = memoryview(chunk)
+    total = 0
+    while total < limit:
+        try:
+            received = os.readv(fd, [view])
+        except BlockingIOError:
+            break
+        if not received:
+            break
+        buffer.feed(view[:received])
+        total += received
+    return total
+
+
+def _receive_datagrams(sock: socket.socket, chunk: bytearray, buffers: dict[str, _SourceBuffer], limit: int) -> int:
+    """Like `_read_available` for the datagram socket, each datagram holds whole lines of the sender."""
+    view = memoryview(chunk)
+    total = 0
+    while total < limit:
+        try:
+            received, address = sock.recvfrom_into(view)
+        except BlockingIOError:
+            break
+        name = _datagram_source_name(address)
+        buffer = buffers.get(name)
+        if buffer is None:
+            buffer = buffers[name] = _SourceBuffer(name)
+        buffer.feed(view[:received])
+        buffer.finish()
+        total += received
+    return total
+
+
+def _datagram_source_name(address: str | bytes | None) -> str:
+    # Senders bound to an abstract address (`\0server_1`) are named after it, to a path after its file
+    if isinstance(address, bytes):
+        return address.lstrip(b"\0").decode(errors="replace") or UNNAMED_DATAGRAM_SOURCE
+    return Path(address).stem if address else UNNAMED_DATAGRAM_SOURCE
+
+
+def _drain(fd: int) -> None:
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
 
 
 if __name__ == "__main__":
-    pipe_path = Path(os.getenv(LOG_PIPE_ENV_VAR, "/tmp/log_server_1.pipe"))
+    pipe_paths = os.getenv(LOG_PIPE_PATHS_ENV_VAR)
+    socket_path = Path(socket_env) if (socket_env := os.getenv(LOG_SOCKET_PATH_ENV_VAR)) else None
+    if pipe_paths is not None:
+        sources = parse_sources(pipe_paths)
+    elif socket_path is not None and os.getenv(LOG_PIPE_ENV_VAR) is None:
+        sources = []
+    else:
+        sources = parse_sources(os.getenv(LOG_PIPE_ENV_VAR, DEFAULT_LOG_PIPE))
     log_file_path = Path(os.getenv(LOG_FILE_PATH_ENV_VAR, "/tmp/log_server_1.log"))
-    main(pipe_path=pipe_path, log_file_path=log_file_path)
+    output = EOutputMode(os.getenv(LOG_OUTPUT_ENV_VAR, DEFAULT_LOG_OUTPUT))
+    flush_bytes = int(os.getenv(LOG_FLUSH_BYTES_ENV_VAR, DEFAULT_LOG_FLUSH_BYTES))
+    flush_interval = float(os.getenv(LOG_FLUSH_INTERVAL_ENV_VAR, DEFAULT_LOG_FLUSH_INTERVAL))
+    fsync = EFsyncPolicy(os.getenv(LOG_FSYNC_ENV_VAR, DEFAULT_LOG_FSYNC))
+    storage = EStorage(os.getenv(LOG_STORAGE_ENV_VAR, DEFAULT_LOG_STORAGE))
+    segments = (
+        SegmentOptions(
+            segment_bytes=int(os.getenv(LOG_SEGMENT_BYTES_ENV_VAR, DEFAULT_LOG_SEGMENT_BYTES)),
+            rotate_interval=float(os.getenv(LOG_ROTATE_INTERVAL_ENV_VAR, DEFAULT_LOG_ROTATE_INTERVAL)),
+            index_interval=int(os.getenv(LOG_INDEX_INTERVAL_ENV_VAR, DEFAULT_LOG_INDEX_INTERVAL)),
+            retention_segments=int(os.getenv(LOG_RETENTION_SEGMENTS_ENV_VAR, "0")),
+            retention_bytes=int(os.getenv(LOG_RETENTION_BYTES_ENV_VAR, DEFAULT_LOG_RETENTION_BYTES)),
+            retention_age=float(os.getenv(LOG_RETENTION_AGE_ENV_VAR, "0")),
+            compression=ECompression(os.getenv(LOG_COMPRESSION_ENV_VAR, DEFAULT_LOG_COMPRESSION)),
+        )
+        if storage == EStorage.SEGMENTED
+        else None
+    )
+    main(
+        sources=sources,
+        log_file_path=log_file_path,
+        socket_path=socket_path,
+        output=output,
+        segments=segments,
+        flush_bytes=flush_bytes,
+        flush_interval=flush_interval,
+        fsync=fsync,
+    )
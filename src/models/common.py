@@ -1,6 +1,109 @@
+from enum import StrEnum
+
 from models.base import MessageABC
 
 
 class MonitorParams(MessageABC):
     width: int
     height: int
+
+
+class EPixelFormat(StrEnum):
+    # Native mss layout, sent without any conversion
+    BGRA = "bgra"
+    RGB = "rgb"
+
+
+class RegionFrame(MessageABC):
+    width: int
+    height: int
+    pixel_format: EPixelFormat
+    # Total length of the raw frames that follow the response
+    size: int
+
+
+class FrameSubscription(MessageABC):
+    subscription_id: int
+    width: int
+    height: int
+    # Side of the square blocks the screen is diffed in, changed rectangles are aligned to it
+    block_size: int
+    pixel_format: EPixelFormat
+
+
+class CacheStats(MessageABC):
+    hits: int
+    misses: int
+    # Calls that waited for an identical call in progress instead of running again
+    coalesced: int
+    evictions: int
+    size: int
+    max_size: int
+
+
+class LogStats(MessageABC):
+    level: str
+    written: int
+    # Records lost to the overflow policy while the log pipe could not keep up
+    dropped: int
+    queued: int
+
+
+class LatencyHistogram(MessageABC):
+    count: int
+    total_us: float
+    max_us: float
+    # Upper bounds of the buckets, the last bucket (one more than the bounds) is unbounded
+    bounds_us: list[float]
+    counts: list[int]
+    # Estimated as the upper bound of the bucket the percentile falls into, None without samples
+    p50_us: float | None
+    p90_us: float | None
+    p99_us: float | None
+
+
+class PoolStats(MessageABC):
+    size: int
+    open: int
+    idle: int
+    in_use: int
+    checkouts: int
+    # Checkouts that gave up: all the connections in use, or a new one not answered in time
+    timeouts: int
+    # Time from asking for a connection to getting one, opening it included
+    wait: LatencyHistogram
+
+
+class HealthStats(MessageABC):
+    # closed: calls go through; open: they fail fast until the next reconnect attempt; half_open: one is in progress
+    state: str
+    consecutive_failures: int
+    last_error: str | None
+    # Seconds until the next reconnect attempt while the circuit is open
+    retry_in: float | None
+    reconnect_attempts: int
+    # Round trips of the successful health probes
+    probes: LatencyHistogram
+    # Time from the circuit opening until the backend answered again
+    reconnects: LatencyHistogram
+
+
+class CallMetrics(MessageABC):
+    count: int
+    # Calls answered with an ErrorResponse
+    errors: int
+    decode: LatencyHistogram
+    handler: LatencyHistogram
+    # Not recorded for streamed responses, the encoding of their chunks is interleaved with sending
+    encode: LatencyHistogram
+
+
+class ServerMetrics(MessageABC):
+    active_connections: int
+    total_connections: int
+    # Messages that could not be decoded into a call
+    invalid_calls: int
+    # Time from handing work to the executor to a worker starting on it
+    queue_wait: LatencyHistogram
+    # By call type
+    calls: dict[str, CallMetrics]
@@ -1,20 +1,35 @@
 from enum import StrEnum
+from typing import Annotated, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 
 from models.base import MessageABC
+from models.common import EPixelFormat
 
 
 class ECallType(StrEnum):
     GET_MAIN_MONITOR_PARAMS = "get_main_monitor_params"
     GET_MAIN_MONITOR_PIXEL_COLOR = "get_main_monitor_pixel_color"
+    GET_MAIN_MONITOR_PIXEL_COLORS = "get_main_monitor_pixel_colors"
+    CAPTURE_MAIN_MONITOR_REGION = "capture_main_monitor_region"
     GET_PROCESS_ID = "get_process_id"
     GET_THREAD_COUNT = "get_thread_count"
+    NEGOTIATE_FRAMING = "negotiate_framing"
+    SUBSCRIBE_FRAME_CHANGES = "subscribe_frame_changes"
+    UNSUBSCRIBE_FRAME_CHANGES = "unsubscribe_frame_changes"
+    GET_CACHE_STATS = "get_cache_stats"
+    GET_LOG_STATS = "get_log_stats"
+    GET_METRICS = "get_metrics"
+    PING = "ping"
+    BATCH = "batch"
 
 
 class CallABC[T](MessageABC):
+    # Narrowed to a single `Literal` member by every call, it discriminates the calls in `TCall`
     type: ECallType
     params: T
+    # Optional correlation id, echoed back in the response so that calls can be pipelined
+    id: int | None = None
 
 
 class GetMainMonitorPixelColor(BaseModel):
@@ -22,13 +37,140 @@ class GetMainMonitorPixelColor(BaseModel):
     y: int
 
 
-class GetMainMonitorPixelColorCall(CallABC[GetMainMonitorPixelColor]): ...
+class GetMainMonitorPixelColorCall(CallABC[GetMainMonitorPixelColor]):
+    type: Literal[ECallType.GET_MAIN_MONITOR_PIXEL_COLOR] = ECallType.GET_MAIN_MONITOR_PIXEL_COLOR
 
 
-class GetMainMonitorParamsCall(CallABC[None]): ...
+class GetMainMonitorPixelColors(BaseModel):
+    # (x, y) pairs, all of them are read from a single grab of their bounding box
+    points: list[tuple[int, int]] = Field(min_length=1)
 
 
-class GetProcessIdCall(CallABC[None]): ...
+class GetMainMonitorPixelColorsCall(CallABC[GetMainMonitorPixelColors]):
+    type: Literal[ECallType.GET_MAIN_MONITOR_PIXEL_COLORS] = ECallType.GET_MAIN_MONITOR_PIXEL_COLORS
 
 
-class GetThreadCountCall(CallABC[None]): ...
+class CaptureMainMonitorRegion(BaseModel):
+    x: int
+    y: int
+    width: int = Field(gt=0)
+    height: int = Field(gt=0)
+    pixel_format: EPixelFormat = EPixelFormat.BGRA
+
+
+# The pixels follow the response as raw frames, so the call needs the binary framing
+class CaptureMainMonitorRegionCall(CallABC[CaptureMainMonitorRegion]):
+    type: Literal[ECallType.CAPTURE_MAIN_MONITOR_REGION] = ECallType.CAPTURE_MAIN_MONITOR_REGION
+
+
+class GetMainMonitorParamsCall(CallABC[None]):
+    type: Literal[ECallType.GET_MAIN_MONITOR_PARAMS] = ECallType.GET_MAIN_MONITOR_PARAMS
+    params: None = None
+
+
+class GetProcessIdCall(CallABC[None]):
+    type: Literal[ECallType.GET_PROCESS_ID] = ECallType.GET_PROCESS_ID
+    params: None = None
+
+
+class GetThreadCountCall(CallABC[None]):
+    type: Literal[ECallType.GET_THREAD_COUNT] = ECallType.GET_THREAD_COUNT
+    params: None = None
+
+
+class NegotiateFraming(BaseModel):
+    # Framings the client supports, in order of preference
+    framings: list[str]
+
+
+class NegotiateFramingCall(CallABC[NegotiateFraming]):
+    type: Literal[ECallType.NEGOTIATE_FRAMING] = ECallType.NEGOTIATE_FRAMING
+
+
+class SubscribeFrameChanges(BaseModel):
+    # Capture rate, subscribers with the same fps and block_size share one capture
+    fps: float = Field(default=10, gt=0, le=60)
+    block_size: int = Field(default=32, ge=8, le=256)
+    # Upper bound for the deltas sent to this subscriber, changes in between are merged
+    max_fps: float | None = Field(default=None, gt=0)
+    pixel_format: EPixelFormat = EPixelFormat.BGRA
+
+
+# Deltas follow the response as raw frames until the subscription is cancelled, needs the binary framing
+class SubscribeFrameChangesCall(CallABC[SubscribeFrameChanges]):
+    type: Literal[ECallType.SUBSCRIBE_FRAME_CHANGES] = ECallType.SUBSCRIBE_FRAME_CHANGES
+
+
+class UnsubscribeFrameChanges(BaseModel):
+    subscription_id: int
+
+
+class UnsubscribeFrameChangesCall(CallABC[UnsubscribeFrameChanges]):
+    type: Literal[ECallType.UNSUBSCRIBE_FRAME_CHANGES] = ECallType.UNSUBSCRIBE_FRAME_CHANGES
+
+
+class GetCacheStatsCall(CallABC[None]):
+    type: Literal[ECallType.GET_CACHE_STATS] = ECallType.GET_CACHE_STATS
+    params: None = None
+
+
+class GetLogStatsCall(CallABC[None]):
+    type: Literal[ECallType.GET_LOG_STATS] = ECallType.GET_LOG_STATS
+    params: None = None
+
+
+class GetMetricsCall(CallABC[None]):
+    type: Literal[ECallType.GET_METRICS] = ECallType.GET_METRICS
+    params: None = None
+
+
+# Answered by a worker like any other call, so it also tells whether the server keeps up
+class PingCall(CallABC[None]):
+    type: Literal[ECallType.PING] = ECallType.PING
+    params: None = None
+
+
+# Calls that can be part of a batch: answered with a single message and independent of the connection state
+type TBatchedCall = Annotated[
+    GetMainMonitorParamsCall
+    | GetMainMonitorPixelColorCall
+    | GetMainMonitorPixelColorsCall
+    | GetProcessIdCall
+    | GetThreadCountCall
+    | GetCacheStatsCall
+    | GetLogStatsCall
+    | GetMetricsCall
+    | PingCall,
+    Field(discriminator="type"),
+]
+
+
+class Batch(BaseModel):
+    # Run concurrently, the results come back in the same order
+    calls: list[TBatchedCall] = Field(min_length=1, max_length=64)
+
+
+class BatchCall(CallABC[Batch]):
+    type: Literal[ECallType.BATCH] = ECallType.BATCH
+
+
+type TCall = Annotated[
+    GetMainMonitorParamsCall
+    | GetMainMonitorPixelColorCall
+    | GetMainMonitorPixelColorsCall
+    | CaptureMainMonitorRegionCall
+    | GetProcessIdCall
+    | GetThreadCountCall
+    | NegotiateFramingCall
+    | SubscribeFrameChangesCall
+    | UnsubscribeFrameChangesCall
+    | GetCacheStatsCall
+    | GetLogStatsCall
+    | GetMetricsCall
+    | PingCall
+    | BatchCall,
+    Field(discriminator="type"),
+]
+
+# Built once, validates the raw JSON of any call straight into its model in a single pass
+CALL_ADAPTER: TypeAdapter[TCall] = TypeAdapter(TCall)
@@ -1,14 +1,15 @@
 from datetime import datetime, UTC
-from typing import Literal
+from typing import Annotated, Any, Literal
 
 from pydantic import Field
 
 from models.base import MessageABC
-from models.common import MonitorParams
+from models.common import CacheStats, FrameSubscription, LogStats, MonitorParams, RegionFrame, ServerMetrics
 
 
 class Response(MessageABC):
     timestamp: datetime = Field(default_factory=lambda: datetime.now(tz=UTC))
+    id: int | None = None
 
 
 class ErrorResponse(Response):
@@ -24,10 +25,47 @@ class SuccessResponse[T](Response):
 class GetMainMonitorPixelColorResponse(SuccessResponse[str]): ...
 
 
+# Colors packed as 0xRRGGBB integers, in the order of the requested points
+class GetMainMonitorPixelColorsResponse(SuccessResponse[list[int]]): ...
+
+
 class GetMainMonitorParamsResponse(SuccessResponse[MonitorParams]): ...
 
 
+class CaptureMainMonitorRegionResponse(SuccessResponse[RegionFrame]): ...
+
+
 class GetProcessIdResponse(SuccessResponse[int]): ...
 
 
 class GetThreadCountResponse(SuccessResponse[int]): ...
+
+
+class NegotiateFramingResponse(SuccessResponse[str]): ...
+
+
+class SubscribeFrameChangesResponse(SuccessResponse[FrameSubscription]): ...
+
+
+# False if there was no such subscription
+class UnsubscribeFrameChangesResponse(SuccessResponse[bool]): ...
+
+
+class GetCacheStatsResponse(SuccessResponse[CacheStats]): ...
+
+
+class GetLogStatsResponse(SuccessResponse[LogStats]): ...
+
+
+class GetMetricsResponse(SuccessResponse[ServerMetrics]): ...
+
+
+class PingResponse(SuccessResponse[bool]): ...
+
+
+# A sub-call's own response with a plain JSON result, or its error
+type TBatchedResponse = Annotated[SuccessResponse[Any] | ErrorResponse, Field(discriminator="success")]
+
+
+# In the order of the batched calls, a failed call does not fail the others
+class BatchResponse(SuccessResponse[list[TBatchedResponse]]): ...
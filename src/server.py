@@ -1,77 +1,279 @@
+import asyncio
+import contextvars
 import fcntl
 import json
+import math
 import os
 import signal
 import socket
 import sys
 import threading
-from collections.abc import Iterator
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, wait
 from concurrent.futures.thread import ThreadPoolExecutor
-from contextlib import contextmanager
-from datetime import datetime
+from contextlib import AbstractContextManager, ExitStack, closing, contextmanager
+from datetime import UTC, datetime
+from enum import StrEnum
 from pathlib import Path
 from types import FrameType
-from types_ import TLogger
-from typing import Any, assert_never
+from typing import Any, NamedTuple, TextIO
+
+from pydantic import ValidationError
+from pydantic_core import ErrorDetails
 
 from consts import (
     DEFAULT_LOG_PIPE,
+    DEFAULT_MAX_MESSAGE_SIZE,
+    DEFAULT_SERVER_CACHE_SIZE,
+    DEFAULT_SERVER_FORKS,
     DEFAULT_SERVER_LOCK,
+    DEFAULT_SERVER_LOG_LEVEL,
+    DEFAULT_SERVER_LOG_OVERFLOW,
+    DEFAULT_SERVER_LOG_QUEUE_SIZE,
+    DEFAULT_SERVER_MODE,
+    DEFAULT_SERVER_PROCESS_WORKERS,
     DEFAULT_SERVER_SOCKET,
     LOG_PIPE_ENV_VAR,
+    SERVER_CACHE_SIZE_ENV_VAR,
+    SERVER_FORKS_ENV_VAR,
     SERVER_LOCK_ENV_VAR,
+    SERVER_LOG_LEVEL_ENV_VAR,
+    SERVER_LOG_OVERFLOW_ENV_VAR,
+    SERVER_LOG_QUEUE_SIZE_ENV_VAR,
+    SERVER_MAX_MESSAGE_SIZE_ENV_VAR,
+    SERVER_MODE_ENV_VAR,
+    SERVER_PROCESS_WORKERS_ENV_VAR,
     SERVER_SOCKER_ENV_VAR,
+    SERVER_WORKERS_ENV_VAR,
 )
 from models.request import (
+    CALL_ADAPTER,
+    BatchCall,
+    CallABC,
+    CaptureMainMonitorRegionCall,
     ECallType,
-    GetMainMonitorPixelColor,
-    GetProcessIdCall,
-    GetThreadCountCall,
+    GetCacheStatsCall,
+    GetLogStatsCall,
     GetMainMonitorParamsCall,
     GetMainMonitorPixelColorCall,
+    GetMainMonitorPixelColorsCall,
+    GetMetricsCall,
+    GetProcessIdCall,
+    GetThreadCountCall,
+    NegotiateFramingCall,
+    PingCall,
+    SubscribeFrameChangesCall,
+    TBatchedCall,
+    TCall,
+    UnsubscribeFrameChangesCall,
 )
-from utils.monitor import get_main_monitor_params, get_main_monitor_pixel_color
-from utils.proc import get_process_id, get_thread_count
 from models.response import (
+    BatchResponse,
+    CaptureMainMonitorRegionResponse,
     ErrorResponse,
+    GetCacheStatsResponse,
+    GetLogStatsResponse,
     GetMainMonitorParamsResponse,
     GetMainMonitorPixelColorResponse,
+    GetMainMonitorPixelColorsResponse,
+    GetMetricsResponse,
     GetProcessIdResponse,
     GetThreadCountResponse,
+    NegotiateFramingResponse,
+    PingResponse,
     Response,
+    SubscribeFrameChangesResponse,
+    SuccessResponse,
+    TBatchedResponse,
+    UnsubscribeFrameChangesResponse,
+)
+from types_ import TLogger
+from utils.cache import ResultCache
+from utils.frames import Subscription, close_subscriptions, subscribe_frame_changes, unsubscribe_frame_changes
+from utils.log import DatagramLogStream, ELogLevel, EOverflowPolicy, FifoLogStream, PipeLogger
+from utils.messagging import (
+    FLAG_MORE,
+    SUPPORTED_FRAMINGS,
+    EFrameType,
+    EFraming,
+    Frame,
+    FrameReader,
+    ProtocolError,
+    asend_message,
+    asend_raw,
+    encode_message,
+    send_message,
+    send_raw,
+)
+from utils.metrics import MetricsRecorder
+from utils.monitor import (
+    REGION_CHUNK_SIZE,
+    capture_main_monitor_region,
+    get_main_monitor_params,
+    get_main_monitor_pixel_color,
+    get_main_monitor_pixel_colors,
 )
-from utils.messagging import get_messages, send_message
+from utils.offload import ProcessPool, TAllocate, run_here
+from utils.prefork import run_workers
+from utils.proc import get_process_id, get_thread_count
 
+# Pipelined calls a single connection may have in flight before reading from it pauses
+MAX_IN_FLIGHT_PER_CONNECTION = 256
 
-def main(*, server_socket: Path, lock_file: Path, log_pipe_path: Path) -> None:
-    shutdown_event = threading.Event()
+# Calls whose results are served from the cache, with how long (seconds) a result stays fresh
+CACHE_TTLS: dict[ECallType, float] = {
+    ECallType.GET_MAIN_MONITOR_PARAMS: 1.0,
+    ECallType.GET_MAIN_MONITOR_PIXEL_COLOR: 0.05,
+    ECallType.GET_MAIN_MONITOR_PIXEL_COLORS: 0.05,
+    ECallType.GET_PROCESS_ID: math.inf,
+    ECallType.GET_THREAD_COUNT: 0.1,
+}
+
+
+class StreamedResponse(NamedTuple):
+    """A response followed by raw frames with the pixels, bytes etc. that do not fit into JSON."""
+
+    response: Response
+    chunks: Iterator[bytes | memoryview]
+    # Set for open-ended streams (subscriptions): ends the chunks, e.g. when the client goes away
+    cancel: Callable[[], None] | None = None
 
+
+class EServerMode(StrEnum):
+    # One executor thread per connection, polling accept/recv with a timeout
+    THREADED = "threaded"
+    # All connections multiplexed on one asyncio loop, handlers run in the executor
+    EVENT_LOOP = "event_loop"
+
+
+def main(
+    *,
+    server_socket: Path,
+    lock_file: Path,
+    log_pipe_path: Path,
+    mode: EServerMode = EServerMode.THREADED,
+    workers: int | None = None,
+    max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE,
+    cache_size: int = DEFAULT_SERVER_CACHE_SIZE,
+    log_level: ELogLevel = ELogLevel.INFO,
+    log_overflow: EOverflowPolicy = EOverflowPolicy.DROP,
+    log_queue_size: int = DEFAULT_SERVER_LOG_QUEUE_SIZE,
+    process_workers: int = DEFAULT_SERVER_PROCESS_WORKERS,
+    forks: int = DEFAULT_SERVER_FORKS,
+) -> None:
+    """Serve on `server_socket`; with `forks` the master process forks that many workers that accept on it."""
+    global _result_cache
+    _result_cache = ResultCache(max_entries=cache_size)
+
+    def open_log_pipe(name: str, writer_thread: bool = True) -> AbstractContextManager[PipeLogger]:
+        return _open_log_pipe(
+            log_pipe_path,
+            name=name,
+            level=log_level,
+            overflow=log_overflow,
+            queue_size=log_queue_size,
+            writer_thread=writer_thread,
+            shared=bool(forks),
+        )
+
+    def serve(server: socket.socket, logger: PipeLogger) -> None:
+        _serve(
+            server,
+            logger,
+            mode=mode,
+            workers=workers,
+            max_message_size=max_message_size,
+            process_workers=process_workers,
+        )
+
+    # The master of the workers must not run threads when it forks them
     with (
-        _open_log_pipe(log_pipe_path) as logger,
+        open_log_pipe(server_socket.stem, writer_thread=not forks) as logger,
         _ensure_one_instance(lock_file, logger),
         _run_server(server_socket, logger) as server,
     ):
+        if not forks:
+            serve(server, logger)
+            return
+
+        def serve_worker(index: int) -> None:
+            # The instance lock stays with the workers too: the instance lasts as long as one of them serves
+            with open_log_pipe(f"{server_socket.stem}.{index}") as worker_logger:
+                serve(server, worker_logger)
+
+        run_workers(forks, serve_worker, logger)
+
+
+def _serve(
+    server: socket.socket,
+    logger: PipeLogger,
+    *,
+    mode: EServerMode,
+    workers: int | None,
+    max_message_size: int,
+    process_workers: int,
+) -> None:
+    """Accept and serve clients on `server` until SIGINT or SIGTERM."""
+    shutdown_event = threading.Event()
 
-        def shutdown(signum: int, _frame: FrameType | None) -> None:
-            logger(f"Received shutdown signal {signum}, exiting...")
-            shutdown_event.set()
+    def shutdown(signum: int, _frame: FrameType | None) -> None:
+        # Logged by the accept loop: the handler may interrupt a thread that holds the log queue lock
+        received_signals.append(signum)
+        shutdown_event.set()
 
-        signal.signal(signal.SIGINT, shutdown)
-        signal.signal(signal.SIGTERM, shutdown)
+    received_signals: list[int] = []
 
-        executor = ThreadPoolExecutor(max_workers=None)
-        _handle_clients(server, logger, executor, shutdown_event)
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    with _start_process_pool(process_workers, logger):
+        executor = ThreadPoolExecutor(max_workers=workers)
+        if mode == EServerMode.EVENT_LOOP:
+            asyncio.run(_serve_event_loop(server, logger, executor, shutdown_event, max_message_size))
+        else:
+            _handle_clients(server, logger, executor, shutdown_event, max_message_size, received_signals)
 
 
 @contextmanager
-def _open_log_pipe(log_pipe_path: Path) -> Iterator[TLogger]:
-    def log(msg: str) -> None:
-        print(msg)
-        log_pipe.write(f"timestamp='{datetime.now().isoformat()}' message='{msg}'\n")
-        log_pipe.flush()
+def _open_log_pipe(
+    log_pipe_path: Path,
+    *,
+    name: str,
+    level: ELogLevel,
+    overflow: EOverflowPolicy,
+    queue_size: int,
+    writer_thread: bool = True,
+    shared: bool = False,
+) -> Iterator[PipeLogger]:
+    """Log into the log server's FIFO or, when `log_pipe_path` is its datagram socket, into the socket as `name`.
 
-    with log_pipe_path.open("w") as log_pipe:
-        yield log
+    With `shared` other processes log into the same FIFO, the records written into it are tagged with `name`.
+    """
+    global _logger
+    with ExitStack() as stack:
+        process = None
+        if log_pipe_path.is_socket():
+            log_pipe: TextIO | DatagramLogStream | FifoLogStream = stack.enter_context(
+                closing(DatagramLogStream(log_pipe_path, name=name))
+            )
+        elif log_pipe_path.is_fifo():
+            log_pipe = stack.enter_context(closing(FifoLogStream(log_pipe_path)))
+            process = name if shared else None
+        else:
+            log_pipe = stack.enter_context(log_pipe_path.open("w"))
+        _logger = PipeLogger(
+            log_pipe,
+            level=level,
+            overflow=overflow,
+            queue_size=queue_size,
+            writer_thread=writer_thread,
+            process=process,
+        )
+        try:
+            yield _logger
+        finally:
+            _logger.close()
 
 
 @contextmanager
@@ -86,6 +288,24 @@ def _ensure_one_instance(lock_file_path: Path, logger: TLogger) -> Iterator[None
             sys.exit(1)
 
 
+@contextmanager
+def _start_process_pool(workers: int, logger: TLogger) -> Iterator[None]:
+    """Without workers the CPU-bound calls run in the executor like the others."""
+    global _process_pool
+    if not workers:
+        yield
+        return
+    _process_pool = ProcessPool(workers)
+    try:
+        # Before the first call, so that none of them waits for a worker to start
+        pids = _process_pool.warm_up()
+        logger(f"Started {len(pids)} worker processes for CPU-bound calls: {pids}")
+        yield
+    finally:
+        _process_pool.close()
+        _process_pool = None
+
+
 @contextmanager
 def _run_server(socket_path: Path, logger: TLogger) -> Iterator[socket.socket]:
     socket_path.parent.mkdir(exist_ok=True, parents=True)
@@ -93,90 +313,590 @@ def _run_server(socket_path: Path, logger: TLogger) -> Iterator[socket.socket]:
         socket_path.unlink()
     with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
         server.bind(socket_path.as_posix())
-        server.listen(5)
+        server.listen(socket.SOMAXCONN)
         logger(f"Starting listening on {socket_path.as_posix()}")
         yield server
 
 
 def _handle_clients(
     server: socket.socket,
-    logger: TLogger,
+    logger: PipeLogger,
     executor: ThreadPoolExecutor,
     shutdown_event: threading.Event,
+    max_message_size: int,
+    received_signals: list[int],
 ) -> None:
     server.settimeout(1.0)
     while not shutdown_event.is_set():
         try:
             client, _ = server.accept()
         except socket.timeout:
-            logger("Server accept timed out, checking shutdown event...")
+            logger.debug("Server accept timed out, checking shutdown event...")
             continue
         logger("Client connected")
-        executor.submit(_handle_client_messages, client, logger, shutdown_event)
+        executor.submit(
+            _handle_client_messages, client, logger, shutdown_event, max_message_size, time.perf_counter_ns()
+        )
+    for signum in received_signals:
+        logger(f"Received shutdown signal {signum}, exiting...")
     logger("Client handler has been shut down")
     executor.shutdown(wait=True)
 
 
-def _handle_client_messages(conn: socket.socket, logger: TLogger, shutdown_event: threading.Event) -> None:
+def _handle_client_messages(
+    conn: socket.socket, logger: PipeLogger, shutdown_event: threading.Event, max_message_size: int, queued_at: int
+) -> None:
+    _metrics.record_queue_wait(time.perf_counter_ns() - queued_at)
+    _metrics.connection_opened()
+    # Open-ended streams are sent from their own threads, every frame is sent under the lock
+    send_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT_PER_CONNECTION)
+    pipelined: list[Future[None]] = []
+    cancels: list[Callable[[], None]] = []
+    pumps: list[threading.Thread] = []
+    subscriptions: dict[int, Subscription] = {}
+    subscriptions_token = _connection_subscriptions.set(subscriptions)
+    reader = FrameReader(conn, logger.debug, max_message_size=max_message_size)
+
+    def respond(call: TCall, decode_ns: int) -> None:
+        handling_at = time.perf_counter_ns()
+        result = _check_streamable(_process_call(call), reader.framing)
+        handler_ns = time.perf_counter_ns() - handling_at
+        logger.debug("Sending response: %s", result)
+        if isinstance(result, StreamedResponse):
+            _record_call(call, result, decode_ns=decode_ns, handler_ns=handler_ns)
+            if result.cancel is None:
+                _send_stream(conn, result, send_lock)
+                return
+            # Keep reading calls (e.g. the unsubscribe one) while the stream lasts
+            cancels.append(result.cancel)
+            pump = threading.Thread(
+                target=_pump_stream, args=(conn, result, send_lock, logger), name="stream", daemon=True
+            )
+            pump.start()
+            pumps.append(pump)
+            return
+        with send_lock:
+            # Under the lock, so that the response is framed the way the client reads it when it arrives
+            encoding_at = time.perf_counter_ns()
+            data = encode_message(result, reader.framing)
+            encode_ns = time.perf_counter_ns() - encoding_at
+            conn.sendall(data)
+            if isinstance(result, NegotiateFramingResponse):
+                reader.framing = EFraming(result.result)
+        _record_call(call, result, decode_ns=decode_ns, handler_ns=handler_ns, encode_ns=encode_ns)
+
+    def respond_pipelined(call: TCall, decode_ns: int) -> None:
+        try:
+            respond(call, decode_ns)
+        except OSError as e:
+            logger.warning("Client error: %s", e)
+        finally:
+            in_flight.release()
+
     with conn:
-        for message in get_messages(conn, shutdown_event, logger):
-            logger(f"Received message: {message}")
-            response = _process_message(message)
-            logger(f"Sending response: {response}")
-            send_message(conn, response)
+        try:
+            for frame in reader.frames(shutdown_event):
+                logger.debug("Received message: %r", frame.body)
+                _check_call_frame(frame)
+                received_at = time.perf_counter_ns()
+                try:
+                    call = CALL_ADAPTER.validate_json(frame.body)
+                except ValidationError as e:
+                    _metrics.record_invalid_call()
+                    with send_lock:
+                        send_message(conn, _invalid_call(frame.body, e), reader.framing)
+                    continue
+                decode_ns = time.perf_counter_ns() - received_at
+                if _is_pipelined(call):
+                    # Stop reading from a client that has too many calls in flight
+                    in_flight.acquire()
+                    pipelined.append(
+                        _pipelined_executor.submit(contextvars.copy_context().run, respond_pipelined, call, decode_ns)
+                    )
+                    pipelined = [future for future in pipelined if not future.done()]
+                else:
+                    respond(call, decode_ns)
+        except (OSError, ProtocolError) as e:
+            logger.warning("Client error: %s", e)
+        finally:
+            wait(pipelined)
+            for cancel in cancels:
+                cancel()
+            close_subscriptions(subscriptions)
+            _connection_subscriptions.reset(subscriptions_token)
+            # Let the streams send their last frames before the connection is closed
+            for pump in pumps:
+                pump.join()
+            _metrics.connection_closed()
     logger("Client handler exited")
 
 
-def _process_message(raw_message: bytes) -> Response:
+def _send_stream(conn: socket.socket, result: StreamedResponse, send_lock: threading.Lock) -> None:
+    request_id = result.response.id or 0
+    with send_lock:
+        send_message(conn, result.response, EFraming.BINARY, flags=FLAG_MORE)
     try:
-        message = json.loads(raw_message)
-        return _handle_message(message)
-    except json.JSONDecodeError:
-        return ErrorResponse(success=False, error="Invalid JSON")
+        for chunk in result.chunks:
+            with send_lock:
+                send_raw(conn, chunk, id=request_id, flags=FLAG_MORE)
+    except OSError:
+        raise
+    # The client is waiting for raw frames, whatever the chunks raise ends the stream with the error instead
+    except Exception as e:  # noqa: BLE001
+        with send_lock:
+            send_message(conn, _stream_error(result, e), EFraming.BINARY)
+        return
+    with send_lock:
+        send_raw(conn, b"", id=request_id)
+
+
+def _pump_stream(conn: socket.socket, result: StreamedResponse, send_lock: threading.Lock, logger: TLogger) -> None:
+    try:
+        _send_stream(conn, result, send_lock)
+    except OSError as e:
+        logger(f"Stream error: {e}")
+    finally:
+        if result.cancel is not None:
+            result.cancel()
+
+
+async def _serve_event_loop(
+    server: socket.socket,
+    logger: PipeLogger,
+    executor: ThreadPoolExecutor,
+    shutdown_event: threading.Event,
+    max_message_size: int,
+) -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    def shutdown(signum: int) -> None:
+        logger(f"Received shutdown signal {signum}, exiting...")
+        shutdown_event.set()
+        stop.set()
+
+    # Replace the `signal.signal` handlers so that a signal wakes the loop up immediately
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, shutdown, signum)
+
+    connections: set[asyncio.Task[None]] = set()
+
+    async def accept_clients() -> None:
+        while True:
+            client, _ = await loop.sock_accept(server)
+            logger("Client connected")
+            task = asyncio.create_task(_serve_client_messages(client, logger, executor, max_message_size))
+            connections.add(task)
+            task.add_done_callback(connections.discard)
+
+    server.setblocking(False)
+    acceptor = asyncio.create_task(accept_clients())
+    await stop.wait()
+
+    acceptor.cancel()
+    for task in connections:
+        task.cancel()
+    await asyncio.gather(acceptor, *connections, return_exceptions=True)
+    logger("Client handler has been shut down")
+    executor.shutdown(wait=True)
+
+
+async def _serve_client_messages(
+    conn: socket.socket, logger: PipeLogger, executor: ThreadPoolExecutor, max_message_size: int
+) -> None:
+    loop = asyncio.get_running_loop()
+    send_lock = asyncio.Lock()
+    in_flight = asyncio.Semaphore(MAX_IN_FLIGHT_PER_CONNECTION)
+    pipelined: set[asyncio.Task[None]] = set()
+    cancels: list[Callable[[], None]] = []
+    subscriptions: dict[int, Subscription] = {}
+    # The task runs in a context of its own, the calls are run in copies of it
+    _connection_subscriptions.set(subscriptions)
+
+    reader = FrameReader(conn, logger.debug, max_message_size=max_message_size)
+
+    async def respond(call: TCall, decode_ns: int) -> None:
+        try:
+            result, handler_ns = await loop.run_in_executor(
+                executor, contextvars.copy_context().run, _run_call, call, time.perf_counter_ns()
+            )
+            result = _check_streamable(result, reader.framing)
+            logger.debug("Sending response: %s", result)
+            if isinstance(result, StreamedResponse):
+                _record_call(call, result, decode_ns=decode_ns, handler_ns=handler_ns)
+                if result.cancel is not None:
+                    # Keep reading calls (e.g. the unsubscribe one) while the stream lasts
+                    cancels.append(result.cancel)
+                    task = asyncio.create_task(send_stream(result))
+                    pipelined.add(task)
+                    task.add_done_callback(pipelined.discard)
+                    return
+                await send_stream(result)
+                return
+            async with send_lock:
+                # Under the lock, so that the response is framed the way the client reads it when it arrives
+                encoding_at = time.perf_counter_ns()
+                data = encode_message(result, reader.framing)
+                encode_ns = time.perf_counter_ns() - encoding_at
+                await loop.sock_sendall(conn, data)
+                if isinstance(result, NegotiateFramingResponse):
+                    reader.framing = EFraming(result.result)
+            _record_call(call, result, decode_ns=decode_ns, handler_ns=handler_ns, encode_ns=encode_ns)
+        finally:
+            in_flight.release()
+
+    async def send_stream(result: StreamedResponse) -> None:
+        request_id = result.response.id or 0
+        # An open-ended stream waits for its chunks, it gets its own thread instead of holding a shared one
+        chunks_executor = executor if result.cancel is None else ThreadPoolExecutor(max_workers=1)
+        async with send_lock:
+            await asend_message(conn, result.response, EFraming.BINARY, flags=FLAG_MORE)
+        try:
+            # Chunks are produced in the executor and sent one by one, the lock is only held per frame
+            # so that other pipelined responses can be interleaved with the stream
+            while (chunk := await loop.run_in_executor(chunks_executor, next, result.chunks, None)) is not None:
+                async with send_lock:
+                    await asend_raw(conn, chunk, id=request_id, flags=FLAG_MORE)
+        # As in `_send_stream`, whatever the chunks raise ends the stream with the error
+        except Exception as e:  # noqa: BLE001
+            async with send_lock:
+                await asend_message(conn, _stream_error(result, e), EFraming.BINARY)
+            return
+        finally:
+            if chunks_executor is not executor:
+                chunks_executor.shutdown(wait=False)
+        async with send_lock:
+            await asend_raw(conn, b"", id=request_id)
+
+    conn.setblocking(False)
+    _metrics.connection_opened()
+    with conn:
+        try:
+            async for frame in reader.aframes():
+                message = frame.body
+                logger.debug("Received message: %r", message)
+                _check_call_frame(frame)
+                # Stop reading from a client that has too many calls in flight
+                await in_flight.acquire()
+                received_at = time.perf_counter_ns()
+                try:
+                    call = CALL_ADAPTER.validate_json(message)
+                except ValidationError as e:
+                    in_flight.release()
+                    _metrics.record_invalid_call()
+                    async with send_lock:
+                        await asend_message(conn, _invalid_call(message, e), reader.framing)
+                    continue
+                decode_ns = time.perf_counter_ns() - received_at
+                if _is_pipelined(call):
+                    task = asyncio.create_task(respond(call, decode_ns))
+                    pipelined.add(task)
+                    task.add_done_callback(pipelined.discard)
+                else:
+                    await respond(call, decode_ns)
+            # Nobody is left to receive the subscriptions
+            for cancel in cancels:
+                cancel()
+            await asyncio.gather(*pipelined, return_exceptions=True)
+        except (OSError, ProtocolError) as e:
+            logger.warning("Client error: %s", e)
+        finally:
+            for cancel in cancels:
+                cancel()
+            for task in pipelined:
+                task.cancel()
+            close_subscriptions(subscriptions)
+            _metrics.connection_closed()
+    logger("Client handler exited")
+
+
+_result_cache: ResultCache[Response] = ResultCache()
+_metrics = MetricsRecorder()
+_logger: PipeLogger | None = None
+# Runs the sub-calls of batches: a batch waits for them, so they cannot take the threads that serve the calls
+_batch_executor = ThreadPoolExecutor(thread_name_prefix="batch")
+# Runs the pipelined calls of threaded connections, which hold the threads of the server's executor
+_pipelined_executor = ThreadPoolExecutor(thread_name_prefix="pipelined")
+_process_pool: ProcessPool | None = None
+# Frame subscriptions of the connection a call is handled for, set by the connection handlers
+_connection_subscriptions: contextvars.ContextVar[dict[int, Subscription]] = contextvars.ContextVar(
+    "connection_subscriptions"
+)
+
+type THandler[C] = Callable[[C], Response | StreamedResponse]
+# Gets the call with a function that allocates the buffer streamed after the response
+type TCpuBoundHandler[C] = Callable[[TAllocate, C], Response]
+
+# Call type -> handler, filled in by `_handles`
+_HANDLERS: dict[ECallType, THandler[Any]] = {}
+
+
+def _handles[C: CallABC[Any]](call_type: ECallType) -> Callable[[THandler[C]], THandler[C]]:
+    def register(handler: THandler[C]) -> THandler[C]:
+        _HANDLERS[call_type] = handler
+        return handler
+
+    return register
+
+
+def _handles_cpu_bound[C: CallABC[Any]](call_type: ECallType) -> Callable[[TCpuBoundHandler[C]], TCpuBoundHandler[C]]:
+    """`_handles` for handlers that would hold the GIL for long: they run in the process pool when there is one."""
+
+    def register(handler: TCpuBoundHandler[C]) -> TCpuBoundHandler[C]:
+        _HANDLERS[call_type] = lambda call: _run_cpu_bound(handler, call)
+        return handler
+
+    return register
+
+
+def _run_cpu_bound[C: CallABC[Any]](handler: TCpuBoundHandler[C], call: C) -> Response | StreamedResponse:
+    if _process_pool is None:
+        response, output = run_here(handler, call)
+    else:
+        # The output comes back in shared memory and is streamed from there
+        response, output = _process_pool.run(handler, call)
+    if output is None:
+        return response
+    return StreamedResponse(response, output.chunks(REGION_CHUNK_SIZE))
+
+
+def _check_call_frame(frame: Frame) -> None:
+    # Raw frames only follow the responses of streamed calls, there are no streamed calls from the clients
+    if frame.type != EFrameType.MESSAGE:
+        raise ProtocolError(f"Unexpected {frame.type.name} frame from a client")
+
+
+def _is_pipelined(call: TCall) -> bool:
+    # Calls with an id are answered in completion order, the client matches them by id. The framing negotiation
+    # is answered before the next frame is read, the frames after it are in the negotiated framing
+    return call.id is not None and not isinstance(call, NegotiateFramingCall)
+
+
+def _run_call(call: TCall, queued_at: int) -> tuple[Response | StreamedResponse, int]:
+    """`_process_call` in an executor, returns the result with the time the handler took."""
+    started_at = time.perf_counter_ns()
+    _metrics.record_queue_wait(started_at - queued_at)
+    result = _process_call(call)
+    return result, time.perf_counter_ns() - started_at
+
+
+def _record_call(
+    call: TCall, result: Response | StreamedResponse, *, decode_ns: int, handler_ns: int, encode_ns: int | None = None
+) -> None:
+    response = result.response if isinstance(result, StreamedResponse) else result
+    _metrics.record_call(
+        call.type,
+        decode_ns=decode_ns,
+        handler_ns=handler_ns,
+        encode_ns=encode_ns,
+        error=isinstance(response, ErrorResponse),
+    )
+
+
+def _process_call(call: TCall) -> Response | StreamedResponse:
+    try:
+        result = _dispatch(call)
     except Exception as e:
-        return ErrorResponse(success=False, error=str(e))
-
-
-def _handle_message(message: dict[str, Any]) -> Response:
-    parsed_message = _parse_message(message)
-    if isinstance(parsed_message, GetMainMonitorParamsCall):
-        params = get_main_monitor_params()
-        return GetMainMonitorParamsResponse(success=True, result=params)
-    if isinstance(parsed_message, GetMainMonitorPixelColorCall):
-        color = get_main_monitor_pixel_color(x=parsed_message.params.x, y=parsed_message.params.y)
-        return GetMainMonitorPixelColorResponse(success=True, result=color)
-    if isinstance(parsed_message, GetProcessIdCall):
-        pid = get_process_id()
-        return GetProcessIdResponse(success=True, result=pid)
-    if isinstance(parsed_message, GetThreadCountCall):
-        thread_count = get_thread_count()
-        return GetThreadCountResponse(success=True, result=thread_count)
-    assert_never(parsed_message)
-
-
-def _parse_message(
-    message: dict[str, Any],
-) -> GetMainMonitorParamsCall | GetMainMonitorPixelColorCall | GetProcessIdCall | GetThreadCountCall:
-    if message["type"] == ECallType.GET_MAIN_MONITOR_PARAMS:
-        return GetMainMonitorParamsCall(type=ECallType.GET_MAIN_MONITOR_PARAMS, params=None)
-
-    if message["type"] == ECallType.GET_MAIN_MONITOR_PIXEL_COLOR:
-        return GetMainMonitorPixelColorCall(
-            type=ECallType.GET_MAIN_MONITOR_PIXEL_COLOR,
-            params=GetMainMonitorPixelColor(
-                x=message["params"]["x"],
-                y=message["params"]["y"],
-            ),
-        )
-    if message["type"] == ECallType.GET_PROCESS_ID:
-        return GetProcessIdCall(type=ECallType.GET_PROCESS_ID, params=None)
-    if message["type"] == ECallType.GET_THREAD_COUNT:
-        return GetThreadCountCall(type=ECallType.GET_THREAD_COUNT, params=None)
-    raise NotImplementedError
+        result = ErrorResponse(success=False, error=str(e))
+    response = result.response if isinstance(result, StreamedResponse) else result
+    response.id = call.id
+    return result
+
+
+def _invalid_call(raw_message: bytes, error: ValidationError) -> ErrorResponse:
+    errors = error.errors(include_url=False)
+    if errors[0]["type"] == "json_invalid":
+        return ErrorResponse(success=False, error="Invalid JSON")
+    details = "; ".join(_describe_validation_error(e) for e in errors)
+    # Echo the id back when there is one, a pipelining client is waiting for it
+    message = json.loads(raw_message)
+    request_id = message.get("id") if isinstance(message, dict) else None
+    return ErrorResponse(
+        success=False, error=f"Invalid call: {details}", id=request_id if isinstance(request_id, int) else None
+    )
+
+
+def _describe_validation_error(error: ErrorDetails) -> str:
+    location = ".".join(map(str, error["loc"]))
+    if error["type"] == "union_tag_invalid":
+        # Nested in a batch the location tells which of its calls
+        message = f"unknown call type {error['ctx']['tag']!r}"
+        return f"{location}: {message}" if location else message
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+
+def _check_streamable(result: Response | StreamedResponse, framing: EFraming) -> Response | StreamedResponse:
+    if isinstance(result, StreamedResponse) and framing != EFraming.BINARY:
+        if result.cancel is not None:
+            result.cancel()
+        return ErrorResponse(success=False, error="The call requires the binary framing", id=result.response.id)
+    return result
+
+
+def _stream_error(result: StreamedResponse, error: Exception) -> ErrorResponse:
+    return ErrorResponse(success=False, error=f"Stream aborted: {error}", id=result.response.id)
+
+
+def _dispatch(call: TCall) -> Response | StreamedResponse:
+    handler = _HANDLERS.get(call.type)
+    if handler is None:
+        raise NotImplementedError(f"No handler for {call.type}")
+    ttl = CACHE_TTLS.get(call.type)
+    if ttl is None:
+        return handler(call)
+    key = (call.type, call.model_dump_json(include={"params"}))
+    # Identical calls share the cached response, every caller gets a copy to set its own id and time on
+    response = _result_cache.get_or_compute(key, lambda: _cacheable(call, handler(call)), ttl)
+    return response.model_copy(update={"timestamp": datetime.now(tz=UTC)})
+
+
+def _cacheable(call: TCall, result: Response | StreamedResponse) -> Response:
+    if isinstance(result, StreamedResponse):
+        raise TypeError(f"Streamed {call.type} calls cannot be cached")
+    return result
+
+
+@_handles(ECallType.GET_MAIN_MONITOR_PARAMS)
+def _handle_get_main_monitor_params(_call: GetMainMonitorParamsCall) -> Response:
+    params = get_main_monitor_params()
+    return GetMainMonitorParamsResponse(success=True, result=params)
+
+
+@_handles_cpu_bound(ECallType.CAPTURE_MAIN_MONITOR_REGION)
+def _handle_capture_main_monitor_region(allocate: TAllocate, call: CaptureMainMonitorRegionCall) -> Response:
+    region = call.params
+    frame = capture_main_monitor_region(
+        allocate, x=region.x, y=region.y, width=region.width, height=region.height, pixel_format=region.pixel_format
+    )
+    return CaptureMainMonitorRegionResponse(success=True, result=frame)
+
+
+@_handles(ECallType.GET_MAIN_MONITOR_PIXEL_COLOR)
+def _handle_get_main_monitor_pixel_color(call: GetMainMonitorPixelColorCall) -> Response:
+    color = get_main_monitor_pixel_color(x=call.params.x, y=call.params.y)
+    return GetMainMonitorPixelColorResponse(success=True, result=color)
+
+
+@_handles(ECallType.GET_MAIN_MONITOR_PIXEL_COLORS)
+def _handle_get_main_monitor_pixel_colors(call: GetMainMonitorPixelColorsCall) -> Response:
+    colors = get_main_monitor_pixel_colors(call.params.points)
+    return GetMainMonitorPixelColorsResponse(success=True, result=colors)
+
+
+@_handles(ECallType.GET_PROCESS_ID)
+def _handle_get_process_id(_call: GetProcessIdCall) -> Response:
+    pid = get_process_id()
+    return GetProcessIdResponse(success=True, result=pid)
+
+
+@_handles(ECallType.GET_THREAD_COUNT)
+def _handle_get_thread_count(_call: GetThreadCountCall) -> Response:
+    thread_count = get_thread_count()
+    return GetThreadCountResponse(success=True, result=thread_count)
+
+
+@_handles(ECallType.NEGOTIATE_FRAMING)
+def _handle_negotiate_framing(call: NegotiateFramingCall) -> Response:
+    framing = _negotiate_framing(call.params.framings)
+    return NegotiateFramingResponse(success=True, result=framing)
+
+
+@_handles(ECallType.SUBSCRIBE_FRAME_CHANGES)
+def _handle_subscribe_frame_changes(call: SubscribeFrameChangesCall) -> StreamedResponse:
+    options = call.params
+    subscription = subscribe_frame_changes(
+        _connection_subscriptions.get(),
+        fps=options.fps,
+        block_size=options.block_size,
+        max_fps=options.max_fps,
+        pixel_format=options.pixel_format,
+    )
+    try:
+        response = SubscribeFrameChangesResponse(success=True, result=subscription.info())
+    except BaseException:
+        subscription.close()
+        raise
+    return StreamedResponse(response, subscription.deltas(), subscription.close)
+
+
+@_handles(ECallType.UNSUBSCRIBE_FRAME_CHANGES)
+def _handle_unsubscribe_frame_changes(call: UnsubscribeFrameChangesCall) -> Response:
+    unsubscribed = unsubscribe_frame_changes(_connection_subscriptions.get(), call.params.subscription_id)
+    return UnsubscribeFrameChangesResponse(success=True, result=unsubscribed)
+
+
+@_handles(ECallType.GET_CACHE_STATS)
+def _handle_get_cache_stats(_call: GetCacheStatsCall) -> Response:
+    return GetCacheStatsResponse(success=True, result=_result_cache.stats())
+
+
+@_handles(ECallType.GET_LOG_STATS)
+def _handle_get_log_stats(_call: GetLogStatsCall) -> Response:
+    if _logger is None:
+        raise RuntimeError("Logging is not set up")
+    return GetLogStatsResponse(success=True, result=_logger.stats())
+
+
+@_handles(ECallType.GET_METRICS)
+def _handle_get_metrics(_call: GetMetricsCall) -> Response:
+    return GetMetricsResponse(success=True, result=_metrics.snapshot())
+
+
+@_handles(ECallType.PING)
+def _handle_ping(_call: PingCall) -> Response:
+    return PingResponse(success=True, result=True)
+
+
+@_handles(ECallType.BATCH)
+def _handle_batch(call: BatchCall) -> Response:
+    first, *rest = call.params.calls
+    futures = [_batch_executor.submit(_process_batched, batched) for batched in rest]
+    # The first one meanwhile runs in this thread
+    results = [_process_batched(first), *(future.result() for future in futures)]
+    return BatchResponse(success=True, result=results)
+
+
+def _process_batched(call: TBatchedCall) -> TBatchedResponse:
+    result = _process_call(call)
+    if isinstance(result, SuccessResponse | ErrorResponse):
+        return result
+    if isinstance(result, StreamedResponse) and result.cancel is not None:
+        result.cancel()
+    return ErrorResponse(success=False, error=f"Streamed {call.type} calls cannot be batched", id=call.id)
+
+
+def _negotiate_framing(offered: list[str]) -> EFraming:
+    for framing in offered:
+        if framing in SUPPORTED_FRAMINGS:
+            return EFraming(framing)
+    return EFraming.JSON_LINES
 
 
 if __name__ == "__main__":
     server_socket_path = Path(os.getenv(SERVER_SOCKER_ENV_VAR, DEFAULT_SERVER_SOCKET))
     lock_file_path = Path(os.getenv(SERVER_LOCK_ENV_VAR, DEFAULT_SERVER_LOCK))
     log_pipe_path = Path(os.getenv(LOG_PIPE_ENV_VAR, DEFAULT_LOG_PIPE))
-    main(server_socket=server_socket_path, lock_file=lock_file_path, log_pipe_path=log_pipe_path)
+    server_mode = EServerMode(os.getenv(SERVER_MODE_ENV_VAR, DEFAULT_SERVER_MODE))
+    server_workers = int(workers_env) if (workers_env := os.getenv(SERVER_WORKERS_ENV_VAR)) else None
+    server_max_message_size = int(os.getenv(SERVER_MAX_MESSAGE_SIZE_ENV_VAR, DEFAULT_MAX_MESSAGE_SIZE))
+    server_cache_size = int(os.getenv(SERVER_CACHE_SIZE_ENV_VAR, DEFAULT_SERVER_CACHE_SIZE))
+    server_log_level = ELogLevel[os.getenv(SERVER_LOG_LEVEL_ENV_VAR, DEFAULT_SERVER_LOG_LEVEL).upper()]
+    server_log_overflow = EOverflowPolicy(os.getenv(SERVER_LOG_OVERFLOW_ENV_VAR, DEFAULT_SERVER_LOG_OVERFLOW))
+    server_log_queue_size = int(os.getenv(SERVER_LOG_QUEUE_SIZE_ENV_VAR, DEFAULT_SERVER_LOG_QUEUE_SIZE))
+    server_process_workers = int(os.getenv(SERVER_PROCESS_WORKERS_ENV_VAR, DEFAULT_SERVER_PROCESS_WORKERS))
+    server_forks = int(os.getenv(SERVER_FORKS_ENV_VAR, DEFAULT_SERVER_FORKS))
+    main(
+        server_socket=server_socket_path,
+        lock_file=lock_file_path,
+        log_pipe_path=log_pipe_path,
+        mode=server_mode,
+        workers=server_workers,
+        max_message_size=server_max_message_size,
+        cache_size=server_cache_size,
+        log_level=server_log_level,
+        log_overflow=server_log_overflow,
+        log_queue_size=server_log_queue_size,
+        process_workers=server_process_workers,
+        forks=server_forks,
+    )
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from concurrent.futures import Future
+
+from consts import DEFAULT_SERVER_CACHE_SIZE
+from models.common import CacheStats
+
+
+class ResultCache[T]:
+    """Bounded LRU cache of call results with a TTL per entry.
+
+    Concurrent misses on the same key are coalesced: the first caller computes the value while the others
+    wait for it, so a burst of identical calls costs one execution. Failed computations are not cached,
+    every waiter gets the exception.
+    """
+
+    def __init__(self, *, max_entries: int = DEFAULT_SERVER_CACHE_SIZE) -> None:
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (expires at, value), the most recently used entries are at the end
+        self._entries: OrderedDict[Hashable, tuple[float, T]] = OrderedDict()
+        self._in_flight: dict[Hashable, Future[T]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], T], ttl: float) -> T:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+            waiting = self._in_flight.get(key)
+            if waiting is None:
+                self._misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self._coalesced += 1
+        if waiting is not None:
+            return waiting.result()
+        return self._compute(key, compute, ttl, future)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                coalesced=self._coalesced,
+                evictions=self._evictions,
+                size=len(self._entries),
+                max_size=self._max_entries,
+            )
+
+    def _compute(self, key: Hashable, compute: Callable[[], T], ttl: float, future: Future[T]) -> T:
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            if ttl > 0:
+                self._entries[key] = (time.monotonic() + ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        future.set_result(value)
+        return value
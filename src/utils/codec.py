@@ -0,0 +1,60 @@
+import functools
+import json
+from typing import Any
+
+from pydantic import TypeAdapter
+
+from models.request import CallABC
+from models.response import ErrorResponse, Response
+from utils.messagging import DELIMITER, EFrameType, EFraming, encode_frame
+
+# Encoded calls without params up to their id, they only differ in it
+_constant_prefixes: dict[type[CallABC[Any]], bytes] = {}
+
+
+class CallError(RuntimeError):
+    """The server answered a call with an ErrorResponse."""
+
+
+@functools.cache
+def response_adapter[T: Response](expected_response: type[T]) -> TypeAdapter[T | ErrorResponse]:
+    # Building an adapter compiles a validator, it is done once per response type
+    return TypeAdapter(expected_response | ErrorResponse)
+
+
+def decode_response[T: Response](raw: bytes, expected_response: type[T]) -> T | ErrorResponse:
+    return response_adapter(expected_response).validate_json(raw)
+
+
+def decode_result(raw: bytes) -> Any:
+    """Only the plain JSON `result` of a response, no response model is built; raises CallError on errors."""
+    message = json.loads(raw)
+    if not message.get("success"):
+        raise CallError(message.get("error"))
+    return message["result"]
+
+
+def encode_call(call: CallABC[Any], framing: EFraming = EFraming.JSON_LINES, *, id: int | None = None) -> bytes:
+    """Encode a call with `id` (the call's own one by default).
+
+    Calls without params are serialized once per type, later only their id is appended.
+    """
+    request_id = call.id if id is None else id
+    body = _encode_prefix(call) + (b"null" if request_id is None else str(request_id).encode()) + b"}"
+    if framing == EFraming.BINARY:
+        return encode_frame(EFrameType.MESSAGE, body, id=request_id or 0)
+    return body + DELIMITER
+
+
+def _encode_prefix(call: CallABC[Any]) -> bytes:
+    if call.params is not None:
+        return _dump_prefix(call)
+    prefix = _constant_prefixes.get(type(call))
+    if prefix is None:
+        prefix = _constant_prefixes[type(call)] = _dump_prefix(call)
+    return prefix
+
+
+def _dump_prefix(call: CallABC[Any]) -> bytes:
+    # `{"type":...,"params":...}` without the closing brace, the id is the last field
+    return call.model_dump_json(exclude={"id"}).encode()[:-1] + b',"id":'
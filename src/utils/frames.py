@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import itertools
+import struct
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+
+from models.common import EPixelFormat, FrameSubscription
+from utils.monitor import REGION_CHUNK_SIZE, bgra2rgb, capture_main_monitor, get_main_monitor_params
+
+# Sequence number, frames coalesced into this delta, rectangle count
+DELTA_HEADER = struct.Struct("!IIH")
+# x, y, width, height
+RECT = struct.Struct("!HHHH")
+
+_BGRA_BYTES = 4
+
+
+class Rect(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class FrameDelta(NamedTuple):
+    seq: int
+    # Captured frames merged into this delta because the subscriber was not ready for them
+    dropped: int
+    # Changed rectangles with their pixels, rows top to bottom
+    rects: list[tuple[Rect, bytes]]
+
+
+def diff_blocks(previous: bytearray, current: bytearray, *, width: int, height: int, block_size: int) -> set[int]:
+    """Indices (row-major) of the `block_size` square blocks that differ between two BGRA frames.
+
+    Whole rows are compared first with one memcmp each; only changed rows are compared block by block.
+    """
+    row_size = width * _BGRA_BYTES
+    block_bytes = block_size * _BGRA_BYTES
+    blocks_per_row = -(-width // block_size)
+    dirty: set[int] = set()
+    for y in range(height):
+        start = y * row_size
+        end = start + row_size
+        if previous[start:end] == current[start:end]:
+            continue
+        first = y // block_size * blocks_per_row
+        for index, offset in enumerate(range(start, end, block_bytes), first):
+            if index not in dirty and previous[offset : offset + block_bytes] != current[offset : offset + block_bytes]:
+                dirty.add(index)
+    return dirty
+
+
+def blocks_to_rects(blocks: Iterable[int], *, width: int, height: int, block_size: int) -> list[Rect]:
+    """Merge horizontally adjacent blocks into rectangles clipped to the frame."""
+    blocks_per_row = -(-width // block_size)
+    rects: list[Rect] = []
+    for by, row in itertools.groupby(sorted(blocks), key=lambda index: index // blocks_per_row):
+        columns = [index % blocks_per_row for index in row]
+        # Consecutive columns share the same `column - position` key
+        for _, run in itertools.groupby(enumerate(columns), key=lambda item: item[1] - item[0]):
+            run_columns = [column for _, column in run]
+            x, y = run_columns[0] * block_size, by * block_size
+            rect_width = min((run_columns[-1] + 1) * block_size, width) - x
+            rects.append(Rect(x, y, rect_width, min(block_size, height - y)))
+    return rects
+
+
+def encode_frame_delta(
+    *,
+    seq: int,
+    dropped: int,
+    rects: list[Rect],
+    frame: bytearray,
+    width: int,
+    pixel_format: EPixelFormat,
+    chunk_size: int = REGION_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Header and rectangles first, then the pixels of the rectangles in chunks of about `chunk_size` bytes."""
+    yield DELTA_HEADER.pack(seq, dropped, len(rects)) + b"".join(RECT.pack(*rect) for rect in rects)
+    row_size = width * _BGRA_BYTES
+    parts: list[bytearray] = []
+    size = 0
+    for rect in rects:
+        for y in range(rect.y, rect.y + rect.height):
+            start = y * row_size + rect.x * _BGRA_BYTES
+            parts.append(frame[start : start + rect.width * _BGRA_BYTES])
+            size += rect.width * _BGRA_BYTES
+            if size >= chunk_size:
+                yield _convert(b"".join(parts), pixel_format)
+                parts, size = [], 0
+    if parts:
+        yield _convert(b"".join(parts), pixel_format)
+
+
+def read_frame_deltas(chunks: Iterable[bytes], pixel_format: EPixelFormat) -> Iterator[FrameDelta]:
+    """Reassemble the deltas of a subscription from the raw chunks they are streamed in."""
+    bytes_per_pixel = _BGRA_BYTES if pixel_format == EPixelFormat.BGRA else 3
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while (decoded := _decode_frame_delta(buffer, bytes_per_pixel)) is not None:
+            delta, size = decoded
+            del buffer[:size]
+            yield delta
+
+
+def _decode_frame_delta(data: bytearray, bytes_per_pixel: int) -> tuple[FrameDelta, int] | None:
+    """Decode the delta at the start of `data`, return it with its size or None if it is incomplete."""
+    if len(data) < DELTA_HEADER.size:
+        return None
+    seq, dropped, count = DELTA_HEADER.unpack_from(data)
+    offset = DELTA_HEADER.size
+    if len(data) < offset + count * RECT.size:
+        return None
+    rects = [Rect(*RECT.unpack_from(data, offset + index * RECT.size)) for index in range(count)]
+    offset += count * RECT.size
+    if len(data) < offset + sum(rect.width * rect.height for rect in rects) * bytes_per_pixel:
+        return None
+    pixels = []
+    for rect in rects:
+        size = rect.width * rect.height * bytes_per_pixel
+        pixels.append((rect, bytes(data[offset : offset + size])))
+        offset += size
+    return FrameDelta(seq, dropped, pixels), offset
+
+
+def _convert(bgra: bytes, pixel_format: EPixelFormat) -> bytes:
+    return bgra if pixel_format == EPixelFormat.BGRA else bytes(bgra2rgb(bgra))
+
+
+class Subscription:
+    """Changes accumulated for one subscriber since the last delta it was sent.
+
+    A subscriber that is slower than the capture rate (or its own `max_fps`) does not queue frames up:
+    the dirty blocks of the frames it missed are merged and sent once with the latest pixels.
+    """
+
+    def __init__(
+        self,
+        publisher: _FramePublisher,
+        subscriptions: dict[int, Subscription],
+        *,
+        max_fps: float | None,
+        pixel_format: EPixelFormat,
+        id: int,
+    ) -> None:
+        self.id = id
+        self.pixel_format = pixel_format
+        self._publisher = publisher
+        self._subscriptions = subscriptions
+        self._min_interval = 1 / max_fps if max_fps else 0.0
+        self._condition = threading.Condition()
+        self._dirty: set[int] = set()
+        self._frame = bytearray()
+        self._width = self._height = 0
+        self._dropped = 0
+        self._next_send_at = 0.0
+        self._closed = False
+        self._error: Exception | None = None
+
+    def info(self) -> FrameSubscription:
+        monitor = get_main_monitor_params()
+        return FrameSubscription(
+            subscription_id=self.id,
+            width=monitor.width,
+            height=monitor.height,
+            block_size=self._publisher.block_size,
+            pixel_format=self.pixel_format,
+        )
+
+    def deltas(self) -> Iterator[bytes]:
+        """Block until there are changes, yield them encoded in chunks; ends when the subscription is closed."""
+        try:
+            for seq in itertools.count():
+                with self._condition:
+                    while not self._closed:
+                        if self._dirty:
+                            delay = self._next_send_at - time.monotonic()
+                            if delay <= 0:
+                                break
+                            self._condition.wait(delay)
+                        else:
+                            self._condition.wait()
+                    if self._error is not None:
+                        raise self._error
+                    if self._closed:
+                        return
+                    dirty, frame, width, height, dropped = (
+                        self._dirty,
+                        self._frame,
+                        self._width,
+                        self._height,
+                        self._dropped,
+                    )
+                    self._dirty, self._dropped = set(), 0
+                    self._next_send_at = time.monotonic() + self._min_interval
+                rects = blocks_to_rects(dirty, width=width, height=height, block_size=self._publisher.block_size)
+                yield from encode_frame_delta(
+                    seq=seq, dropped=dropped, rects=rects, frame=frame, width=width, pixel_format=self.pixel_format
+                )
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._publisher.remove(self)
+        with _registry_lock:
+            self._subscriptions.pop(self.id, None)
+            # Dropped once idle, its capture thread stops by itself: `fps` is any rate a client asks for
+            key = (self._publisher.fps, self._publisher.block_size)
+            if self._publisher.idle and _publishers.get(key) is self._publisher:
+                del _publishers[key]
+
+    def _mark(self, blocks: set[int], frame: bytearray, width: int, height: int) -> None:
+        with self._condition:
+            if self._dirty:
+                self._dropped += 1
+            self._dirty |= blocks
+            self._frame, self._width, self._height = frame, width, height
+            self._condition.notify()
+
+    def _fail(self, error: Exception) -> None:
+        with self._condition:
+            self._error = error
+            self._closed = True
+            self._condition.notify_all()
+
+
+class _FramePublisher:
+    """Captures the main monitor at a fixed rate while it has subscribers and hands them the changed blocks."""
+
+    def __init__(self, *, fps: float, block_size: int) -> None:
+        self.fps = fps
+        self.block_size = block_size
+        self.size = (0, 0)
+        self._interval = 1 / fps
+        self._lock = threading.Lock()
+        self._subscribers: set[Subscription] = set()
+        self._frame: bytearray | None = None
+        self._thread: threading.Thread | None = None
+
+    def add(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._frame is not None:
+                # A new subscriber starts with the whole frame
+                subscription._mark(self._all_blocks(), self._frame, *self.size)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="frame-publisher", daemon=True)
+                self._thread.start()
+
+    def remove(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def idle(self) -> bool:
+        with self._lock:
+            return not self._subscribers
+
+    def _all_blocks(self) -> set[int]:
+        width, height = self.size
+        return set(range(-(-width // self.block_size) * -(-height // self.block_size)))
+
+    def _run(self) -> None:
+        next_capture_at = time.monotonic()
+        while True:
+            try:
+                frame, width, height = capture_main_monitor()
+            # Whatever the capture raises, the streams of the current subscribers end with the error
+            except Exception as e:  # noqa: BLE001
+                with self._lock:
+                    subscribers, self._subscribers = self._subscribers, set()
+                    self._thread, self._frame = None, None
+                for subscription in subscribers:
+                    subscription._fail(e)
+                return
+            with self._lock:
+                if not self._subscribers:
+                    # Stop capturing, the next subscriber starts a new thread from a clean state
+                    self._thread, self._frame = None, None
+                    return
+                previous, self._frame = self._frame, frame
+                if previous is None or (width, height) != self.size:
+                    self.size = (width, height)
+                    dirty = self._all_blocks()
+                else:
+                    dirty = diff_blocks(previous, frame, width=width, height=height, block_size=self.block_size)
+                if dirty:
+                    for subscription in self._subscribers:
+                        subscription._mark(dirty, frame, width, height)
+            next_capture_at = max(next_capture_at + self._interval, time.monotonic())
+            time.sleep(next_capture_at - time.monotonic())
+
+
+_registry_lock = threading.Lock()
+_publishers: dict[tuple[float, int], _FramePublisher] = {}
+_subscription_ids = itertools.count(1)
+
+
+def subscribe_frame_changes(
+    subscriptions: dict[int, Subscription],
+    *,
+    fps: float,
+    block_size: int,
+    max_fps: float | None,
+    pixel_format: EPixelFormat,
+) -> Subscription:
+    """Subscribers with the same capture rate and block size share one capture thread.
+
+    `subscriptions` are those of one client, the subscription is in there until it is closed.
+    """
+    with _registry_lock:
+        publisher = _publishers.setdefault((fps, block_size), _FramePublisher(fps=fps, block_size=block_size))
+        subscription = Subscription(
+            publisher, subscriptions, max_fps=max_fps, pixel_format=pixel_format, id=next(_subscription_ids)
+        )
+        subscriptions[subscription.id] = subscription
+        # Under the registry lock, so that the publisher is not dropped as idle meanwhile
+        publisher.add(subscription)
+    return subscription
+
+
+def unsubscribe_frame_changes(subscriptions: dict[int, Subscription], subscription_id: int) -> bool:
+    """False if there is no such subscription in `subscriptions`, the ones of other clients included."""
+    with _registry_lock:
+        subscription = subscriptions.get(subscription_id)
+    if subscription is None:
+        return False
+    subscription.close()
+    return True
+
+
+def close_subscriptions(subscriptions: dict[int, Subscription]) -> None:
+    with _registry_lock:
+        closing = list(subscriptions.values())
+    for subscription in closing:
+        subscription.close()
@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from enum import StrEnum
+from typing import NamedTuple
+
+from models.common import HealthStats
+from utils.metrics import Histogram
+
+
+class ECircuitState(StrEnum):
+    # The backend answers, calls go through
+    CLOSED = "closed"
+    # The backend is down, calls fail fast until the next reconnect attempt is due
+    OPEN = "open"
+    # A reconnect attempt is in progress, other calls keep failing fast until it is over
+    HALF_OPEN = "half_open"
+
+
+class HealthOptions(NamedTuple):
+    # Seconds between two health probes of a backend that answers
+    probe_interval: float = 5
+    # Seconds a probe waits for the answer to its ping
+    probe_timeout: float = 1
+    # Failed calls or probes in a row that open the circuit
+    failure_threshold: int = 3
+    # Reconnect attempts are `backoff_base * 2**attempt` seconds apart at most, with full jitter
+    backoff_base: float = 0.1
+    backoff_max: float = 10
+
+
+DEFAULT_HEALTH_OPTIONS = HealthOptions()
+
+
+class CircuitOpenError(ConnectionError): ...
+
+
+def backoff_delay(attempt: int, options: HealthOptions) -> float:
+    """Exponential backoff with full jitter: spread out over the whole range, clients that lost the same backend
+    do not all come back at the same moment."""
+    return random.uniform(0, min(options.backoff_max, options.backoff_base * 2**attempt))
+
+
+class CircuitBreaker:
+    """Health of one backend: fails calls fast while it is down and lets a reconnect attempt through once the
+    backoff is over.
+
+    Whoever gets the attempt through `check` (a health probe or a call) reports how it went, like any other
+    call, with `record_success` or `record_failure`; `guard` does both. Thread safe.
+    """
+
+    def __init__(self, name: str, options: HealthOptions = DEFAULT_HEALTH_OPTIONS) -> None:
+        self._name = name
+        self._options = options
+        self._lock = threading.Lock()
+        self._state = ECircuitState.CLOSED
+        self._failures = 0
+        self._last_error: str | None = None
+        self._attempts = 0
+        self._total_attempts = 0
+        # perf_counter_ns of the circuit opening and of the next reconnect attempt
+        self._opened_at = 0
+        self._retry_at = 0
+        self._probes = Histogram()
+        self._reconnects = Histogram()
+
+    @property
+    def state(self) -> ECircuitState:
+        return self._state
+
+    @property
+    def options(self) -> HealthOptions:
+        return self._options
+
+    def check(self) -> None:
+        """Raises CircuitOpenError while the backend is down, except for the reconnect attempt once it is due."""
+        with self._lock:
+            if self._state == ECircuitState.CLOSED:
+                return
+            if self._state == ECircuitState.OPEN and time.perf_counter_ns() >= self._retry_at:
+                self._state = ECircuitState.HALF_OPEN
+                self._total_attempts += 1
+                return
+            raise CircuitOpenError(f"{self._name} is down ({self._last_error}), retrying in {self._retry_in():.1f}s")
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """`check`, then record how the call went.
+
+        Only connection errors are failures, a backend that answers with an error is up; any other exception
+        gives a reconnect attempt back without a verdict.
+        """
+        self.check()
+        try:
+            yield
+        except (OSError, EOFError) as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            with self._lock:
+                if self._state == ECircuitState.HALF_OPEN:
+                    self._state = ECircuitState.OPEN
+            raise
+        self.record_success()
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != ECircuitState.CLOSED:
+                self._reconnects.record(time.perf_counter_ns() - self._opened_at)
+            self._state = ECircuitState.CLOSED
+            self._failures = self._attempts = 0
+
+    def record_failure(self, error: BaseException) -> bool:
+        """Returns whether this failure opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error) or type(error).__name__
+            # Already open: a call that was in flight, the next attempt stays where it is
+            if self._state == ECircuitState.OPEN:
+                return False
+            if self._state == ECircuitState.CLOSED and self._failures < self._options.failure_threshold:
+                return False
+            now = time.perf_counter_ns()
+            opened = self._state == ECircuitState.CLOSED
+            if opened:
+                self._opened_at = now
+            else:
+                # The reconnect attempt failed, the next one waits longer
+                self._attempts += 1
+            self._state = ECircuitState.OPEN
+            self._retry_at = now + round(backoff_delay(self._attempts, self._options) * 1e9)
+            return opened
+
+    def record_probe(self, ns: int) -> None:
+        with self._lock:
+            self._probes.record(ns)
+
+    def next_probe_in(self) -> float:
+        """Seconds until the next probe, or until the reconnect attempt while the circuit is open."""
+        with self._lock:
+            return self._retry_in() if self._state == ECircuitState.OPEN else self._options.probe_interval
+
+    def stats(self) -> HealthStats:
+        with self._lock:
+            return HealthStats(
+                state=self._state,
+                consecutive_failures=self._failures,
+                last_error=self._last_error,
+                retry_in=self._retry_in() if self._state == ECircuitState.OPEN else None,
+                reconnect_attempts=self._total_attempts,
+                probes=self._probes.snapshot(),
+                reconnects=self._reconnects.snapshot(),
+            )
+
+    def _retry_in(self) -> float:
+        return max(0.0, (self._retry_at - time.perf_counter_ns()) / 1e9)
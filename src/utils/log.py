@@ -1,2 +1,246 @@
+import os
+import queue
+import select
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+from enum import IntEnum, StrEnum
+from pathlib import Path
+from typing import Any, TextIO
+
+from models.common import LogStats
+
+
 def log(msg: str) -> None:
     print(msg)
+
+
+class ELogLevel(IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+
+class EOverflowPolicy(StrEnum):
+    # Wait for room in the queue, nothing is lost but a slow log reader slows the caller down
+    BLOCK = "block"
+    # Drop the records that do not fit
+    DROP = "drop"
+    # Keep one in `sample_rate` of the records that do not fit (waiting for room for it), drop the rest
+    SAMPLE = "sample"
+
+
+# Largest datagram sent to a log socket, the batches are split on line boundaries to fit
+DATAGRAM_SIZE = 64 * 1024
+
+
+class DatagramLogStream:
+    """Write-only text stream to a log server's Unix datagram socket, every flush sends whole lines.
+
+    The socket is bound to the abstract address `name`, the log server tags the records with it.
+    Nothing blocks on a missing log server, the records are lost instead.
+    """
+
+    def __init__(self, path: Path, *, name: str) -> None:
+        self._path = str(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self._socket.bind(f"\0{name}")
+        except OSError:
+            pass  # Taken by another process, the records are tagged as unnamed
+        self._pending: list[str] = []
+
+    def write(self, text: str) -> int:
+        self._pending.append(text)
+        return len(text)
+
+    def flush(self) -> None:
+        data = "".join(self._pending).encode()
+        self._pending.clear()
+        while data:
+            end = len(data)
+            if end > DATAGRAM_SIZE:
+                end = data.rfind(b"\n", 0, DATAGRAM_SIZE) + 1 or DATAGRAM_SIZE
+            self._socket.sendto(data[:end], self._path)
+            data = data[end:]
+
+    def close(self) -> None:
+        self._socket.close()
+
+
+class FifoLogStream:
+    """Write-only text stream to a log server's FIFO, every flush writes whole lines.
+
+    The lines are written unbuffered, at most PIPE_BUF bytes at a time: such writes are never interleaved with
+    those of the other processes writing to the FIFO. Only a line longer than that can be.
+    """
+
+    def __init__(self, path: Path) -> None:
+        # Blocks until the log server opens the FIFO for reading
+        self._fd = os.open(path, os.O_WRONLY)
+        self._pending: list[str] = []
+
+    def write(self, text: str) -> int:
+        self._pending.append(text)
+        return len(text)
+
+    def flush(self) -> None:
+        data = "".join(self._pending).encode()
+        self._pending.clear()
+        while data:
+            end = len(data)
+            if end > select.PIPE_BUF:
+                end = data.rfind(b"\n", 0, select.PIPE_BUF) + 1 or data.find(b"\n") + 1 or len(data)
+            data = data[os.write(self._fd, data[:end]) :]
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+# (time, level, message, args)
+type _TRecord = tuple[float, ELogLevel, str, tuple[Any, ...]]
+
+
+class PipeLogger:
+    """Logs through a bounded queue, a background thread formats the records and writes them in batches.
+
+    Callers only pay for the level check and a queue put: `%`-style args are formatted by the writer, and
+    only for the records that pass the level. Warnings and errors are never dropped, whatever the policy.
+    Calling the logger directly logs at INFO, so it can be passed wherever a `TLogger` is expected.
+
+    Without `writer_thread` the callers write their records themselves, for processes that fork: a thread that
+    holds a lock (e.g. the one of stdout) at the fork leaves it locked for good in the child. With `process` every
+    record says which process it comes from, for processes that share a stream.
+    """
+
+    def __init__(
+        self,
+        stream: TextIO | DatagramLogStream | FifoLogStream,
+        *,
+        level: ELogLevel = ELogLevel.INFO,
+        queue_size: int = 10_000,
+        overflow: EOverflowPolicy = EOverflowPolicy.DROP,
+        sample_rate: int = 10,
+        batch_size: int = 512,
+        echo: bool = True,
+        writer_thread: bool = True,
+        process: str | None = None,
+    ) -> None:
+        self.level = level
+        self._process = f" process='{process}'" if process is not None else ""
+        self._stream = stream
+        self._overflow = overflow
+        self._sample_rate = sample_rate
+        self._batch_size = batch_size
+        self._echo = echo
+        self._queue: queue.Queue[_TRecord | None] = queue.Queue(maxsize=queue_size)
+        self._counters_lock = threading.Lock()
+        self._overflowed = 0
+        self._dropped = 0
+        self._reported_dropped = 0
+        self._written = 0
+        self._writer: threading.Thread | None = None
+        if writer_thread:
+            self._writer = threading.Thread(target=self._write_records, name="log-writer", daemon=True)
+            self._writer.start()
+
+    def __call__(self, msg: str) -> None:
+        self.log(ELogLevel.INFO, msg)
+
+    def debug(self, msg: str, *args: Any) -> None:
+        self.log(ELogLevel.DEBUG, msg, *args)
+
+    def info(self, msg: str, *args: Any) -> None:
+        self.log(ELogLevel.INFO, msg, *args)
+
+    def warning(self, msg: str, *args: Any) -> None:
+        self.log(ELogLevel.WARNING, msg, *args)
+
+    def error(self, msg: str, *args: Any) -> None:
+        self.log(ELogLevel.ERROR, msg, *args)
+
+    def log(self, level: ELogLevel, msg: str, *args: Any) -> None:
+        if level < self.level:
+            return
+        record = (time.time(), level, msg, args)
+        if self._writer is None:
+            with self._counters_lock:
+                self._write(self._format(record))
+                self._written += 1
+            return
+        if self._overflow == EOverflowPolicy.BLOCK or level >= ELogLevel.WARNING:
+            self._queue.put(record)
+            return
+        try:
+            self._queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        with self._counters_lock:
+            self._overflowed += 1
+            keep = self._overflow == EOverflowPolicy.SAMPLE and self._overflowed % self._sample_rate == 0
+            if not keep:
+                self._dropped += 1
+        if keep:
+            self._queue.put(record)
+
+    def stats(self) -> LogStats:
+        with self._counters_lock:
+            return LogStats(
+                level=self.level.name.lower(),
+                written=self._written,
+                dropped=self._dropped,
+                queued=self._queue.qsize(),
+            )
+
+    def close(self) -> None:
+        """Write out everything queued so far and stop the writer."""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_records(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # Take whatever else is already queued, one write and flush for all of it
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closed = batch[-1] is None
+            records = [record for record in batch if record is not None]
+            lines = [self._format(record) for record in records]
+            with self._counters_lock:
+                dropped = self._dropped - self._reported_dropped
+                self._reported_dropped = self._dropped
+            if dropped:
+                lines.append(self._format((time.time(), ELogLevel.WARNING, "Dropped %d log records", (dropped,))))
+            self._write("".join(lines))
+            with self._counters_lock:
+                self._written += len(records)
+            if closed:
+                return
+
+    def _write(self, text: str) -> None:
+        if self._echo:
+            sys.stdout.write(text)
+        try:
+            self._stream.write(text)
+            self._stream.flush()
+        except OSError as e:
+            print(f"Log write failed: {e}", file=sys.stderr)
+
+    def _format(self, record: _TRecord) -> str:
+        created, level, msg, args = record
+        if args:
+            try:
+                msg = msg % args
+            except (TypeError, ValueError):
+                msg = f"{msg} {args!r}"
+        timestamp = datetime.fromtimestamp(created).isoformat()
+        return f"timestamp='{timestamp}' level='{level.name}' message='{msg}'{self._process}\n"
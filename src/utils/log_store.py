@@ -0,0 +1,223 @@
+import bisect
+import gzip
+import mmap
+import struct
+import time
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO
+
+# Sparse index entry: timestamp of a line (microseconds since the epoch, naive local time) and its offset in the segment.
+# Keys never decrease within an index, a line that arrived later than newer ones is indexed with the newest key
+INDEX_ENTRY = struct.Struct("!qQ")
+
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+# Closed segments compressed in the background, their indexes keep the offsets of the uncompressed data
+COMPRESSED_SUFFIX = ".log.gz"
+
+# How much of a segment is read at once when streaming it
+READ_SIZE = 256 * 1024
+
+_TIMESTAMP_FIELD = b"timestamp='"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def store_directory(log_file_path: Path) -> Path:
+    """Directory of the segments that replace `log_file_path`: `logs/servers.log` -> `logs/servers`."""
+    return log_file_path.with_suffix("")
+
+
+def segment_path(directory: Path, seq: int, *, compressed: bool = False) -> Path:
+    return directory / f"{seq:010d}{COMPRESSED_SUFFIX if compressed else SEGMENT_SUFFIX}"
+
+
+def segment_seq(segment: Path) -> int:
+    return int(segment.name.split(".", 1)[0])
+
+
+def index_path(segment: Path) -> Path:
+    return segment.with_name(f"{segment.name.split('.', 1)[0]}{INDEX_SUFFIX}")
+
+
+def is_compressed(segment: Path) -> bool:
+    return segment.name.endswith(COMPRESSED_SUFFIX)
+
+
+def list_segments(directory: Path) -> list[Path]:
+    """Segments from the oldest to the newest, the last one is being written to.
+
+    A segment caught in the middle of its compression is listed once, uncompressed.
+    """
+    segments: dict[int, Path] = {}
+    for segment in directory.glob(f"*{COMPRESSED_SUFFIX}"):
+        segments[segment_seq(segment)] = segment
+    for segment in directory.glob(f"*{SEGMENT_SUFFIX}"):
+        segments[segment_seq(segment)] = segment
+    return [segments[seq] for seq in sorted(segments)]
+
+
+def find_timestamp(data: bytes, *, last: bool = False) -> bytes | None:
+    """The raw `timestamp='...'` value of the first (or the `last`) line in `data` that has one."""
+    position = data.rfind(_TIMESTAMP_FIELD) if last else data.find(_TIMESTAMP_FIELD)
+    if position == -1:
+        return None
+    position += len(_TIMESTAMP_FIELD)
+    end = data.find(b"'", position)
+    return data[position:end] if end != -1 else None
+
+
+def to_micros(moment: datetime) -> int:
+    """Index key of a (naive, local) time."""
+    return (moment.replace(tzinfo=None) - _EPOCH) // timedelta(microseconds=1)
+
+
+def parse_timestamp(raw: bytes) -> int | None:
+    try:
+        return to_micros(datetime.fromisoformat(raw.decode()))
+    except ValueError:
+        return None
+
+
+def read_range(directory: Path, start: datetime, end: datetime) -> Iterator[bytes]:
+    """Lines (with their newlines) of a segmented log with timestamps in [start, end), in the order they were written.
+
+    The first segment and the position in it are found by binary search on the memory-mapped indexes, so the
+    cost depends on the size of the result, not of the log; a compressed segment also costs decompressing it
+    up to that position. Records are ordered by time within
+    a log server flush, one that arrived later than newer ones may be missed at the edges of the range.
+    """
+    start_key, end_key = to_micros(start), to_micros(end)
+    # ISO timestamps in one format order the same as strings
+    start_raw, end_raw = start.replace(tzinfo=None).isoformat().encode(), end.replace(tzinfo=None).isoformat().encode()
+    segments = list_segments(directory)
+    first = max(0, bisect.bisect_right(segments, start_key, key=_first_key) - 1)
+    for segment in segments[first:]:
+        if _first_key(segment) >= end_key:
+            return
+        start_offset, stop_offset = _span(segment, start_key, end_key)
+        for line in _segment_lines(segment, start_offset, stop_offset):
+            raw = find_timestamp(line)
+            if raw is not None and start_raw <= raw < end_raw:
+                yield line
+
+
+def iter_lines(directory: Path, *, follow: bool = False, poll_interval: float = 0.5) -> Iterator[bytes]:
+    """All the lines of a segmented log, oldest first, across compressed and live segments.
+
+    With `follow` it does not stop at the end of the live segment but waits for more lines, like `tail -f`.
+    """
+    seq = -1
+    while True:
+        segments = [segment for segment in list_segments(directory) if segment_seq(segment) > seq]
+        if not segments:
+            if not follow:
+                return
+            time.sleep(poll_interval)
+            continue
+        seq = segment_seq(segments[0])
+        yield from _stream_segment(directory, segments[0], follow=follow, poll_interval=poll_interval)
+
+
+def _stream_segment(directory: Path, segment: Path, *, follow: bool, poll_interval: float) -> Iterator[bytes]:
+    seq = segment_seq(segment)
+    with _open_segment(segment) as file:
+        partial = b""
+        while True:
+            chunk = file.read(READ_SIZE)
+            if chunk:
+                data = partial + chunk
+                end = data.rfind(b"\n") + 1
+                yield from _split_lines(data[:end])
+                partial = data[end:]
+                continue
+            # The writer closes a segment before it starts the next one: once that exists, what is left is final
+            if any(segment_seq(newer) > seq for newer in list_segments(directory)):
+                rest = partial + file.read()
+                yield from _split_lines(rest if rest.endswith(b"\n") or not rest else rest + b"\n")
+                return
+            if not follow:
+                return
+            time.sleep(poll_interval)
+
+
+def _open_segment(segment: Path) -> gzip.GzipFile | BinaryIO:
+    if is_compressed(segment):
+        return gzip.open(segment, "rb")
+    try:
+        return segment.open("rb")
+    except FileNotFoundError:
+        # Compressed since it was listed
+        return gzip.open(segment_path(segment.parent, segment_seq(segment), compressed=True), "rb")
+
+
+def _split_lines(data: bytes) -> list[bytes]:
+    # Not `splitlines`, a message may contain carriage returns
+    return [line + b"\n" for line in data.split(b"\n")[:-1]]
+
+
+def _segment_lines(segment: Path, start: int, stop: int | None) -> Iterator[bytes]:
+    """Complete lines of a segment between two offsets in its uncompressed data, `None` for its end."""
+    if is_compressed(segment) or not segment.exists():
+        # A forward seek decompresses and discards, bounded by the segment size
+        with _open_segment(segment) as file:
+            file.seek(start)
+            position = start
+            for line in file:
+                if stop is not None and position >= stop:
+                    return
+                yield line
+                position += len(line)
+        return
+    mapped = _map(segment)
+    if mapped is None:
+        return
+    with mapped:
+        position, stop = start, len(mapped) if stop is None else min(stop, len(mapped))
+        while position < stop:
+            end = mapped.find(b"\n", position, stop)
+            if end == -1:
+                # The writer is in the middle of this line
+                return
+            yield mapped[position : end + 1]
+            position = end + 1
+
+
+def _first_key(segment: Path) -> int:
+    try:
+        with index_path(segment).open("rb") as index:
+            entry = index.read(INDEX_ENTRY.size)
+    except FileNotFoundError:
+        entry = b""
+    # Only a segment that was just created has no index entries, nothing is in it yet
+    return INDEX_ENTRY.unpack(entry)[0] if len(entry) == INDEX_ENTRY.size else 2**63 - 1
+
+
+def _span(segment: Path, start_key: int, end_key: int) -> tuple[int, int | None]:
+    """Offsets of the last index entry before `start_key` and of the first one at or after `end_key`."""
+    index = _map(index_path(segment))
+    if index is None:
+        return 0, None
+    with index:
+        entries = len(index) // INDEX_ENTRY.size
+        if not entries:
+            return 0, None
+
+        def key(entry: int) -> int:
+            return int(INDEX_ENTRY.unpack_from(index, entry * INDEX_ENTRY.size)[0])
+
+        def offset(entry: int) -> int:
+            return int(INDEX_ENTRY.unpack_from(index, entry * INDEX_ENTRY.size)[1])
+
+        first = max(0, bisect.bisect_left(range(entries), start_key, key=key) - 1)
+        last = bisect.bisect_left(range(entries), end_key, key=key)
+        return offset(first), offset(last) if last < entries else None
+
+
+def _map(path: Path) -> mmap.mmap | None:
+    try:
+        with path.open("rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None  # Missing or empty, an empty file cannot be mapped
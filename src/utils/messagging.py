@@ -1,46 +1,251 @@
-import threading
+import asyncio
 import socket
-from typing import Iterator
+import struct
+import threading
+from enum import IntEnum, StrEnum
+from typing import AsyncIterator, Generator, Iterator, NamedTuple
 
-from consts import MESSAGE_DELIMITER
+from consts import DEFAULT_MAX_MESSAGE_SIZE, MESSAGE_DELIMITER
+from models.base import MessageABC
 from types_ import TLogger
 from utils.log import log
-from models.base import MessageABC
 
 
-def send_message(s: socket.socket, message: MessageABC) -> None:
-    msg = f"{message.model_dump_json()}{MESSAGE_DELIMITER}".encode()
-    s.sendall(msg)
+class EFraming(StrEnum):
+    # Newline-delimited JSON, every connection starts with it
+    JSON_LINES = "json_lines"
+    # FRAME_HEADER followed by the frame body, switched to after a NEGOTIATE_FRAMING call
+    BINARY = "binary"
 
 
-def get_messages(
-    s: socket.socket, shutdown_event: threading.Event, logger: TLogger, *, read_bytes: int = 1024
-) -> Iterator[bytes]:
-    try:
-        buffer = b""
-        s.settimeout(1.0)
+class EFrameType(IntEnum):
+    # JSON encoded call or response
+    MESSAGE = 1
+    # Opaque bytes that belong to the message with the same id,
+    # a stream of them ends with a RAW frame without FLAG_MORE (usually an empty one)
+    RAW = 2
+
+
+# More frames of the same message follow
+FLAG_MORE = 0x01
+
+# Body length, frame type, flags, call id (0 if the message has none)
+FRAME_HEADER = struct.Struct("!IBBxxI")
+
+# In order of preference
+SUPPORTED_FRAMINGS = (EFraming.BINARY, EFraming.JSON_LINES)
+
+DELIMITER = MESSAGE_DELIMITER.encode()
+
+# Upper bound for the adaptive read size of a FrameReader
+MAX_READ_SIZE = 64 * 1024
+
+
+class Frame(NamedTuple):
+    type: EFrameType
+    flags: int
+    id: int
+    body: bytes
+
+
+def encode_frame(frame_type: EFrameType, body: bytes, *, id: int = 0, flags: int = 0) -> bytes:
+    return FRAME_HEADER.pack(len(body), frame_type, flags, id) + body
+
+
+def encode_message(message: MessageABC, framing: EFraming = EFraming.JSON_LINES, *, flags: int = 0) -> bytes:
+    body = message.model_dump_json().encode()
+    if framing == EFraming.BINARY:
+        return encode_frame(EFrameType.MESSAGE, body, id=getattr(message, "id", None) or 0, flags=flags)
+    return body + DELIMITER
+
+
+def send_message(
+    s: socket.socket, message: MessageABC, framing: EFraming = EFraming.JSON_LINES, *, flags: int = 0
+) -> None:
+    s.sendall(encode_message(message, framing, flags=flags))
+
+
+async def asend_message(
+    s: socket.socket, message: MessageABC, framing: EFraming = EFraming.JSON_LINES, *, flags: int = 0
+) -> None:
+    await asyncio.get_running_loop().sock_sendall(s, encode_message(message, framing, flags=flags))
+
+
+def send_raw(s: socket.socket, chunk: bytes | memoryview, *, id: int, flags: int = 0) -> None:
+    # Header and body are sent separately so that the chunk is not copied
+    s.sendall(FRAME_HEADER.pack(len(chunk), EFrameType.RAW, flags, id))
+    s.sendall(chunk)
+
+
+async def asend_raw(s: socket.socket, chunk: bytes | memoryview, *, id: int, flags: int = 0) -> None:
+    loop = asyncio.get_running_loop()
+    await loop.sock_sendall(s, FRAME_HEADER.pack(len(chunk), EFrameType.RAW, flags, id))
+    await loop.sock_sendall(s, chunk)
+
+
+class ProtocolError(ValueError):
+    """The peer does not follow the framing, nothing more can be read from the connection."""
+
+
+class MessageTooLargeError(ProtocolError): ...
+
+
+class FrameReader:
+    """Splits the byte stream of a socket into frames.
+
+    Data is received with `recv_into` straight into one reusable `bytearray` that only grows for
+    large messages; every frame body is copied out of it exactly once. The read size adapts to the
+    traffic: it doubles while reads fill it up and halves while they stay mostly empty.
+
+    `framing` may be switched between two frames, e.g. right after a framing negotiation.
+    """
+
+    def __init__(
+        self,
+        s: socket.socket,
+        logger: TLogger,
+        *,
+        framing: EFraming = EFraming.JSON_LINES,
+        read_bytes: int = 1024,
+        max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE,
+    ) -> None:
+        self.framing = framing
+        self._s = s
+        self._logger = logger
+        self._max_message_size = max_message_size
+        self._read_size = read_bytes
+        self._min_read_size = read_bytes
+        self._max_read_size = max(read_bytes, MAX_READ_SIZE)
+        self._buffer = bytearray(2 * read_bytes)
+        # Unconsumed data lives in `_buffer[_start:_end]`, `_scanned` is how far it has been searched for a delimiter
+        self._start = 0
+        self._end = 0
+        self._scanned = 0
+
+    def frames(self, shutdown_event: threading.Event) -> Iterator[Frame]:
+        self._s.settimeout(1.0)
         while not shutdown_event.is_set():
+            view = self._reserve()
             try:
-                data = s.recv(read_bytes)
+                received = self._s.recv_into(view)
             except socket.timeout:
-                logger("Client recv timed out, checking shutdown event...")
+                self._logger("Client recv timed out, checking shutdown event...")
                 continue
+            finally:
+                view.release()
 
-            if not data:
-                logger("Client disconnected")
+            if not received:
+                self._logger("Client disconnected")
                 return
 
-            parts = data.split(MESSAGE_DELIMITER.encode())
-            if len(parts) == 1:  # No newline, the message is incomplete
-                buffer += data
-                continue
-
-            for part in parts[:-1]:
-                buffer += part
-                yield buffer
-                buffer = b""
-            buffer = parts[-1]
+            self._commit(received)
+            yield from self._split()
         log("Stopping message reception due to shutdown event")
+
+    async def aframes(self) -> AsyncIterator[Frame]:
+        """Event-loop counterpart of `frames` for non-blocking sockets.
+
+        There is no receive timeout: the caller cancels the consuming task on shutdown.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            view = self._reserve()
+            try:
+                received = await loop.sock_recv_into(self._s, view)
+            finally:
+                view.release()
+
+            if not received:
+                self._logger("Client disconnected")
+                return
+
+            self._commit(received)
+            for frame in self._split():
+                yield frame
+
+    def _reserve(self) -> memoryview:
+        """Make room for the next read and return a view of the free space."""
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+        if len(self._buffer) - self._end < self._read_size:
+            pending = self._end - self._start
+            if self._start:
+                # Move the incomplete message to the front instead of allocating
+                self._buffer[:pending] = self._buffer[self._start : self._end]
+                self._scanned -= self._start
+                self._start, self._end = 0, pending
+            if len(self._buffer) - self._end < self._read_size:
+                self._buffer.extend(bytes(max(len(self._buffer), self._read_size)))
+        return memoryview(self._buffer)[self._end : self._end + self._read_size]
+
+    def _commit(self, received: int) -> None:
+        self._end += received
+        if received == self._read_size:
+            self._read_size = min(self._read_size * 2, self._max_read_size)
+        elif received < self._read_size // 4:
+            self._read_size = max(self._read_size // 2, self._min_read_size)
+
+    def _split(self) -> Iterator[Frame]:
+        # The framing is re-checked after every frame since the consumer may switch it in between
+        while True:
+            if self.framing == EFraming.BINARY:
+                frame = self._next_binary_frame()
+                if frame is None:
+                    return
+                yield frame
+            elif not (yield from self._split_json_lines()):
+                return
+
+    def _split_json_lines(self) -> Generator[Frame, None, bool]:
+        """Yield every complete line, return whether the framing was switched before the last one."""
+        start = self._start
+        last = self._buffer.rfind(DELIMITER, max(self._scanned, start), self._end)
+        if last == -1:  # No newline, the message is incomplete
+            self._scanned = self._end
+            if self._end - start > self._max_message_size:
+                raise MessageTooLargeError(f"Message exceeds the {self._max_message_size} bytes limit")
+            return False
+
+        # One C-level `split` for all the lines instead of one `find` per message
+        self._start = self._scanned = last + len(DELIMITER)
+        framing = self.framing
+        offset = start
+        for body in bytes(memoryview(self._buffer)[start:last]).split(DELIMITER):
+            offset += len(body) + len(DELIMITER)
+            yield Frame(EFrameType.MESSAGE, 0, 0, body)
+            if self.framing != framing:
+                # The rest of the data has to be split with the new framing
+                self._start = self._scanned = offset
+                return True
+        return False
+
+    def _next_binary_frame(self) -> Frame | None:
+        start = self._start
+        available = self._end - start
+        if available < FRAME_HEADER.size:
+            return None
+        length, frame_type, flags, id_ = FRAME_HEADER.unpack_from(self._buffer, start)
+        type_ = _check_header(length, frame_type, flags, self._max_message_size)
+        body_start = start + FRAME_HEADER.size
+        body_end = body_start + length
+        if body_end > self._end:
+            return None
+        self._start = self._scanned = body_end
+        return Frame(type_, flags, id_, bytes(memoryview(self._buffer)[body_start:body_end]))
+
+
+def get_messages(
+    s: socket.socket,
+    shutdown_event: threading.Event,
+    logger: TLogger,
+    *,
+    read_bytes: int = 1024,
+    max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE,
+) -> Iterator[bytes]:
+    try:
+        reader = FrameReader(s, logger, read_bytes=read_bytes, max_message_size=max_message_size)
+        for frame in reader.frames(shutdown_event):
+            yield frame.body
     except Exception as e:
         log(f"Client error: {e}")
 
@@ -48,4 +253,36 @@ def get_messages(
 def get_one_message(
     s: socket.socket, shutdown_event: threading.Event, logger: TLogger, *, read_bytes: int = 1024
 ) -> bytes:
-    return next(get_messages(s, shutdown_event, logger, read_bytes=read_bytes))
+    for message in get_messages(s, shutdown_event, logger, read_bytes=read_bytes):
+        return message
+    raise ConnectionError("Connection closed before a message was received")
+
+
+async def read_stream_frames(
+    reader: asyncio.StreamReader, framing: EFraming, *, max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE
+) -> AsyncIterator[Frame]:
+    """Frames of an `asyncio` stream until it ends, the stream's `limit` has to fit a JSON line.
+
+    Unlike `FrameReader` the framing is fixed: the stream is only read once the negotiation is over.
+    """
+    try:
+        while True:
+            if framing == EFraming.BINARY:
+                length, frame_type, flags, id_ = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                type_ = _check_header(length, frame_type, flags, max_message_size)
+                yield Frame(type_, flags, id_, await reader.readexactly(length))
+            else:
+                yield Frame(EFrameType.MESSAGE, 0, 0, (await reader.readuntil(DELIMITER))[: -len(DELIMITER)])
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("Connection closed in the middle of a frame") from e
+
+
+def _check_header(length: int, frame_type: int, flags: int, max_message_size: int) -> EFrameType:
+    if length > max_message_size:
+        raise MessageTooLargeError(f"Frame of {length} bytes exceeds the {max_message_size} bytes limit")
+    if frame_type not in EFrameType:
+        raise ProtocolError(f"Unknown frame type {frame_type}")
+    if flags & ~FLAG_MORE:
+        raise ProtocolError(f"Unknown frame flags {flags:#04x}")
+    return EFrameType(frame_type)
@@ -0,0 +1,161 @@
+import bisect
+import math
+import threading
+from typing import Self
+
+from models.common import CallMetrics, LatencyHistogram, ServerMetrics
+
+# Upper bounds of the latency buckets in nanoseconds, 1-2-5 steps from 1us to 10s
+BUCKET_BOUNDS_NS: list[int] = [mantissa * 10**exponent for exponent in range(3, 10) for mantissa in (1, 2, 5)] + [
+    10**10
+]
+
+
+class Histogram:
+    """Nanosecond latencies counted in fixed buckets, not thread safe."""
+
+    __slots__ = ("counts", "max", "total")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKET_BOUNDS_NS) + 1)
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns: int) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_NS, ns)] += 1
+        self.total += ns
+        self.max = max(self.max, ns)
+
+    def add(self, other: Self) -> None:
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def snapshot(self) -> LatencyHistogram:
+        count = sum(self.counts)
+        return LatencyHistogram(
+            count=count,
+            total_us=self.total / 1000,
+            max_us=self.max / 1000,
+            bounds_us=[bound / 1000 for bound in BUCKET_BOUNDS_NS],
+            counts=self.counts,
+            p50_us=self._percentile(0.5, count),
+            p90_us=self._percentile(0.9, count),
+            p99_us=self._percentile(0.99, count),
+        )
+
+    def _percentile(self, fraction: float, count: int) -> float | None:
+        if not count:
+            return None
+        rank = math.ceil(fraction * count)
+        seen = 0
+        for bound, bucket_count in zip(BUCKET_BOUNDS_NS, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self.max) / 1000
+        return self.max / 1000
+
+
+class _CallAccumulator:
+    __slots__ = ("count", "decode", "encode", "errors", "handler")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.decode = Histogram()
+        self.handler = Histogram()
+        self.encode = Histogram()
+
+    def add(self, other: Self) -> None:
+        self.count += other.count
+        self.errors += other.errors
+        self.decode.add(other.decode)
+        self.handler.add(other.handler)
+        self.encode.add(other.encode)
+
+
+class _ThreadAccumulator:
+    def __init__(self) -> None:
+        self.opened = 0
+        self.closed = 0
+        self.invalid = 0
+        self.queue_wait = Histogram()
+        self.calls: dict[str, _CallAccumulator] = {}
+
+
+class MetricsRecorder:
+    """Server metrics accumulated per thread, recording never takes a lock.
+
+    Every thread only updates its own accumulator, the lock is taken once per thread to register it.
+    A snapshot sums the accumulators of all the threads that ever recorded anything.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._accumulators: list[_ThreadAccumulator] = []
+
+    def connection_opened(self) -> None:
+        self._accumulator().opened += 1
+
+    def connection_closed(self) -> None:
+        self._accumulator().closed += 1
+
+    def record_invalid_call(self) -> None:
+        self._accumulator().invalid += 1
+
+    def record_queue_wait(self, ns: int) -> None:
+        self._accumulator().queue_wait.record(ns)
+
+    def record_call(
+        self, call_type: str, *, decode_ns: int, handler_ns: int, encode_ns: int | None, error: bool
+    ) -> None:
+        calls = self._accumulator().calls
+        call = calls.get(call_type)
+        if call is None:
+            call = calls[call_type] = _CallAccumulator()
+        call.count += 1
+        call.errors += error
+        call.decode.record(decode_ns)
+        call.handler.record(handler_ns)
+        if encode_ns is not None:
+            call.encode.record(encode_ns)
+
+    def snapshot(self) -> ServerMetrics:
+        with self._lock:
+            accumulators = list(self._accumulators)
+        opened = closed = invalid = 0
+        queue_wait = Histogram()
+        calls: dict[str, _CallAccumulator] = {}
+        for accumulator in accumulators:
+            opened += accumulator.opened
+            closed += accumulator.closed
+            invalid += accumulator.invalid
+            queue_wait.add(accumulator.queue_wait)
+            # Copied first, the owning thread may add a call type meanwhile
+            for call_type, call in list(accumulator.calls.items()):
+                calls.setdefault(call_type, _CallAccumulator()).add(call)
+        return ServerMetrics(
+            active_connections=opened - closed,
+            total_connections=opened,
+            invalid_calls=invalid,
+            queue_wait=queue_wait.snapshot(),
+            calls={
+                call_type: CallMetrics(
+                    count=call.count,
+                    errors=call.errors,
+                    decode=call.decode.snapshot(),
+                    handler=call.handler.snapshot(),
+                    encode=call.encode.snapshot(),
+                )
+                for call_type, call in sorted(calls.items())
+            },
+        )
+
+    def _accumulator(self) -> _ThreadAccumulator:
+        accumulator: _ThreadAccumulator | None = getattr(self._local, "accumulator", None)
+        if accumulator is None:
+            accumulator = self._local.accumulator = _ThreadAccumulator()
+            with self._lock:
+                self._accumulators.append(accumulator)
+        return accumulator
@@ -1,24 +1,146 @@
+import threading
+import time
+from collections.abc import Callable
+
 from mss import mss
 from mss.base import MSSBase
+from mss.exception import ScreenShotError
 from mss.models import Monitor
+from mss.screenshot import ScreenShot
+
+from models.common import EPixelFormat, MonitorParams, RegionFrame
+
+# How long the main monitor geometry is trusted before the displays are enumerated again
+MONITOR_GEOMETRY_TTL = 5.0
+
+# Size of the chunks a captured region is streamed in
+REGION_CHUNK_SIZE = 256 * 1024
 
-from models.common import MonitorParams
+# One long-lived capture session per thread, mss sessions must not be shared between threads
+_sessions = threading.local()
+
+_geometry_lock = threading.Lock()
+_geometry: Monitor | None = None
+_geometry_expires_at = 0.0
+# Bumped whenever the geometry changes, sessions opened for an older generation are reopened
+_geometry_generation = 0
 
 
 def get_main_monitor_params() -> MonitorParams:
-    with mss() as sct:
-        main_monitor = _get_main_monitor(sct)
-        return MonitorParams(width=main_monitor["width"], height=main_monitor["height"])
+    main_monitor = _get_main_monitor_geometry()
+    return MonitorParams(width=main_monitor["width"], height=main_monitor["height"])
 
 
 def get_main_monitor_pixel_color(*, x: int, y: int) -> str:
-    with mss() as sct:
-        main_monitor = _get_main_monitor(sct)
-        r, g, b = sct.grab(main_monitor).pixel(x, y)
+    main_monitor = _get_main_monitor_geometry()
+    _check_bounds(main_monitor, x=x, y=y)
+    # Grab only the requested pixel, the cost no longer depends on the screen resolution
+    shot = _grab({"left": main_monitor["left"] + x, "top": main_monitor["top"] + y, "width": 1, "height": 1})
+    r, g, b = shot.pixel(0, 0)
 
     return _rgb2hex(r=r, g=g, b=b)
 
 
+def get_main_monitor_pixel_colors(points: list[tuple[int, int]]) -> list[int]:
+    main_monitor = _get_main_monitor_geometry()
+    for x, y in points:
+        _check_bounds(main_monitor, x=x, y=y)
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    left, top = min(xs), min(ys)
+    width, height = max(xs) - left + 1, max(ys) - top + 1
+    # One grab of the bounding box for all the points
+    shot = _grab(
+        {"left": main_monitor["left"] + left, "top": main_monitor["top"] + top, "width": width, "height": height}
+    )
+    # Read as native (little-endian) 32-bit words, a BGRA pixel is 0xAARRGGBB: masking the alpha leaves 0xRRGGBB
+    pixels = memoryview(shot.raw).cast("I")
+    return [pixels[(y - top) * width + x - left] & 0xFFFFFF for x, y in points]
+
+
+def capture_main_monitor_region(
+    allocate: Callable[[int], memoryview], *, x: int, y: int, width: int, height: int, pixel_format: EPixelFormat
+) -> RegionFrame:
+    """Grab a region and write its pixels, converted to `pixel_format`, into a buffer from `allocate`."""
+    main_monitor = _get_main_monitor_geometry()
+    _check_bounds(main_monitor, x=x, y=y)
+    _check_bounds(main_monitor, x=x + width - 1, y=y + height - 1)
+    shot = _grab({"left": main_monitor["left"] + x, "top": main_monitor["top"] + y, "width": width, "height": height})
+    bytes_per_pixel = 4 if pixel_format == EPixelFormat.BGRA else 3
+    frame = RegionFrame(width=width, height=height, pixel_format=pixel_format, size=width * height * bytes_per_pixel)
+    out = allocate(frame.size)
+    if pixel_format == EPixelFormat.BGRA:
+        out[:] = shot.raw
+    else:
+        _bgra2rgb_into(memoryview(shot.raw), out)
+    return frame
+
+
+def capture_main_monitor() -> tuple[bytearray, int, int]:
+    """Grab the whole main monitor, return its raw BGRA pixels with the width and height."""
+    main_monitor = _get_main_monitor_geometry()
+    shot = _grab(main_monitor)
+    return shot.raw, shot.width, shot.height
+
+
+def bgra2rgb(bgra: bytes | bytearray | memoryview) -> memoryview:
+    rgb = memoryview(bytearray(len(bgra) // 4 * 3))
+    _bgra2rgb_into(memoryview(bgra), rgb)
+    return rgb
+
+
+def invalidate_monitor_geometry() -> None:
+    global _geometry, _geometry_generation
+    with _geometry_lock:
+        _geometry = None
+        _geometry_generation += 1
+
+
+def _get_main_monitor_geometry() -> Monitor:
+    global _geometry, _geometry_expires_at, _geometry_generation
+    with _geometry_lock:
+        if _geometry is None or time.monotonic() >= _geometry_expires_at:
+            # A fresh session, an open one caches the monitors it enumerated at start
+            with mss() as sct:
+                main_monitor = dict(_get_main_monitor(sct))
+            if _geometry is not None and main_monitor != _geometry:
+                _geometry_generation += 1
+            _geometry = main_monitor
+            _geometry_expires_at = time.monotonic() + MONITOR_GEOMETRY_TTL
+        return _geometry
+
+
+def _get_session() -> MSSBase:
+    sct: MSSBase | None = getattr(_sessions, "sct", None)
+    if sct is None or _sessions.generation != _geometry_generation:
+        if sct is not None:
+            sct.close()
+        sct = mss()
+        _sessions.sct = sct
+        _sessions.generation = _geometry_generation
+    return sct
+
+
+def _grab(region: Monitor) -> ScreenShot:
+    try:
+        return _get_session().grab(region)
+    except ScreenShotError:
+        # Most likely the display configuration changed under the session, retry once with a fresh one
+        invalidate_monitor_geometry()
+        return _get_session().grab(region)
+
+
+def _bgra2rgb_into(bgra: memoryview, rgb: memoryview) -> None:
+    rgb[0::3] = bgra[2::4]
+    rgb[1::3] = bgra[1::4]
+    rgb[2::3] = bgra[0::4]
+
+
+def _check_bounds(monitor: Monitor, *, x: int, y: int) -> None:
+    if not (0 <= x < monitor["width"] and 0 <= y < monitor["height"]):
+        raise ValueError(f"Pixel ({x}, {y}) is outside of the {monitor['width']}x{monitor['height']} main monitor")
+
+
 def _get_main_monitor(sct: MSSBase) -> Monitor:
     try:
         return sct.monitors[1]  # 0 stands for all monitors, 1 for the main monitor
@@ -0,0 +1,200 @@
+import multiprocessing
+import os
+import signal
+import threading
+import weakref
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Connection, wait
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.synchronize import Barrier
+from typing import Any, Concatenate
+
+# Handed to an offloaded function: returns a writable buffer of the given size, at most once per call
+type TAllocate = Callable[[int], memoryview]
+
+
+class Output:
+    """The buffer an offloaded function allocated and filled, released by `close` or once garbage collected."""
+
+    def __init__(self, view: memoryview, release: Callable[[], None] | None = None) -> None:
+        self._view = view
+        self._finalizer = weakref.finalize(self, _release, view, release)
+
+    def __len__(self) -> int:
+        return len(self._view)
+
+    def chunks(self, chunk_size: int) -> Iterator[memoryview]:
+        """The buffer in chunks of `chunk_size` bytes, closed once they are all consumed.
+
+        A chunk is only valid until the next one is requested, so that nothing keeps the buffer from being released.
+        """
+        try:
+            for offset in range(0, len(self._view), chunk_size):
+                chunk = self._view[offset : offset + chunk_size]
+                try:
+                    yield chunk
+                finally:
+                    chunk.release()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._finalizer()
+
+
+class ProcessPool:
+    """Worker processes for CPU-bound functions, which the GIL would serialize in threads.
+
+    Functions and their arguments are pickled to the workers. Their results are pickled back too, so they should
+    stay small: the bulk of the output is written into the buffer the function allocates, which is shared memory
+    that the caller reads in place.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self._workers = workers
+        self._context = multiprocessing.get_context("forkserver")
+        # Only written by this process: the workers see it closed once the process is gone, however it ended
+        self._owner_alive, self._alive = self._context.Pipe(duplex=False)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def warm_up(self, timeout: float = 30) -> list[int]:
+        """Start all the workers now rather than on the first calls, returns their pids.
+
+        Every warm-up call waits for the others, so that each is run by a worker of its own.
+        """
+        # Only handed to workers as they are started, hence a new executor
+        started = self._context.Barrier(self._workers)
+        with self._lock:
+            executor, self._executor = self._executor, self._new_executor(started)
+        executor.shutdown(wait=False)
+        futures = [self._executor.submit(_warm_up, timeout) for _ in range(self._workers)]
+        return [future.result() for future in futures]
+
+    def run[**P, R](
+        self, fn: Callable[Concatenate[TAllocate, P], R], *args: P.args, **kwargs: P.kwargs
+    ) -> tuple[R, Output | None]:
+        """Call `fn(allocate, *args, **kwargs)` in a worker, returns its result and the buffer it allocated."""
+        executor = self._executor
+        try:
+            result, name, size = executor.submit(_run_shared, fn, args, kwargs).result()
+        except BrokenProcessPool:
+            # A worker died (killed, out of memory...) and took the pool down with it, the next calls get a new one
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._new_executor()
+            executor.shutdown(wait=False)
+            raise
+        if name is None:
+            return result, None
+        # Tracked from here on: if the server dies before the output is closed, the block is still removed
+        shm = SharedMemory(name)
+        return result, Output(_buffer(shm)[:size], lambda: _unlink(shm))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._alive.close()
+        self._owner_alive.close()
+
+    def _new_executor(self, started: Barrier | None = None) -> ProcessPoolExecutor:
+        # Not forked: the server already runs threads that hold locks
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(started, self._owner_alive),
+        )
+
+
+def run_here[**P, R](
+    fn: Callable[Concatenate[TAllocate, P], R], *args: P.args, **kwargs: P.kwargs
+) -> tuple[R, Output | None]:
+    """`ProcessPool.run` in the calling thread, the buffer is plain memory."""
+    buffers: list[memoryview] = []
+
+    def allocate(size: int) -> memoryview:
+        if buffers:
+            raise RuntimeError("The output is already allocated")
+        buffers.append(memoryview(bytearray(size)))
+        return buffers[0]
+
+    result = fn(allocate, *args, **kwargs)
+    return result, Output(buffers[0]) if buffers else None
+
+
+_started: Barrier | None = None
+
+
+def _init_worker(started: Barrier | None, owner_alive: Connection) -> None:
+    global _started
+    # Signals are handled by the server, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _started = started
+    # Waiting for calls, a worker would outlive a server that was killed and never shut the pool down
+    threading.Thread(target=_exit_with_owner, args=(owner_alive,), name="owner-watch", daemon=True).start()
+
+
+def _exit_with_owner(owner_alive: Connection) -> None:
+    wait([owner_alive])
+    os._exit(1)
+
+
+def _warm_up(timeout: float) -> int:
+    if _started is not None:
+        _started.wait(timeout)
+    return os.getpid()
+
+
+def _run_shared(fn: Callable[..., Any], args: tuple[Any, ...], kwargs: dict[str, Any]) -> tuple[Any, str | None, int]:
+    blocks: list[tuple[SharedMemory, memoryview]] = []
+
+    def allocate(size: int) -> memoryview:
+        if blocks:
+            raise RuntimeError("The output is already allocated")
+        # Not tracked here, the caller takes the block over
+        shm = SharedMemory(create=True, size=max(size, 1), track=False)
+        blocks.append((shm, _buffer(shm)[:size]))
+        return blocks[0][1]
+
+    try:
+        result = fn(allocate, *args, **kwargs)
+    except BaseException:
+        for shm, view in blocks:
+            view.release()
+            shm.unlink()
+        raise
+    if not blocks:
+        return result, None, 0
+    shm, view = blocks[0]
+    size = len(view)
+    view.release()
+    try:
+        shm.close()
+    except BufferError:
+        shm.unlink()
+        raise RuntimeError(f"{fn.__name__} kept a reference to its output")
+    return result, shm.name, size
+
+
+def _buffer(shm: SharedMemory) -> memoryview:
+    buffer = shm.buf
+    if buffer is None:
+        raise ValueError(f"Shared memory {shm.name} is closed")
+    return buffer
+
+
+def _unlink(shm: SharedMemory) -> None:
+    shm.close()
+    shm.unlink()
+
+
+def _release(view: memoryview, release: Callable[[], None] | None) -> None:
+    view.release()
+    if release is not None:
+        release()
@@ -0,0 +1,133 @@
+import os
+import select
+import signal
+import sys
+import time
+import traceback
+from collections.abc import Callable
+from typing import NoReturn
+
+from utils.log import PipeLogger
+
+# Signals that stop the workers, passed on to them by the master
+SHUTDOWN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+# A worker that exits sooner than that after it was started is restarted only once that long is over,
+# so that one failing at startup does not keep the master forking
+MIN_WORKER_UPTIME = 1.0
+
+
+def run_workers(count: int, serve: Callable[[int], None], logger: PipeLogger, *, shutdown_timeout: float = 10) -> None:
+    """Fork `count` workers that run `serve(index)` and restart the ones that exit, until SIGINT or SIGTERM.
+
+    The signal is passed on to the workers as SIGTERM; the ones still running `shutdown_timeout` seconds later
+    are killed. Whatever the workers share (e.g. a listening socket) is set up before, they inherit it.
+    Call it from the main thread of a process that runs no other threads, `logger` included.
+    """
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_write, False)
+    # The handlers do nothing, the signals are read from the wakeup pipe: none is missed between two waits
+    signal.set_wakeup_fd(wakeup_write)
+    for signum in (*SHUTDOWN_SIGNALS, signal.SIGCHLD):
+        signal.signal(signum, _ignore_signal)
+
+    # pid -> (index, monotonic time it was started at)
+    workers: dict[int, tuple[int, float]] = {}
+    # index -> monotonic time it is restarted at
+    restarts: dict[int, float] = {}
+
+    def start(index: int) -> None:
+        # Or the worker would write what is buffered again
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(wakeup_read)
+            os.close(wakeup_write)
+            _run_worker(serve, index)
+        workers[pid] = (index, time.monotonic())
+
+    for index in range(count):
+        start(index)
+    logger(f"Started {count} worker processes: {list(workers)}")
+
+    stopping = False
+    # Monotonic time the workers are killed at, once they have been asked to stop
+    deadline: float | None = None
+    try:
+        while workers or restarts:
+            wake_at = min(restarts.values()) if restarts else deadline
+            timeout = None if wake_at is None else max(0.0, wake_at - time.monotonic())
+            readable, _, _ = select.select([wakeup_read], [], [], timeout)
+            signums = os.read(wakeup_read, 64) if readable else b""
+
+            for received in signums:
+                if received in SHUTDOWN_SIGNALS and not stopping:
+                    logger(f"Received shutdown signal {received}, stopping the workers...")
+                    stopping = True
+                    deadline = time.monotonic() + shutdown_timeout
+                    restarts.clear()
+                    _signal_all(workers, signal.SIGTERM)
+
+            while workers:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if not pid:
+                    break
+                index, started_at = workers.pop(pid)
+                if stopping:
+                    continue
+                uptime = time.monotonic() - started_at
+                logger.warning(
+                    "Worker %d (pid %d) exited with code %d after %.1fs, restarting it",
+                    index,
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                    uptime,
+                )
+                restarts[index] = started_at + MIN_WORKER_UPTIME
+
+            if stopping:
+                if workers and deadline is not None and time.monotonic() >= deadline:
+                    logger.warning("Workers %s did not stop in %ss, killing them", list(workers), shutdown_timeout)
+                    _signal_all(workers, signal.SIGKILL)
+                    deadline = None
+                continue
+            now = time.monotonic()
+            for index, restart_at in list(restarts.items()):
+                if restart_at <= now:
+                    del restarts[index]
+                    start(index)
+    finally:
+        signal.set_wakeup_fd(-1)
+        os.close(wakeup_read)
+        os.close(wakeup_write)
+    logger("All the workers have been stopped")
+
+
+def _run_worker(serve: Callable[[int], None], index: int) -> NoReturn:
+    signal.set_wakeup_fd(-1)
+    for signum in (*SHUTDOWN_SIGNALS, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    code = 1
+    try:
+        serve(index)
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    finally:
+        # Not a normal exit: the cleanups and exit handlers inherited from the master are not the worker's to run,
+        # nor is the rest of its stack. Whatever stops `serve` (e.g. KeyboardInterrupt) ends the worker with code 1
+        if isinstance(error := sys.exception(), Exception):
+            traceback.print_exception(error)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _signal_all(workers: dict[int, tuple[int, float]], signum: int) -> None:
+    for pid in workers:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass  # Exited already, reaped with the others
+
+
+def _ignore_signal(_signum: int, _frame: object) -> None: ...